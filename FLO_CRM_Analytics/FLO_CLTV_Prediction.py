@@ -34,13 +34,24 @@ import pandas as pd
 import datetime as dt
 from lifetimes import BetaGeoFitter
 from lifetimes import GammaGammaFitter
+from helpers.backends import flo_table
+from helpers.bgnbd import BGNBDFitter
+from helpers.bootstrap import bootstrap_cltv
+from helpers.cltv import customer_lifetime_value_horizons
+from helpers.flo import read_flo
+from helpers.lifetimes_fit import fit_bgf_compressed, fit_ggf_compressed
+from helpers.model_registry import ModelRegistry, fit_with_registry
+from helpers.partitioned import fit_partitioned
+from helpers.profiling import NULL_PROFILER
+from helpers.winsorize import winsorizer_from_registry
 from sklearn.preprocessing import MinMaxScaler
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
 pd.set_option('display.float_format', lambda x: '%.3f' % x)
 pd.options.mode.chained_assignment = None
 
-df_ = pd.read_csv("datasets/flo_data_20k.csv")
+# typed schema (dates, categorical channels, int32 counts), cached as Parquet (helpers/flo.py)
+df_ = read_flo("datasets/flo_data_20k.csv")
 df = df_.copy()
 df.head()
 
@@ -91,8 +102,8 @@ analysis_date = dt.datetime(2021,6,1)
 
 cltv_df = pd.DataFrame()
 cltv_df["cutomer_id"] = df["master_id"]
-cltv_df["recency_cltv_weekly"] = ((df["last_order_date"] - df["first_order_date"]).astype('timedelta64[D]')) / 7
-cltv_df["T_weekly"] = ((analysis_date - df["first_order_date"]).astype('timedelta64[D]')) / 7
+cltv_df["recency_cltv_weekly"] = (df["last_order_date"] - df["first_order_date"]).dt.days / 7
+cltv_df["T_weekly"] = (analysis_date - df["first_order_date"]).dt.days / 7
 cltv_df["frequency"] = df["order_num_total"]
 cltv_df["monetary_cltv_avg"] = df["customer_value_total"] / df["order_num_total"]
 
@@ -169,68 +180,146 @@ cltv_df.head(20)
 
 # # Function for whole CLTV prediction process to improve functionality
 
-def create_cltv_df(dataframe):
-
-    # Veriyi Hazırlama
+def create_cltv_df(dataframe, registry=None, refit=True, bootstrap=0, n_jobs=None, profiler=None, backend="pandas"):
+    # profiler: per-stage wall time, rows and memory (helpers/profiling.py, StageProfiler)
+    # backend: "pandas", "polars" or "duckdb" (helpers/backends.py); with polars / duckdb the thresholds,
+    # the totals and the filter run in that engine (dataframe may also be a Parquet path) and only the
+    # columns of the CLTV frame come back to pandas
+    profiler = (profiler or NULL_PROFILER).for_pipeline("create_cltv_df")
     columns = ["order_num_total_ever_online", "order_num_total_ever_offline", "customer_value_total_ever_offline","customer_value_total_ever_online"]
-    for col in columns:
-        replace_with_thresholds(dataframe, col)
 
-    dataframe["order_num_total"] = dataframe["order_num_total_ever_online"] + dataframe["order_num_total_ever_offline"]
-    dataframe["customer_value_total"] = dataframe["customer_value_total_ever_offline"] + dataframe["customer_value_total_ever_online"]
-    dataframe = dataframe[~(dataframe["customer_value_total"] == 0) | (dataframe["order_num_total"] == 0)]
-    date_columns = dataframe.columns[dataframe.columns.str.contains("date")]
-    dataframe[date_columns] = dataframe[date_columns].apply(pd.to_datetime)
+    # Veriyi Hazırlama
+    if backend != "pandas":
+        with profiler.stage("data_prep", None if isinstance(dataframe, str) else dataframe) as stage:
+            # the limits come from the engine's quantiles; storing / loading them is the same as below
+            dataframe, winsorizer = flo_table(dataframe, backend,
+                                              winsorizer=lambda quantiles: winsorizer_from_registry(
+                                                  registry, "thresholds", None, columns, refit=refit,
+                                                  quantiles=quantiles, sides="both", round_limits=True))
+            stage.annotate(backend=backend)
+            stage.output(dataframe)
+    else:
+        # the limits of all four columns are fitted in one call and capped in one pass (helpers/winsorize.py);
+        # with a registry they are stored next to the models and refit=False reuses the training limits
+        with profiler.stage("replace_with_thresholds", dataframe) as stage:
+            winsorizer = winsorizer_from_registry(registry, "thresholds", dataframe, columns, refit=refit,
+                                                  sides="both", round_limits=True)
+            winsorizer.transform(dataframe)
+            stage.output(dataframe)
+
+        with profiler.stage("data_prep", dataframe) as stage:
+            dataframe["order_num_total"] = dataframe["order_num_total_ever_online"] + dataframe["order_num_total_ever_offline"]
+            dataframe["customer_value_total"] = dataframe["customer_value_total_ever_offline"] + dataframe["customer_value_total_ever_online"]
+            dataframe = dataframe[~(dataframe["customer_value_total"] == 0) | (dataframe["order_num_total"] == 0)]
+            date_columns = dataframe.columns[dataframe.columns.str.contains("date")]
+            dataframe[date_columns] = dataframe[date_columns].apply(pd.to_datetime)
+            stage.output(dataframe)
 
     # CLTV veri yapısının oluşturulması
-    dataframe["last_order_date"].max()  # 2021-05-30
-    analysis_date = dt.datetime(2021, 6, 1)
-    cltv_df = pd.DataFrame()
-    cltv_df["customer_id"] = dataframe["master_id"]
-    cltv_df["recency_cltv_weekly"] = ((dataframe["last_order_date"] - dataframe["first_order_date"]).astype('timedelta64[D]')) / 7
-    cltv_df["T_weekly"] = ((analysis_date - dataframe["first_order_date"]).astype('timedelta64[D]')) / 7
-    cltv_df["frequency"] = dataframe["order_num_total"]
-    cltv_df["monetary_cltv_avg"] = dataframe["customer_value_total"] / dataframe["order_num_total"]
-    cltv_df = cltv_df[(cltv_df['frequency'] > 1)]
+    with profiler.stage("cltv_frame", dataframe) as stage:
+        dataframe["last_order_date"].max()  # 2021-05-30
+        analysis_date = dt.datetime(2021, 6, 1)
+        cltv_df = pd.DataFrame()
+        cltv_df["customer_id"] = dataframe["master_id"]
+        cltv_df["recency_cltv_weekly"] = (dataframe["last_order_date"] - dataframe["first_order_date"]).dt.days / 7
+        cltv_df["T_weekly"] = (analysis_date - dataframe["first_order_date"]).dt.days / 7
+        cltv_df["frequency"] = dataframe["order_num_total"]
+        cltv_df["monetary_cltv_avg"] = dataframe["customer_value_total"] / dataframe["order_num_total"]
+        cltv_df = cltv_df[(cltv_df['frequency'] > 1)]
+        stage.output(cltv_df)
 
     # BG-NBD Modelinin Kurulması
-    bgf = BetaGeoFitter(penalizer_coef=0.001)
-    bgf.fit(cltv_df['frequency'],
-            cltv_df['recency_cltv_weekly'],
-            cltv_df['T_weekly'])
-    cltv_df["exp_sales_3_month"] = bgf.predict(4 * 3,
-                                               cltv_df['frequency'],
-                                               cltv_df['recency_cltv_weekly'],
-                                               cltv_df['T_weekly'])
-    cltv_df["exp_sales_6_month"] = bgf.predict(4 * 6,
-                                               cltv_df['frequency'],
-                                               cltv_df['recency_cltv_weekly'],
-                                               cltv_df['T_weekly'])
+    # fit on the unique (frequency, recency, T) triples weighted by their counts; same parameters, fewer rows
+    # with a registry the fit starts from the stored parameters; refit=False only loads them for scoring
+    with profiler.stage("bgnbd_fit", cltv_df):
+        bgf = BGNBDFitter(penalizer_coef=0.001)
+        fit_with_registry(registry, "bgnbd", bgf, fit_bgf_compressed,
+                          cltv_df['frequency'],
+                          cltv_df['recency_cltv_weekly'],
+                          cltv_df['T_weekly'],
+                          analysis_date=analysis_date, refit=refit)
+    # both horizons in one pass: customer terms once, hypergeometric term once per (frequency, T) pair
+    with profiler.stage("bgnbd_predict", cltv_df) as stage:
+        expected = bgf.predict_horizons([4 * 3, 4 * 6],
+                                        cltv_df['frequency'],
+                                        cltv_df['recency_cltv_weekly'],
+                                        cltv_df['T_weekly'])
+        cltv_df["exp_sales_3_month"] = expected[4 * 3]
+        cltv_df["exp_sales_6_month"] = expected[4 * 6]
+        stage.output(expected)
 
     # # Gamma-Gamma Modelinin Kurulması
-    ggf = GammaGammaFitter(penalizer_coef=0.01)
-    ggf.fit(cltv_df['frequency'], cltv_df['monetary_cltv_avg'])
-    cltv_df["exp_average_value"] = ggf.conditional_expected_average_profit(cltv_df['frequency'],
-                                                                           cltv_df['monetary_cltv_avg'])
+    with profiler.stage("gamma_gamma_fit", cltv_df):
+        ggf = GammaGammaFitter(penalizer_coef=0.01)
+        fit_with_registry(registry, "gamma_gamma", ggf, fit_ggf_compressed,
+                          cltv_df['frequency'],
+                          cltv_df['monetary_cltv_avg'],
+                          analysis_date=analysis_date, refit=refit)
+        cltv_df["exp_average_value"] = ggf.conditional_expected_average_profit(cltv_df['frequency'],
+                                                                               cltv_df['monetary_cltv_avg'])
 
     # Cltv tahmini
-    cltv = ggf.customer_lifetime_value(bgf,
-                                       cltv_df['frequency'],
-                                       cltv_df['recency_cltv_weekly'],
-                                       cltv_df['T_weekly'],
-                                       cltv_df['monetary_cltv_avg'],
-                                       time=6,
-                                       freq="W",
-                                       discount_rate=0.01)
-    cltv_df["cltv"] = cltv
+    with profiler.stage("customer_lifetime_value", cltv_df) as stage:
+        cltv = customer_lifetime_value_horizons(bgf,
+                                                ggf,
+                                                cltv_df['frequency'],
+                                                cltv_df['recency_cltv_weekly'],
+                                                cltv_df['T_weekly'],
+                                                cltv_df['monetary_cltv_avg'],
+                                                times=[6],
+                                                freq="W",
+                                                discount_rate=0.01)
+        cltv_df["cltv"] = cltv[6]
+        stage.output(cltv)
 
     # CLTV segmentleme
-    cltv_df["cltv_segment"] = pd.qcut(cltv_df["cltv"], 4, labels=["D", "C", "B", "A"])
+    with profiler.stage("segment", cltv_df) as stage:
+        cltv_df["cltv_segment"] = pd.qcut(cltv_df["cltv"], 4, labels=["D", "C", "B", "A"])
+        stage.output(cltv_df)
+
+    if bootstrap:
+        # bootstrap intervals: refits on weighted resamples of the customer table, percentiles per customer
+        # (added to cltv_df) and of the segment totals (cltv_df.attrs["segment_intervals"]); the return type
+        # stays a DataFrame
+        with profiler.stage("bootstrap", cltv_df):
+            intervals, segment_intervals = bootstrap_cltv(bgf,
+                                                          ggf,
+                                                          cltv_df['frequency'],
+                                                          cltv_df['recency_cltv_weekly'],
+                                                          cltv_df['T_weekly'],
+                                                          cltv_df['monetary_cltv_avg'],
+                                                          segments=cltv_df["cltv_segment"],
+                                                          n_boot=bootstrap,
+                                                          time=6,
+                                                          freq="W",
+                                                          discount_rate=0.01,
+                                                          n_jobs=n_jobs)
+        cltv_df = pd.concat([cltv_df, intervals], axis=1)
+        cltv_df.attrs["segment_intervals"] = segment_intervals
 
     return cltv_df
 
 cltv_df = create_cltv_df(df)
 
+# Daily runs: fitted parameters are kept on disk, refits start from them and scoring-only jobs just load them
+# registry = ModelRegistry("models/flo_cltv")
+# cltv_df = create_cltv_df(df_.copy(), registry=registry)
+# cltv_df = create_cltv_df(df_.copy(), registry=registry, refit=False)
+
+# 5% / 50% / 95% intervals from 200 bootstrap refits, per customer and per segment total
+# cltv_df_ci = create_cltv_df(df_.copy(), bootstrap=200)
+# cltv_df_ci.attrs["segment_intervals"]
+
+# One BG-NBD / Gamma-Gamma pair per order channel, fitted in parallel worker processes;
+# channels with fewer than 1000 customers fall back to the model fitted on all customers
+channel_cltv, channel_models = fit_partitioned(cltv_df,
+                                               by=df["order_channel"],
+                                               min_size=1000,
+                                               recency_col="recency_cltv_weekly",
+                                               T_col="T_weekly",
+                                               monetary_col="monetary_cltv_avg")
+channel_cltv.groupby("partition")[6].agg(["mean", "sum", "count"])
+
 
 cltv_df.head(10)
 
@@ -12,12 +12,17 @@
 
 import pandas as pd
 import datetime as dt
+from helpers.audience import AudienceIndex
+from helpers.export import export_many
+from helpers.flo import read_flo
+from helpers.rfm import segment_from_scores
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
 pd.set_option('display.float_format', lambda x: '%.2f' % x)
 pd.set_option('display.width',1000)
 
-df_ = pd.read_csv("datasets/flo_data_20k.csv")
+# typed schema (dates, categorical channels, int32 counts, category bitmask), cached as Parquet (helpers/flo.py)
+df_ = read_flo("datasets/flo_data_20k.csv")
 df = df_.copy()
 
 df.head()
@@ -124,7 +129,10 @@ seg_map = {
     r'5[4-5]': 'champions'
 }
 
-rfm['segment'] = rfm['RF_SCORE'].replace(seg_map, regex=True)
+# seg_map is compiled once into a 5x5 (recency_score, frequency_score) lookup table, so segments come out
+# of a single vectorized gather as a categorical column instead of regex passes over RF_SCORE strings.
+
+rfm['segment'] = segment_from_scores(rfm['recency_score'], rfm['frequency_score'], seg_map)
 
 rfm.head()
 
@@ -158,19 +166,31 @@ rfm[["segment", "recency", "frequency", "monetary"]].groupby("segment").agg(["me
 #Save as
 
 rfm = rfm.reset_index()
-rfm = rfm.merge(df[["master_id", "interested_in_categories_12"]], how = 'left')
+rfm = rfm.merge(df[["master_id", "interested_in_categories_12", "interested_in_categories_mask",
+                    "order_channel", "last_order_channel"]], how = 'left')
 rfm.head()
 rfm.shape
 
-woman_cat_loyal_or_champion_customers = rfm.loc[(rfm["segment"] == "champions") | (rfm["segment"] == "loyal_customers") & (rfm["interested_in_categories_12"].str.contains("KADIN")),["master_id"]]
+# One bitmap per segment, channel and interest category over the customers (helpers/audience.py);
+# every campaign list is a filter over these bitmaps instead of a new scan of the table.
+audience = AudienceIndex.from_frame(rfm, columns=["segment", "order_channel", "last_order_channel"],
+                                    categories=df_.attrs["interested_in_categories"])
+
+# AND binds tighter than OR, as & and | did in the original mask: every champion, and the loyal customers with KADIN
+woman_cat_loyal_or_champion_customers = rfm.loc[audience.mask(
+    "segment = champions OR (segment = loyal_customers AND category has KADIN)"), ["master_id"]]
 woman_cat_loyal_or_champion_customers.shape
 woman_cat_loyal_or_champion_customers.head()
 
-woman_cat_loyal_or_champion_customers["master_id"].to_csv("woman_cat_loyal_or_champion_customers_masterid.csv")
 
 #b.Nearly 40% discount is planned for Men's and Children's products. Previously interested in categories related to this discount
 #good customers but not to be lost customers who have not shopped for a long time, those who are asleep and new customers
 #want to be specifically targeted. Save the ids of the customers in the appropriate profile to the csv file.
 
-man_and_child_cat_cant_loose_or_about_to_sleep_customers = rfm.loc[(rfm["segment"] == "cant_loose") | (rfm["segment"] == "about_to_sleep") & (rfm["interested_in_categories_12"].str.contains("ERKEK")) | (rfm["interested_in_categories_12"].str.contains("COCUK"))]
-man_and_child_cat_cant_loose_or_about_to_sleep_customers["master_id"].to_csv("man_and_child_cat_cant_loose_or_about_to_sleep_customers_masterid.csv")
\ No newline at end of file
+# same grouping as the original mask: every cant_loose customer, about_to_sleep with ERKEK, and anyone with COCUK
+man_and_child_cat_cant_loose_or_about_to_sleep_customers = rfm.loc[audience.mask(
+    "segment = cant_loose OR (segment = about_to_sleep AND category has ERKEK) OR category has COCUK"), ["master_id"]]
+# both campaign lists are written in parallel (helpers/export.py)
+export_many({"woman_cat_loyal_or_champion_customers_masterid.csv": woman_cat_loyal_or_champion_customers["master_id"],
+             "man_and_child_cat_cant_loose_or_about_to_sleep_customers_masterid.csv":
+                 man_and_child_cat_cant_loose_or_about_to_sleep_customers["master_id"]})
\ No newline at end of file
@@ -29,38 +29,36 @@ Country Country name
 import pandas as pd
 import datetime as dt
 import matplotlib.pyplot as plt
-from lifetimes import BetaGeoFitter
 from lifetimes import GammaGammaFitter
 from lifetimes.plotting import plot_period_transactions
+from helpers.bgnbd import BGNBDFitter
+from helpers.cltv import customer_lifetime_value_horizons
+from helpers.ingest import read_excel_cached
+from helpers.model_registry import initial_params_from
+from helpers.partitioned import fit_partitioned
+from helpers.schema import compact_transactions
+from helpers.winsorize import Winsorizer
 pd.set_option("display.max_columns", None)
 pd.set_option("display.width", 500)
 pd.set_option("display.float_format", lambda x: "%.4f" % x)
 
-df_ = pd.read_excel("dataset/online_retail_II.xlsx", sheet_name="Year 2010-2011")
+# int32 invoice numbers + InvoicePrefix (C / A letter) + is_cancelled, categorical text columns,
+# int32 IDs and quantities (helpers/schema.py)
+df_ = compact_transactions(read_excel_cached("dataset/online_retail_II.xlsx", sheet_name="Year 2010-2011"))
 df = df_.copy()
 df.head()
 df.info()
 df.describe().T
-df = df[~df["Invoice"].str.startswith("C", na=False)]
+# cancellations are in is_cancelled of the compact schema (Invoice is the int32 invoice number)
+df = df[~df["is_cancelled"]]
 df = df[df["Quantity"] > 1]
 df = df[df["Price"] > 0]
 df["TotalPrice"] = df["Quantity"] * df["Price"]
 
-def outlier_threshold(dataframe, variable):
-    q1 = dataframe[variable].quantile(0.01)
-    q3 = dataframe[variable].quantile(0.99)
-    iqr = q3 - q1
-    up_limit = q3 + 1.5 * iqr
-    low_limit = q1 - 1.5 * iqr
-    return low_limit, up_limit
-
-def replace_with_thresholds(dataframe, variable):
-    low_limit, up_limit = outlier_threshold(dataframe, variable)
-    dataframe.loc[dataframe[variable] > up_limit, variable] = round(up_limit, 0)
-    dataframe.loc[dataframe[variable] < low_limit, variable] = round(low_limit,0)
-
-replace_with_thresholds(df, "Quantity")
-replace_with_thresholds(df, "Price")
+# Outliers of both columns are capped in one call (helpers/winsorize.py): limits q01 - 1.5 * IQR and
+# q99 + 1.5 * IQR of the 1% / 99% quantiles, values beyond a limit are set to the limit rounded to 0 decimals
+winsorizer = Winsorizer(sides="both", round_limits=True).fit(df, ["Quantity", "Price"])
+df = winsorizer.transform(df)
 
 # Task 1: Establishing BG-NBD and Gamma-Gamma Models and Forecasting 6-Month CLTV
 # Step 1: Make a 6-month CLTV forecast for customers using data from 2010-2011.
@@ -76,7 +74,8 @@ cltv_df["recency"] = cltv_df["recency"] / 7
 cltv_df["T"] = cltv_df["T"] / 7
 cltv_df = cltv_df[cltv_df["frequency"] > 1]
 cltv_df["avg_monetary"] = cltv_df["monetary"] / cltv_df["frequency"]
-bgf = BetaGeoFitter(penalizer_coef=0.001)
+# in-project BG-NBD (helpers/bgnbd.py): same model and penalizer as lifetimes.BetaGeoFitter, analytic gradients
+bgf = BGNBDFitter(penalizer_coef=0.001)
 bgf.fit(cltv_df["frequency"], cltv_df["recency"], cltv_df["T"])
 cltv_df["exp_sales_6_month"] = bgf.predict(24, cltv_df["frequency"], cltv_df["recency"], cltv_df["T"])
 ggf = GammaGammaFitter(penalizer_coef=0.01)
@@ -96,24 +95,23 @@ cltv_df["cltv"] = ggf.customer_lifetime_value(bgf,
 # Step 2: Analyze the 10 people with the highest 1-month CLTV and the 10 people with the highest 12-month CLTV.
 uk_customer_ids = (df[df["Country"] == "United Kingdom"]["Customer ID"]).unique()
 uk_cltv_df = cltv_df[cltv_df.index.isin(uk_customer_ids)]
-bgf.fit(uk_cltv_df["frequency"], uk_cltv_df["recency"], uk_cltv_df["T"])
-ggf.fit(uk_cltv_df["frequency"], uk_cltv_df["avg_monetary"])
-uk_cltv_df["cltv_1_month"] = ggf.customer_lifetime_value(bgf,
-                                                         uk_cltv_df["frequency"],
-                                                         uk_cltv_df["recency"],
-                                                         uk_cltv_df["T"],
-                                                         uk_cltv_df["avg_monetary"],
-                                                         time=1,
-                                                         discount_rate=0.01,
-                                                         freq="W")
-uk_cltv_df["cltv_12_month"] = ggf.customer_lifetime_value(bgf,
-                                                         uk_cltv_df["frequency"],
-                                                         uk_cltv_df["recency"],
-                                                         uk_cltv_df["T"],
-                                                         uk_cltv_df["avg_monetary"],
-                                                         time=12,
-                                                         discount_rate=0.01,
-                                                         freq="W")
+# the UK refit starts from the parameters fitted on all customers instead of the default starting point
+bgf.fit(uk_cltv_df["frequency"], uk_cltv_df["recency"], uk_cltv_df["T"],
+        initial_params=initial_params_from(bgf.params_, uk_cltv_df["T"].max()))
+ggf.fit(uk_cltv_df["frequency"], uk_cltv_df["avg_monetary"],
+        initial_params=initial_params_from(ggf.params_))
+# 1, 6 and 12-month CLTV from one pass over the monthly expected purchases (the 6-month one is used in Task 3)
+uk_cltv = customer_lifetime_value_horizons(bgf,
+                                           ggf,
+                                           uk_cltv_df["frequency"],
+                                           uk_cltv_df["recency"],
+                                           uk_cltv_df["T"],
+                                           uk_cltv_df["avg_monetary"],
+                                           times=[1, 6, 12],
+                                           discount_rate=0.01,
+                                           freq="W")
+uk_cltv_df["cltv_1_month"] = uk_cltv[1]
+uk_cltv_df["cltv_12_month"] = uk_cltv[12]
 uk_cltv_df.sort_values("cltv_1_month", ascending=False).head(10)
 uk_cltv_df.sort_values("cltv_12_month", ascending=False).head(10)
 
@@ -121,13 +119,17 @@ uk_cltv_df.sort_values("cltv_12_month", ascending=False).head(10)
 # Step 1: Divide all your customers into 4 groups (segments) according to the 6-month CLTV for 2010-2011 UK customers and
 # Add the group names to the data set.
 # Step 2: Make short 6-month action proposals to the management for 2 groups you will choose from among the 4 groups.
-uk_cltv_df["cltv_6_month"] = ggf.customer_lifetime_value(bgf,
-                                                         uk_cltv_df["frequency"],
-                                                         uk_cltv_df["recency"],
-                                                         uk_cltv_df["T"],
-                                                         uk_cltv_df["avg_monetary"],
-                                                         time=6,
-                                                         discount_rate=0.01,
-                                                         freq="W")
+uk_cltv_df["cltv_6_month"] = uk_cltv[6]
 uk_cltv_df["segment"] = pd.qcut(uk_cltv_df["cltv_6_month"], 4, ["D", "B", "C", "A"])
-uk_cltv_df.groupby("segment").agg(["mean", "sum", "count"])
\ No newline at end of file
+uk_cltv_df.groupby("segment").agg(["mean", "sum", "count"])
+
+# The same for every country at once: one BG-NBD / Gamma-Gamma pair per country, fitted in worker processes
+# (largest countries first). Countries with fewer than 100 customers are scored with the model fitted on everyone.
+customer_country = df.groupby("Customer ID")["Country"].first()
+country_cltv, country_models = fit_partitioned(cltv_df,
+                                               by=customer_country,
+                                               min_size=100,
+                                               times=[1, 6, 12],
+                                               monetary_col="avg_monetary")
+country_models.sort_values("n_customers", ascending=False)
+country_cltv.groupby("partition")[6].agg(["mean", "sum", "count"]).sort_values("sum", ascending=False)
@@ -0,0 +1,202 @@
+"""
+End-to-end benchmarks of the create_* pipelines on synthetic data.
+
+    python -m benchmarks.run_benchmarks --rows 100000 1000000 --output bench.json
+    python -m benchmarks.run_benchmarks --rows 1000000 --baseline bench.json --tolerance 0.2
+
+For every size the synthetic Online Retail II / FLO inputs are written to
+Parquet once (benchmarks/synthetic.py). Every stage then runs in a fresh
+process: it reads the input, and runs one create_* function taken from its
+script. The scripts run their whole analysis at import time, so only their
+imports and function definitions are executed (load_script_functions). The
+report records wall time, rows in/out and peak RSS per function, and the
+per-stage records of helpers/profiling.StageProfiler inside it. With --baseline,
+stages slower than the baseline by more than --tolerance are listed and the
+exit code is 1.
+"""
+
+import argparse
+import ast
+import datetime as dt
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# stage -> (script, function, dataset, keyword arguments)
+STAGES = {"create_rfm": ("rfm/rfm.py", "create_rfm", "online_retail", {}),
+          "create_cltv_c": ("cltv/cltv.py", "create_cltv_c", "online_retail", {}),
+          "create_cltv_p": ("cltv_prediction/cltv_prediction.py", "create_cltv_p", "online_retail", {}),
+          "create_cltv_df": ("FLO_CRM_Analytics/FLO_CLTV_Prediction.py", "create_cltv_df", "flo", {})}
+N_JOBS_STAGES = {"create_rfm", "create_cltv_c", "create_cltv_p"}
+
+
+def load_script_functions(path):
+    """Imports and top-level functions of a script, without running its module-level analysis."""
+    with open(path) as file:
+        tree = ast.parse(file.read(), path)
+    tree.body = [node for node in tree.body
+                 if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef))]
+    namespace = {"__name__": "benchmarked_script", "__file__": path}
+    exec(compile(tree, path, "exec"), namespace)
+    return namespace
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _run_stage(stage, input_path, n_jobs):
+    # runs in a fresh (spawned) process so that peak RSS belongs to this stage only
+    import pandas as pd
+
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    script, function_name, _, kwargs = STAGES[stage]
+    function = load_script_functions(os.path.join(REPO_ROOT, script))[function_name]
+    if n_jobs is not None and stage in N_JOBS_STAGES:
+        kwargs = dict(kwargs, n_jobs=n_jobs)
+
+    start = time.perf_counter()
+    dataframe = pd.read_parquet(input_path)
+    load_seconds = time.perf_counter() - start
+    load_rss = peak_rss_mb()
+
+    from helpers.profiling import StageProfiler
+
+    profiler = StageProfiler(log=False)
+    rows_in = len(dataframe)  # before the call: create_cltv_df prepares its input in place
+    start = time.perf_counter()
+    try:
+        result = function(dataframe, profiler=profiler, **kwargs)
+    except Exception as error:
+        # the stages that finished (and the failing one) are still reported
+        return {"error": "%s: %s" % (type(error).__name__, error), "stages": profiler.records}
+    seconds = time.perf_counter() - start
+    return {"load_seconds": load_seconds, "seconds": seconds, "rows_in": rows_in,
+            "rows_out": len(result[0] if isinstance(result, tuple) else result),
+            "load_peak_rss_mb": load_rss, "peak_rss_mb": peak_rss_mb(), "stages": profiler.records}
+
+
+def run_stage(stage, input_path, n_jobs=None):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        try:
+            return pool.submit(_run_stage, stage, input_path, n_jobs).result()
+        except BrokenProcessPool:
+            return {"error": "worker process died (out of memory?)"}
+        except Exception as error:
+            return {"error": "%s: %s" % (type(error).__name__, error)}
+
+
+def make_inputs(rows, workdir, seed=0, chunk_rows=1_000_000, flo_rows=None):
+    from benchmarks.synthetic import online_retail_chunks, flo_chunks, write_parquet
+
+    paths = {"online_retail": os.path.join(workdir, "online_retail_%d.parquet" % rows),
+             "flo": os.path.join(workdir, "flo_%d.parquet" % (flo_rows or rows))}
+    timings = {}
+    for name, chunks in (("online_retail", lambda: online_retail_chunks(rows, chunk_rows, seed)),
+                         ("flo", lambda: flo_chunks(flo_rows or rows, chunk_rows, seed))):
+        if not os.path.exists(paths[name]):
+            start = time.perf_counter()
+            write_parquet(chunks(), paths[name])
+            timings[name] = time.perf_counter() - start
+    return paths, timings
+
+
+def environment():
+    import numpy as np
+    import pandas as pd
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"created_at": dt.datetime.now().isoformat(timespec="seconds"), "git_commit": commit,
+            "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "pandas": pd.__version__, "numpy": np.__version__}
+
+
+def run(rows, stages=tuple(STAGES), workdir=None, seed=0, n_jobs=None, flo_rows=None):
+    workdir = workdir or tempfile.mkdtemp(prefix="crm_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    report = {"environment": environment(), "results": []}
+    for size in rows:
+        paths, generation = make_inputs(size, workdir, seed=seed, flo_rows=flo_rows)
+        for stage in stages:
+            result = run_stage(stage, paths[STAGES[stage][2]], n_jobs)
+            result = {"stage": stage, "rows": size, "n_jobs": n_jobs, **result}
+            report["results"].append(result)
+            print(json.dumps(result), flush=True)
+        report.setdefault("generation_seconds", {})[str(size)] = generation
+    return report
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Stages slower than in baseline by more than tolerance (relative), and stages that passed in
+    baseline but fail now (with their "error"), as a list of dicts.
+    """
+    previous = {(result["stage"], result["rows"], result.get("n_jobs")): result
+                for result in baseline["results"] if "seconds" in result}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get((result["stage"], result["rows"], result.get("n_jobs")))
+        if before is None:
+            continue
+        if "seconds" not in result:
+            regressions.append({"stage": result["stage"], "rows": result["rows"],
+                                "error": result.get("error", "no timing"), "baseline_seconds": before["seconds"]})
+            continue
+        ratio = result["seconds"] / before["seconds"]
+        if ratio > 1 + tolerance:
+            regressions.append({"stage": result["stage"], "rows": result["rows"], "seconds": result["seconds"],
+                                "baseline_seconds": before["seconds"], "ratio": ratio})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000],
+                        help="Online Retail rows per run (also FLO customers unless --flo-rows)")
+    parser.add_argument("--flo-rows", type=int, default=None)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--n-jobs", type=int, default=None, help="n_jobs of create_rfm / create_cltv_c / create_cltv_p")
+    parser.add_argument("--workdir", default=None, help="where the synthetic Parquet inputs are kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--baseline", default=None, help="report of a previous version to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    report = run(args.rows, args.stages, args.workdir, args.seed, args.n_jobs, args.flo_rows)
+    if args.baseline:
+        with open(args.baseline) as file:
+            report["regressions"] = compare(report, json.load(file), args.tolerance)
+        for regression in report["regressions"]:
+            if "error" in regression:
+                print("REGRESSION %(stage)s rows=%(rows)d: failed (%(error)s), passed in %(baseline_seconds).2fs"
+                      % regression)
+            else:
+                print("REGRESSION %(stage)s rows=%(rows)d: %(seconds).2fs vs %(baseline_seconds).2fs (x%(ratio).2f)"
+                      % regression)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Synthetic inputs with the schemas of the datasets the scripts read.
+
+online_retail: the Online Retail II sheets (Invoice with "C" cancellations,
+StockCode, Description, Quantity, InvoiceDate, Price, Customer ID, Country)
+between 2009-12-01 and 2011-12-09. Invoices have several lines, customers a
+heavy-tailed number of invoices and a fixed country (mostly United Kingdom),
+and a share of invoices has no Customer ID, as in the real file.
+
+flo: flo_data_20k.csv (master_id, channels, order dates as YYYY-MM-DD
+strings, online/offline order counts and values, interested_in_categories_12)
+with the analysis date of the FLO scripts (2021-06-01) just after the last
+order.
+
+Large inputs are generated in chunks (online_retail_chunks, flo_chunks) and
+written with write_parquet, so 100M rows never have to be in memory at once.
+"""
+
+import numpy as np
+import pandas as pd
+
+RETAIL_START = pd.Timestamp("2009-12-01 07:45:00")
+RETAIL_END = pd.Timestamp("2011-12-09 12:50:00")
+COUNTRIES = ["United Kingdom", "Germany", "France", "EIRE", "Spain", "Netherlands", "Belgium", "Switzerland",
+             "Portugal", "Australia", "Sweden", "Italy", "Norway", "Channel Islands", "Finland", "Denmark"]
+COUNTRY_SHARES = np.r_[0.9, np.full(len(COUNTRIES) - 1, 0.1 / (len(COUNTRIES) - 1))]
+
+FLO_START = pd.Timestamp("2013-01-14")
+FLO_END = pd.Timestamp("2021-05-30")
+FLO_CHANNELS = ["Android App", "Mobile", "Ios App", "Desktop"]
+FLO_CHANNEL_SHARES = [0.48, 0.24, 0.14, 0.14]
+FLO_CATEGORIES = ["KADIN", "ERKEK", "COCUK", "AKTIFSPOR", "AKTIFCOCUK"]
+
+
+def _retail_customers(n_customers, seed):
+    rng = np.random.default_rng(seed)
+    activity = rng.pareto(1.2, n_customers) + 1
+    country = rng.choice(len(COUNTRIES), n_customers, p=COUNTRY_SHARES)
+    return activity / activity.sum(), country
+
+
+def online_retail(n_rows, seed=0, n_customers=None, n_products=4000, lines_per_invoice=20, cancel_rate=0.02,
+                  missing_customer_rate=0.2, first_invoice=489434, customers=None):
+    """n_rows of Online Retail II transactions as a DataFrame."""
+    rng = np.random.default_rng(seed)
+    n_invoices = max(1, n_rows // lines_per_invoice)
+    if customers is None:
+        customers = _retail_customers(n_customers or max(10, n_rows // 180), seed)
+    customer_p, customer_country = customers
+
+    # invoice level: customer, date, cancellation; invoice numbers increase with the date
+    invoice_customer = rng.choice(len(customer_p), n_invoices, p=customer_p)
+    span = int((RETAIL_END - RETAIL_START).total_seconds())
+    invoice_date = RETAIL_START + pd.to_timedelta(np.sort(rng.integers(0, span, n_invoices)) // 60 * 60, unit="s")
+    invoice_cancelled = rng.random(n_invoices) < cancel_rate
+    invoice_known = rng.random(n_invoices) >= missing_customer_rate
+    invoice_number = (first_invoice + np.arange(n_invoices)).astype(str)
+    invoice_label = np.where(invoice_cancelled, np.char.add("C", invoice_number), invoice_number)
+
+    # line level
+    lines = rng.geometric(1 / lines_per_invoice, n_invoices)
+    lines[-1] += max(0, n_rows - lines.sum())
+    invoice = np.repeat(np.arange(n_invoices), lines)[:n_rows]
+    product = np.minimum(rng.zipf(1.3, n_rows), n_products) - 1
+    product_price = np.round(np.random.default_rng(seed + 1).lognormal(1.0, 0.8, n_products), 2)
+    quantity = rng.geometric(0.12, n_rows)
+    quantity = np.where(invoice_cancelled[invoice], -quantity, quantity)
+    customer_id = np.where(invoice_known[invoice], 12346 + invoice_customer[invoice], np.nan)
+
+    return pd.DataFrame({"Invoice": invoice_label[invoice],
+                         "StockCode": (85000 + product).astype(str),
+                         "Description": np.char.add("PRODUCT ", product.astype(str)),
+                         "Quantity": quantity,
+                         "InvoiceDate": invoice_date[invoice],
+                         "Price": product_price[product],
+                         "Customer ID": customer_id,
+                         "Country": np.asarray(COUNTRIES)[customer_country[invoice_customer[invoice]]]})
+
+
+def online_retail_chunks(n_rows, chunk_rows=1_000_000, seed=0, **kwargs):
+    """online_retail in chunks of chunk_rows rows sharing one customer base."""
+    n_customers = kwargs.pop("n_customers", None) or max(10, n_rows // 180)
+    customers = _retail_customers(n_customers, seed)
+    seeds = np.random.SeedSequence(seed).generate_state(max(1, -(-n_rows // chunk_rows)))
+    first_invoice = kwargs.pop("first_invoice", 489434)
+    lines_per_invoice = kwargs.get("lines_per_invoice", 20)
+    for i, start in enumerate(range(0, n_rows, chunk_rows)):
+        rows = min(chunk_rows, n_rows - start)
+        yield online_retail(rows, seed=int(seeds[i]), customers=customers, first_invoice=first_invoice, **kwargs)
+        first_invoice += max(1, rows // lines_per_invoice)
+
+
+def _uuids(rng, n):
+    digits = pd.Series(np.char.add(np.char.mod("%016x", rng.integers(0, 2 ** 63, n)),
+                                   np.char.mod("%016x", rng.integers(0, 2 ** 63, n))))
+    return (digits.str[:8] + "-" + digits.str[8:12] + "-" + digits.str[12:16] + "-" + digits.str[16:20] + "-"
+            + digits.str[20:32]).to_numpy()
+
+
+def _dates(days):
+    return (FLO_START + pd.to_timedelta(days, unit="D")).strftime("%Y-%m-%d").to_numpy()
+
+
+def flo(n_customers, seed=0):
+    """n_customers rows of flo_data_20k.csv as a DataFrame."""
+    rng = np.random.default_rng(seed)
+    span = (FLO_END - FLO_START).days
+
+    order_channel = np.asarray(FLO_CHANNELS)[rng.choice(len(FLO_CHANNELS), n_customers, p=FLO_CHANNEL_SHARES)]
+    last_channel_options = np.asarray(FLO_CHANNELS + ["Offline"])
+    last_order_channel = np.where(rng.random(n_customers) < 0.7, order_channel,
+                                  last_channel_options[rng.integers(0, len(last_channel_options), n_customers)])
+
+    # first orders lean towards the recent years; the last order is between the first one and FLO_END
+    first = (span * rng.beta(2.5, 1.2, n_customers)).astype(int)
+    last = first + (rng.beta(1.0, 0.6, n_customers) * (span - first)).astype(int)
+    online_is_last = rng.random(n_customers) < 0.55
+    other = first + (rng.random(n_customers) * (last - first)).astype(int)
+    last_online = np.where(online_is_last, last, other)
+    last_offline = np.where(online_is_last, other, last)
+
+    online_orders = (1 + rng.poisson(2.0, n_customers)).astype(float)
+    offline_orders = (1 + rng.poisson(0.9, n_customers)).astype(float)
+    online_value = np.round(online_orders * rng.lognormal(4.9, 0.5, n_customers), 2)
+    offline_value = np.round(offline_orders * rng.lognormal(4.8, 0.5, n_customers), 2)
+
+    category_bits = rng.integers(0, 2 ** len(FLO_CATEGORIES), n_customers)
+    category_sets = ["[" + ", ".join(name for bit, name in enumerate(FLO_CATEGORIES) if code >> bit & 1) + "]"
+                     for code in range(2 ** len(FLO_CATEGORIES))]
+
+    return pd.DataFrame({"master_id": _uuids(rng, n_customers),
+                         "order_channel": order_channel,
+                         "last_order_channel": last_order_channel,
+                         "first_order_date": _dates(first),
+                         "last_order_date": _dates(last),
+                         "last_order_date_online": _dates(last_online),
+                         "last_order_date_offline": _dates(last_offline),
+                         "order_num_total_ever_online": online_orders,
+                         "order_num_total_ever_offline": offline_orders,
+                         "customer_value_total_ever_offline": offline_value,
+                         "customer_value_total_ever_online": online_value,
+                         "interested_in_categories_12": np.asarray(category_sets)[category_bits]})
+
+
+def flo_chunks(n_customers, chunk_rows=1_000_000, seed=0):
+    seeds = np.random.SeedSequence(seed).generate_state(max(1, -(-n_customers // chunk_rows)))
+    for i, start in enumerate(range(0, n_customers, chunk_rows)):
+        yield flo(min(chunk_rows, n_customers - start), seed=int(seeds[i]))
+
+
+def write_parquet(chunks, path):
+    """Writes DataFrame chunks to one Parquet file (one row group per chunk); returns the row count."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer, n_rows = None, 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            n_rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
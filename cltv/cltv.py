@@ -34,15 +34,25 @@
 
 import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
+from helpers.backends import cltv_c_table
+from helpers.cleaning import clean, not_cancelled, not_null, positive
+from helpers.export import export
+from helpers.ingest import read_excel_cached
+from helpers.parallel import parallel_cltv_c_metrics
+from helpers.profiling import NULL_PROFILER
+from helpers.schema import compact_transactions
 pd.set_option('display.max_columns', None)
 # pd.set_option('display.max_rows', None)
 pd.set_option('display.float_format', lambda x: '%.5f' % x)
 
-df_ = pd.read_excel("datasets/online_retail_II.xlsx", sheet_name="Year 2009-2010")
+# compact_transactions: int32 fatura no + InvoicePrefix (C / A harfi) + is_cancelled,
+# kategorik metin kolonları, int32 ID / adet (helpers/schema.py)
+df_ = compact_transactions(read_excel_cached("datasets/online_retail_II.xlsx", sheet_name="Year 2009-2010"))
 df = df_.copy()
 df.head()
 df.isnull().sum()
-df = df[~df["Invoice"].str.contains("C", na=False)]
+# iptaller compact şemada is_cancelled kolonunda (Invoice artık int32 fatura numarası)
+df = df[~df["is_cancelled"]]
 df.describe().T
 df = df[(df['Quantity'] > 0)]
 df.dropna(inplace=True)
@@ -112,7 +122,7 @@ cltv_c.sort_values(by="cltv", ascending=False).head()
 
 cltv_c.groupby("segment").agg({"count", "mean", "sum"})
 
-cltv_c.to_csv("cltc_c.csv")
+export(cltv_c, "cltc_c.csv")
 
 # 18102.00000       A
 # 14646.00000       A
@@ -131,32 +141,54 @@ cltv_c.to_csv("cltc_c.csv")
 # 9. BONUS: Tüm İşlemlerin Fonksiyonlaştırılması
 ##################################################
 
-def create_cltv_c(dataframe, profit=0.10):
+def create_cltv_c(dataframe, profit=0.10, n_jobs=1, profiler=None, backend="pandas"):
+    # profiler: adım bazında süre, satır sayısı ve bellek ölçümü (helpers/profiling.py, StageProfiler)
+    # backend: "pandas", "polars" ya da "duckdb" (helpers/backends.py); polars / duckdb temizleme ve
+    # özetlemeyi kendi içinde yapar (dataframe bir Parquet yolu da olabilir), pandas'a müşteri tablosu gelir
+    profiler = (profiler or NULL_PROFILER).for_pipeline("create_cltv_c")
+    rules = [not_cancelled(), positive("Quantity"), not_null()]
 
     # Veriyi hazırlama
-    dataframe = dataframe[~dataframe["Invoice"].str.contains("C", na=False)]
-    dataframe = dataframe[(dataframe['Quantity'] > 0)]
-    dataframe.dropna(inplace=True)
-    dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
-    cltv_c = dataframe.groupby('Customer ID').agg({'Invoice': lambda x: x.nunique(),
-                                                   'Quantity': lambda x: x.sum(),
-                                                   'TotalPrice': lambda x: x.sum()})
-    cltv_c.columns = ['total_transaction', 'total_unit', 'total_price']
-    # avg_order_value
-    cltv_c['avg_order_value'] = cltv_c['total_price'] / cltv_c['total_transaction']
-    # purchase_frequency
-    cltv_c["purchase_frequency"] = cltv_c['total_transaction'] / cltv_c.shape[0]
-    # repeat rate & churn rate
-    repeat_rate = cltv_c[cltv_c.total_transaction > 1].shape[0] / cltv_c.shape[0]
-    churn_rate = 1 - repeat_rate
-    # profit_margin
-    cltv_c['profit_margin'] = cltv_c['total_price'] * profit
-    # Customer Value
-    cltv_c['customer_value'] = (cltv_c['avg_order_value'] * cltv_c["purchase_frequency"])
-    # Customer Lifetime Value
-    cltv_c['cltv'] = (cltv_c['customer_value'] / churn_rate) * cltv_c['profit_margin']
+    if backend == "pandas":
+        with profiler.stage("data_prep", dataframe) as stage:
+            # tüm kurallar tek bir maskede değerlendirilir, girdi değiştirilmez (helpers/cleaning.py)
+            dataframe, dropped = clean(dataframe, rules)
+            stage.annotate(dropped_rows=dropped)
+            dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
+            stage.output(dataframe)
+    with profiler.stage("aggregate", None if isinstance(dataframe, str) else dataframe) as stage:
+        if backend != "pandas":
+            cltv_c, dropped = cltv_c_table(dataframe, rules, backend)
+            stage.annotate(backend=backend, dropped_rows=dropped)
+        elif n_jobs != 1:
+            # Customer ID hash'ine göre parçalanıp süreç havuzunda özetlenir (helpers/parallel.py).
+            # churn_rate ve purchase_frequency paydaları birleştirilmiş müşteri tablosundan gelir.
+            cltv_c = parallel_cltv_c_metrics(dataframe, n_jobs=n_jobs)
+        else:
+            cltv_c = dataframe.groupby('Customer ID').agg({'Invoice': lambda x: x.nunique(),
+                                                           'Quantity': lambda x: x.sum(),
+                                                           'TotalPrice': lambda x: x.sum()})
+            cltv_c.columns = ['total_transaction', 'total_unit', 'total_price']
+        stage.output(cltv_c)
+    with profiler.stage("cltv", cltv_c) as stage:
+        # avg_order_value
+        cltv_c['avg_order_value'] = cltv_c['total_price'] / cltv_c['total_transaction']
+        # purchase_frequency
+        cltv_c["purchase_frequency"] = cltv_c['total_transaction'] / cltv_c.shape[0]
+        # repeat rate & churn rate
+        repeat_rate = cltv_c[cltv_c.total_transaction > 1].shape[0] / cltv_c.shape[0]
+        churn_rate = 1 - repeat_rate
+        # profit_margin
+        cltv_c['profit_margin'] = cltv_c['total_price'] * profit
+        # Customer Value
+        cltv_c['customer_value'] = (cltv_c['avg_order_value'] * cltv_c["purchase_frequency"])
+        # Customer Lifetime Value
+        cltv_c['cltv'] = (cltv_c['customer_value'] / churn_rate) * cltv_c['profit_margin']
+        stage.output(cltv_c)
     # Segment
-    cltv_c["segment"] = pd.qcut(cltv_c["cltv"], 4, labels=["D", "C", "B", "A"])
+    with profiler.stage("segment", cltv_c) as stage:
+        cltv_c["segment"] = pd.qcut(cltv_c["cltv"], 4, labels=["D", "C", "B", "A"])
+        stage.output(cltv_c)
 
     return cltv_c
 
@@ -47,6 +47,20 @@ import matplotlib.pyplot as plt
 from lifetimes import BetaGeoFitter
 from lifetimes import GammaGammaFitter
 from lifetimes.plotting import plot_period_transactions
+from helpers.ingest import read_excel_cached
+from helpers.cleaning import clean, not_cancelled, not_null, positive
+from helpers.backends import cltv_p_table
+from helpers.bgnbd import BGNBDFitter, predict_horizons
+from helpers.bootstrap import bootstrap_cltv
+from helpers.cltv import customer_lifetime_value_horizons
+from helpers.export import export
+from helpers.lifetimes_fit import fit_bgf_compressed, fit_ggf_compressed
+from helpers.model_registry import ModelRegistry, fit_with_registry
+from helpers.parallel import parallel_cltv_p_metrics
+from helpers.profiling import NULL_PROFILER
+from helpers.scoring_service import CLTVScoringService
+from helpers.schema import compact_transactions
+from helpers.winsorize import winsorizer_from_registry
 
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', 500)
@@ -73,8 +87,10 @@ def replace_with_thresholds(dataframe, variable):
 # Verinin Okunması
 #########################
 
-df_ = pd.read_excel("datasets/online_retail_II.xlsx",
-                    sheet_name="Year 2010-2011")
+# compact_transactions: int32 fatura no + InvoicePrefix (C / A harfi) + is_cancelled,
+# kategorik metin kolonları, int32 ID / adet (helpers/schema.py)
+df_ = compact_transactions(read_excel_cached("datasets/online_retail_II.xlsx",
+                                             sheet_name="Year 2010-2011"))
 df = df_.copy()
 df.describe().T
 df.head()
@@ -85,7 +101,8 @@ df.isnull().sum()
 #########################
 
 df.dropna(inplace=True)
-df = df[~df["Invoice"].str.contains("C", na=False)]
+# iptaller compact şemada is_cancelled kolonunda (Invoice artık int32 fatura numarası)
+df = df[~df["is_cancelled"]]
 df = df[df["Quantity"] > 0]
 df = df[df["Price"] > 0]
 
@@ -145,48 +162,34 @@ bgf.conditional_expected_number_of_purchases_up_to_time(1,
                                                         cltv_df['recency'],
                                                         cltv_df['T']).sort_values(ascending=False).head(10)
 
-bgf.predict(1,
-            cltv_df['frequency'],
-            cltv_df['recency'],
-            cltv_df['T']).sort_values(ascending=False).head(10)
+# predict aynı frequency/recency/T dizileri için her ufukta müşteri terimlerini ve hipergeometrik
+# fonksiyonu baştan hesaplar. predict_horizons tüm ufukları tek seferde müşteri x ufuk matrisi olarak verir.
+expected = predict_horizons(bgf, [1, 4, 4 * 3],
+                            cltv_df['frequency'],
+                            cltv_df['recency'],
+                            cltv_df['T'])
 
-cltv_df["expected_purc_1_week"] = bgf.predict(1,
-                                              cltv_df['frequency'],
-                                              cltv_df['recency'],
-                                              cltv_df['T'])
+expected[1].sort_values(ascending=False).head(10)
+
+cltv_df["expected_purc_1_week"] = expected[1]
 
 ################################################################
 # 1 ay içinde en çok satın alma beklediğimiz 10 müşteri kimdir?
 ################################################################
 
-bgf.predict(4,
-            cltv_df['frequency'],
-            cltv_df['recency'],
-            cltv_df['T']).sort_values(ascending=False).head(10)
+expected[4].sort_values(ascending=False).head(10)
 
-cltv_df["expected_purc_1_month"] = bgf.predict(4,
-                                               cltv_df['frequency'],
-                                               cltv_df['recency'],
-                                               cltv_df['T'])
+cltv_df["expected_purc_1_month"] = expected[4]
 
-bgf.predict(4,
-            cltv_df['frequency'],
-            cltv_df['recency'],
-            cltv_df['T']).sum()
+expected[4].sum()
 
 ################################################################
 # 3 Ayda Tüm Şirketin Beklenen Satış Sayısı Nedir?
 ################################################################
 
-bgf.predict(4 * 3,
-            cltv_df['frequency'],
-            cltv_df['recency'],
-            cltv_df['T']).sum()
+expected[4 * 3].sum()
 
-cltv_df["expected_purc_3_month"] = bgf.predict(4 * 3,
-                                               cltv_df['frequency'],
-                                               cltv_df['recency'],
-                                               cltv_df['T'])
+cltv_df["expected_purc_3_month"] = expected[4 * 3]
 ################################################################
 # Tahmin Sonuçlarının Değerlendirilmesi
 ################################################################
@@ -246,76 +249,147 @@ cltv_final.sort_values(by="clv", ascending=False).head(50)
 cltv_final.groupby("segment").agg(
     {"count", "mean", "sum"})
 
+# Tek müşteri skorlama: fit edilmiş parametreler ve dondurulmuş segment sınırları ile, script çalıştırmadan
+# milisaniye altında skor (helpers/scoring_service.py). serve(service) ile yerel HTTP uç noktası olarak da açılabilir.
+service = CLTVScoringService.from_models(bgf, ggf, cltv_final["clv"], time=3)
+service.score(frequency=5, recency=20.0, T=40.0, monetary=150.0)
+service.score_batch([(5, 20.0, 40.0, 150.0), (2, 3.0, 50.0, 20.0)])
+service.latency()
+service.save("cltv_scoring_service.json")
+
 
 
 ##############################################################
 # 6. Çalışmanın Fonksiyonlaştırılması
 ##############################################################
 
-def create_cltv_p(dataframe, month=3):
-    # 1. Veri Ön İşleme
-    dataframe.dropna(inplace=True)
-    dataframe = dataframe[~dataframe["Invoice"].str.contains("C", na=False)]
-    dataframe = dataframe[dataframe["Quantity"] > 0]
-    dataframe = dataframe[dataframe["Price"] > 0]
-    replace_with_thresholds(dataframe, "Quantity")
-    replace_with_thresholds(dataframe, "Price")
-    dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
+def create_cltv_p(dataframe, month=3, n_jobs=1, registry=None, refit=True, bootstrap=0, profiler=None,
+                  backend="pandas"):
+    # profiler: adım bazında süre, satır sayısı ve bellek ölçümü (helpers/profiling.py, StageProfiler)
+    # backend: "pandas", "polars" ya da "duckdb" (helpers/backends.py); polars / duckdb temizleme, eşik
+    # baskılama ve müşteri bazında özetlemeyi kendi içinde yapar (dataframe bir Parquet yolu da olabilir),
+    # pandas'a sadece modellerin girdisi olan müşteri tablosu gelir
+    profiler = (profiler or NULL_PROFILER).for_pipeline("create_cltv_p")
+    rules = [not_null(), not_cancelled(), positive("Quantity"), positive("Price")]
     today_date = dt.datetime(2011, 12, 11)
 
-    cltv_df = dataframe.groupby('Customer ID').agg(
-        {'InvoiceDate': [lambda InvoiceDate: (InvoiceDate.max() - InvoiceDate.min()).days,
-                         lambda InvoiceDate: (today_date - InvoiceDate.min()).days],
-         'Invoice': lambda Invoice: Invoice.nunique(),
-         'TotalPrice': lambda TotalPrice: TotalPrice.sum()})
-
-    cltv_df.columns = cltv_df.columns.droplevel(0)
-    cltv_df.columns = ['recency', 'T', 'frequency', 'monetary']
-    cltv_df["monetary"] = cltv_df["monetary"] / cltv_df["frequency"]
-    cltv_df = cltv_df[(cltv_df['frequency'] > 1)]
-    cltv_df["recency"] = cltv_df["recency"] / 7
-    cltv_df["T"] = cltv_df["T"] / 7
+    # 1. Veri Ön İşleme
+    # eksik değer, iptal, Quantity / Price > 0 kuralları tek bir maskede değerlendirilir;
+    # girdi değiştirilmez (helpers/cleaning.py)
+    if backend == "pandas":
+        with profiler.stage("clean", dataframe) as stage:
+            dataframe, dropped = clean(dataframe, rules)
+            stage.annotate(dropped_rows=dropped)
+            stage.output(dataframe)
+        # Quantity ve Price sınırları tek çağrıda hesaplanıp tek geçişte uygulanır (helpers/winsorize.py);
+        # registry verilirse sınırlar modellerin yanına kaydedilir, refit=False eğitimdeki sınırları kullanır
+        with profiler.stage("replace_with_thresholds", dataframe) as stage:
+            winsorizer = winsorizer_from_registry(registry, "thresholds", dataframe, ["Quantity", "Price"],
+                                                  refit=refit, sides="upper")
+            winsorizer.transform(dataframe)
+            dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
+            stage.output(dataframe)
+
+    with profiler.stage("aggregate", None if isinstance(dataframe, str) else dataframe) as stage:
+        if backend != "pandas":
+            # sınırlar motorun quantile'larından hesaplanır, kayıt / yükleme pandas'takiyle aynıdır
+            cltv_df, dropped, winsorizer = cltv_p_table(
+                dataframe, today_date, rules, backend,
+                winsorizer=lambda quantiles: winsorizer_from_registry(registry, "thresholds", None,
+                                                                      ["Quantity", "Price"], refit=refit,
+                                                                      quantiles=quantiles, sides="upper"))
+            stage.annotate(backend=backend, dropped_rows=dropped)
+        elif n_jobs != 1:
+            # Customer ID hash'ine göre parçalanıp süreç havuzunda özetlenir (helpers/parallel.py);
+            # model girdisi olan müşteri tablosu merkezde birleştirilir.
+            cltv_df = parallel_cltv_p_metrics(dataframe, today_date, n_jobs=n_jobs)
+        else:
+            cltv_df = dataframe.groupby('Customer ID').agg(
+                {'InvoiceDate': [lambda InvoiceDate: (InvoiceDate.max() - InvoiceDate.min()).days,
+                                 lambda InvoiceDate: (today_date - InvoiceDate.min()).days],
+                 'Invoice': lambda Invoice: Invoice.nunique(),
+                 'TotalPrice': lambda TotalPrice: TotalPrice.sum()})
+
+            cltv_df.columns = cltv_df.columns.droplevel(0)
+            cltv_df.columns = ['recency', 'T', 'frequency', 'monetary']
+        cltv_df["monetary"] = cltv_df["monetary"] / cltv_df["frequency"]
+        cltv_df = cltv_df[(cltv_df['frequency'] > 1)]
+        cltv_df["recency"] = cltv_df["recency"] / 7
+        cltv_df["T"] = cltv_df["T"] / 7
+        stage.output(cltv_df)
 
     # 2. BG-NBD Modelinin Kurulması
-    bgf = BetaGeoFitter(penalizer_coef=0.001)
-    bgf.fit(cltv_df['frequency'],
-            cltv_df['recency'],
-            cltv_df['T'])
-
-    cltv_df["expected_purc_1_week"] = bgf.predict(1,
-                                                  cltv_df['frequency'],
-                                                  cltv_df['recency'],
-                                                  cltv_df['T'])
-
-    cltv_df["expected_purc_1_month"] = bgf.predict(4,
-                                                   cltv_df['frequency'],
-                                                   cltv_df['recency'],
-                                                   cltv_df['T'])
-
-    cltv_df["expected_purc_3_month"] = bgf.predict(12,
-                                                   cltv_df['frequency'],
-                                                   cltv_df['recency'],
-                                                   cltv_df['T'])
+    # Aynı (frequency, recency, T) üçlüsüne sahip müşteriler tek satıra indirilip ağırlıklandırılır;
+    # olabilirlik aynı kalır, parametreler değişmez (helpers/lifetimes_fit.py).
+    # registry (helpers/model_registry.py) verilirse kayıtlı parametrelerden başlanır (warm start),
+    # refit=False ile sadece kayıtlı parametreler yüklenip skorlama yapılır.
+    with profiler.stage("bgnbd_fit", cltv_df):
+        bgf = BGNBDFitter(penalizer_coef=0.001)
+        fit_with_registry(registry, "bgnbd", bgf, fit_bgf_compressed,
+                          cltv_df['frequency'],
+                          cltv_df['recency'],
+                          cltv_df['T'],
+                          analysis_date=today_date, refit=refit)
+
+    with profiler.stage("bgnbd_predict", cltv_df) as stage:
+        expected = bgf.predict_horizons([1, 4, 12],
+                                        cltv_df['frequency'],
+                                        cltv_df['recency'],
+                                        cltv_df['T'])
+        cltv_df["expected_purc_1_week"] = expected[1]
+        cltv_df["expected_purc_1_month"] = expected[4]
+        cltv_df["expected_purc_3_month"] = expected[12]
+        stage.output(expected)
 
     # 3. GAMMA-GAMMA Modelinin Kurulması
-    ggf = GammaGammaFitter(penalizer_coef=0.01)
-    ggf.fit(cltv_df['frequency'], cltv_df['monetary'])
-    cltv_df["expected_average_profit"] = ggf.conditional_expected_average_profit(cltv_df['frequency'],
-                                                                                 cltv_df['monetary'])
+    with profiler.stage("gamma_gamma_fit", cltv_df):
+        ggf = GammaGammaFitter(penalizer_coef=0.01)
+        fit_with_registry(registry, "gamma_gamma", ggf, fit_ggf_compressed,
+                          cltv_df['frequency'],
+                          cltv_df['monetary'],
+                          analysis_date=today_date, refit=refit)
+        cltv_df["expected_average_profit"] = ggf.conditional_expected_average_profit(cltv_df['frequency'],
+                                                                                     cltv_df['monetary'])
 
     # 4. BG-NBD ve GG modeli ile CLTV'nin hesaplanması.
-    cltv = ggf.customer_lifetime_value(bgf,
-                                       cltv_df['frequency'],
-                                       cltv_df['recency'],
-                                       cltv_df['T'],
-                                       cltv_df['monetary'],
-                                       time=month,  # 3 aylık
-                                       freq="W",  # T'nin frekans bilgisi.
-                                       discount_rate=0.01)
-
-    cltv = cltv.reset_index()
-    cltv_final = cltv_df.merge(cltv, on="Customer ID", how="left")
-    cltv_final["segment"] = pd.qcut(cltv_final["clv"], 4, labels=["D", "C", "B", "A"])
+    with profiler.stage("customer_lifetime_value", cltv_df) as stage:
+        cltv = customer_lifetime_value_horizons(bgf,
+                                                ggf,
+                                                cltv_df['frequency'],
+                                                cltv_df['recency'],
+                                                cltv_df['T'],
+                                                cltv_df['monetary'],
+                                                times=[month],  # 3 aylık
+                                                freq="W",  # T'nin frekans bilgisi.
+                                                discount_rate=0.01)[month].rename("clv")
+        stage.output(cltv)
+
+    with profiler.stage("segment", cltv_df) as stage:
+        cltv = cltv.reset_index()
+        cltv_final = cltv_df.merge(cltv, on="Customer ID", how="left")
+        cltv_final["segment"] = pd.qcut(cltv_final["clv"], 4, labels=["D", "C", "B", "A"])
+        stage.output(cltv_final)
+
+    if bootstrap:
+        # 5. Güven aralıkları: bootstrap=200 gibi bir değerle modeller müşteri tablosunun ağırlıklı yeniden
+        # örneklemeleri üzerinde tekrar fit edilir (helpers/bootstrap.py). Müşteri bazında clv yüzdelikleri
+        # tabloya eklenir, segment toplamlarının yüzdelikleri cltv_final.attrs["segment_intervals"] içinde;
+        # dönüş tipi bootstrap ile de DataFrame kalır.
+        with profiler.stage("bootstrap", cltv_final):
+            intervals, segment_intervals = bootstrap_cltv(bgf,
+                                                          ggf,
+                                                          cltv_final['frequency'],
+                                                          cltv_final['recency'],
+                                                          cltv_final['T'],
+                                                          cltv_final['monetary'],
+                                                          segments=cltv_final["segment"],
+                                                          n_boot=bootstrap,
+                                                          time=month,
+                                                          freq="W",
+                                                          discount_rate=0.01,
+                                                          n_jobs=n_jobs)
+        cltv_final = pd.concat([cltv_final, intervals], axis=1)
+        cltv_final.attrs["segment_intervals"] = segment_intervals
 
     return cltv_final
 
@@ -324,7 +398,18 @@ df = df_.copy()
 
 cltv_final2 = create_cltv_p(df)
 
-cltv_final2.to_csv("cltv_prediction.csv")
+# Günlük çalıştırmalarda parametreler diskte tutulur: yeniden fit bir önceki parametrelerden başlar,
+# sadece skorlama yapan işler fit etmeden yükler.
+# registry = ModelRegistry("models/cltv_prediction")
+# cltv_final2 = create_cltv_p(df_.copy(), registry=registry)
+# cltv_scored = create_cltv_p(df_.copy(), registry=registry, refit=False)
+
+# Finans için güven aralıkları: 200 bootstrap tekrarı, müşteri ve segment bazında %5 / %50 / %95 yüzdelikleri
+# cltv_final3 = create_cltv_p(df_.copy(), bootstrap=200, n_jobs=-1)
+# cltv_final3.attrs["segment_intervals"]
+
+export(cltv_final2, "cltv_prediction.csv")
+# büyük tablolar için: export(cltv_final2, "cltv_prediction.parquet") ya da "cltv_prediction.csv.gz"
 
 
 
@@ -0,0 +1,190 @@
+"""
+Bitmap index over a customer table for campaign target lists.
+
+The campaign lists of FLO_RFM.py merge the customer table with the raw data and
+scan interested_in_categories_12 with str.contains for every campaign.
+AudienceIndex numbers the customers densely (0..n-1) once and keeps one bitmap
+(np.packbits of a boolean array, 1 bit per customer) per value of every
+indexed column (segment, order_channel, ...) and per interest category (from
+the interested_in_categories_mask of helpers/flo.py). A filter then compiles to
+AND / OR / NOT of bitmaps:
+
+    index = AudienceIndex.from_frame(customers, columns=["segment", "order_channel"],
+                                     categories=df.attrs["interested_in_categories"])
+    index.query('segment in {champions, loyal_customers} AND category has KADIN')
+
+Filter syntax (keywords are case-insensitive):
+    column in {value, ...}    column = value    category has NAME
+    NOT a    a AND b    a OR b    ( ... )
+NOT binds tighter than AND, AND tighter than OR. Values with spaces are quoted
+("Android App"). `has` matches as str.contains does on the raw category lists:
+COCUK also selects AKTIFCOCUK.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from helpers.flo import MASK_COLUMN, category_bits
+
+_TOKEN = re.compile(r'\s*(?:([{}(),=])|"([^"]*)"|\'([^\']*)\'|([^\s{}(),=\'"]+))')
+_KEYWORDS = {"and", "or", "not", "in", "has"}
+
+
+def _tokenize(expression):
+    tokens, position = [], 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise ValueError("Cannot parse filter at %r" % expression[position:])
+        symbol, double_quoted, single_quoted, word = match.groups()
+        if symbol is not None:
+            tokens.append(("symbol", symbol))
+        elif word is not None and word.lower() in _KEYWORDS:
+            tokens.append(("keyword", word.lower()))
+        else:
+            value = word if word is not None else double_quoted if double_quoted is not None else single_quoted
+            tokens.append(("value", value))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    # recursive descent: or_expr := and_expr (OR and_expr)*, and_expr := factor (AND factor)*,
+    # factor := NOT factor | ( or_expr ) | predicate
+
+    def __init__(self, index, expression):
+        self.index = index
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _next(self, kind=None, text=None):
+        token = self._peek()
+        if token[0] is None or (kind is not None and token[0] != kind) or (text is not None and token[1] != text):
+            raise ValueError("Expected %s in filter, got %r" % (text or kind, token[1]))
+        self.position += 1
+        return token[1]
+
+    def parse(self):
+        bitmap = self._or()
+        if self.position != len(self.tokens):
+            raise ValueError("Unexpected %r in filter" % (self._peek()[1],))
+        return bitmap
+
+    def _or(self):
+        bitmap = self._and()
+        while self._peek() == ("keyword", "or"):
+            self._next()
+            bitmap = bitmap | self._and()
+        return bitmap
+
+    def _and(self):
+        bitmap = self._factor()
+        while self._peek() == ("keyword", "and"):
+            self._next()
+            bitmap = bitmap & self._factor()
+        return bitmap
+
+    def _factor(self):
+        if self._peek() == ("keyword", "not"):
+            self._next()
+            return self.index._not(self._factor())
+        if self._peek() == ("symbol", "("):
+            self._next()
+            bitmap = self._or()
+            self._next("symbol", ")")
+            return bitmap
+        return self._predicate()
+
+    def _predicate(self):
+        column = self._next("value")
+        operator = self._next()
+        if operator == "has":
+            return self.index._category(column, self._next("value"))
+        if operator == "=":
+            return self.index._values(column, [self._next("value")])
+        if operator == "in":
+            self._next("symbol", "{")
+            values = [self._next("value")]
+            while self._peek() == ("symbol", ","):
+                self._next()
+                values.append(self._next("value"))
+            self._next("symbol", "}")
+            return self.index._values(column, values)
+        raise ValueError("Unknown operator %r in filter" % operator)
+
+
+class AudienceIndex:
+
+    def __init__(self, ids, columns=None, category_masks=None, categories=None, category_name="category"):
+        """
+        ids: customer IDs (master_id) in the dense order; columns: {name: values aligned with ids};
+        category_masks: interest bitmask per customer with the bit order of categories.
+        """
+        self.ids = np.asarray(ids)
+        self.n = len(self.ids)
+        self.bitmaps = {}
+        for name, values in (columns or {}).items():
+            codes, uniques = pd.factorize(np.asarray(values))
+            self.bitmaps[name] = {str(value): np.packbits(codes == code) for code, value in enumerate(uniques)}
+        self.category_name = category_name
+        self.categories = list(categories) if categories is not None else None
+        self.category_bitmaps = []
+        if category_masks is not None:
+            masks = np.asarray(category_masks).astype("uint64")
+            n_bits = len(self.categories) if self.categories is not None else int(masks.max()).bit_length()
+            self.category_bitmaps = [np.packbits((masks >> np.uint64(bit)) & np.uint64(1) == 1)
+                                     for bit in range(n_bits)]
+        self._all = np.packbits(np.ones(self.n, dtype=bool))
+
+    @classmethod
+    def from_frame(cls, dataframe, id_col="master_id", columns=("segment",), mask_col=MASK_COLUMN, categories=None):
+        """Index of a customer table (one row per customer), e.g. the rfm table merged with the typed FLO data."""
+        masks = dataframe[mask_col].to_numpy() if mask_col in dataframe else None
+        if categories is None:
+            categories = dataframe.attrs.get("interested_in_categories")
+        return cls(dataframe[id_col].to_numpy(), {col: dataframe[col].to_numpy() for col in columns},
+                   masks, categories)
+
+    def _values(self, column, values):
+        if column not in self.bitmaps:
+            raise ValueError("Column %r is not indexed (indexed: %s)" % (column, sorted(self.bitmaps)))
+        bitmap = np.zeros_like(self._all)
+        for value in values:
+            if value in self.bitmaps[column]:  # a value without customers selects nobody
+                bitmap |= self.bitmaps[column][value]
+        return bitmap
+
+    def _category(self, column, name):
+        if column != self.category_name or not self.category_bitmaps:
+            raise ValueError("'has' needs the category bitmaps: %s has NAME" % self.category_name)
+        bitmap = np.zeros_like(self._all)
+        bits = category_bits(name, self.categories)
+        for bit, category_bitmap in enumerate(self.category_bitmaps):
+            if bits >> bit & 1:
+                bitmap |= category_bitmap
+        return bitmap
+
+    def _not(self, bitmap):
+        # the padding bits of the last byte stay 0
+        return ~bitmap & self._all
+
+    def bitmap(self, expression):
+        """Packed bitmap (np.packbits) of the customers selected by the filter."""
+        return _Parser(self, expression).parse()
+
+    def mask(self, expression):
+        """Boolean array over the customers (in the order of ids)."""
+        return np.unpackbits(self.bitmap(expression), count=self.n).astype(bool)
+
+    def count(self, expression):
+        return int(np.unpackbits(self.bitmap(expression), count=self.n).sum())
+
+    def query(self, expression):
+        """IDs (master_id) of the customers selected by the filter."""
+        return self.ids[self.mask(expression)]
@@ -0,0 +1,380 @@
+"""
+Compute backends for the feature builders: pandas, Polars (lazy) or DuckDB.
+
+create_rfm, create_cltv_c, create_cltv_p and create_cltv_df run the same plan:
+clean the rows, aggregate them per customer and score the customer table.
+backend="pandas" is the in-memory path of the scripts. With backend="polars"
+or "duckdb" the cleaning (the rules of helpers/cleaning.py, through their
+spec), the winsorizing and the per-customer aggregation run in that engine,
+multi-threaded, and only the customer-level table comes back as a pandas
+DataFrame. The scoring and the models then run on that table as before.
+
+The source is a DataFrame or the path of a Parquet file. A Parquet file is
+scanned by the engine itself (pl.scan_parquet / DuckDB read_parquet), so the
+transactions never have to fit in memory.
+
+Polars and DuckDB are optional; they are imported when the backend is used.
+Their sums run in another order than pandas', so sums can differ in the last
+bits; counts, dates and quantiles are the same.
+"""
+
+import numpy as np
+import pandas as pd
+
+from helpers.rfm import days_between
+
+BACKENDS = ("pandas", "polars", "duckdb")
+
+
+def _spec(rule):
+    name, function = rule
+    if not hasattr(function, "spec"):
+        raise ValueError("Rule %r has no spec; only the pandas backend runs it" % name)
+    return name, function.spec
+
+
+def _check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend %r (known: %s)" % (backend, ", ".join(BACKENDS)))
+
+
+#############################################
+# Polars
+#############################################
+
+class PolarsFrame:
+
+    def __init__(self, source):
+        try:
+            import polars as pl
+        except ImportError as error:
+            raise ImportError("backend='polars' needs the polars package (pip install polars)") from error
+        self.pl = pl
+        self.frame = pl.scan_parquet(source) if isinstance(source, str) else pl.from_pandas(source).lazy()
+
+    def _schema(self):
+        return self.frame.collect_schema()
+
+    def _expr(self, node):
+        pl, schema = self.pl, self._schema()
+        kind = node[0]
+        if kind == "not_null":
+            expr = pl.lit(True)
+            for col in schema.names() if node[1] is None else node[1]:
+                expr = expr & pl.col(col).is_not_null()
+                if schema[col].is_float():
+                    expr = expr & pl.col(col).is_not_nan()
+            return expr
+        if kind in ("not", "and", "or"):
+            parts = [self._expr(part) for part in node[1:]]
+            if kind == "not":
+                return ~parts[0]
+            expr = parts[0]
+            for part in parts[1:]:
+                expr = (expr & part) if kind == "and" else (expr | part)
+            return expr
+        col = node[1]
+        if kind == "cancelled" and "is_cancelled" in schema:
+            return pl.col("is_cancelled").fill_null(False)
+        if kind in ("contains", "cancelled"):
+            text = "C" if kind == "cancelled" else node[2]
+            return pl.col(col).cast(pl.String).str.contains(text, literal=True).fill_null(False)
+        expr = {">": pl.col(col) > node[2], "==": pl.col(col) == node[2], "!=": pl.col(col) != node[2]}[kind]
+        if schema[col].is_float() and kind == ">":
+            expr = expr & pl.col(col).is_not_nan()  # NaN sorts above every number in Polars
+        return expr.fill_null(kind == "!=")
+
+    def clean(self, rules):
+        """Filters by every rule; returns the rows dropped per rule, counted as in helpers/cleaning.clean."""
+        pl = self.pl
+        keep, counts = pl.lit(True), []
+        for name, spec in map(_spec, rules):
+            rule_keep = self._expr(spec)
+            counts.append((keep & ~rule_keep).sum().alias(name))
+            keep = keep & rule_keep
+        dropped = {}
+        if counts:
+            row = self.frame.select(counts).collect().row(0, named=True)
+            dropped = {name: int(value) for name, value in row.items()}
+        self.frame = self.frame.filter(keep)
+        return dropped
+
+    def where(self, node):
+        self.frame = self.frame.filter(self._expr(node))
+
+    def quantiles(self, columns, probabilities):
+        pl = self.pl
+        exprs = [pl.col(col).cast(pl.Float64).quantile(q, interpolation="linear").alias("%s_%d" % (col, i))
+                 for col in columns for i, q in enumerate(probabilities)]
+        row = self.frame.select(exprs).collect().row(0)
+        return np.asarray(row, dtype="float64").reshape(len(columns), len(probabilities)).T
+
+    def clip(self, winsorizer):
+        # compared with the limits, set to the (rounded) caps, as Winsorizer.transform
+        pl, schema = self.pl, self._schema()
+        exprs = []
+        for col, (low, up, low_value, up_value) in winsorizer.caps().items():
+            expr = pl.col(col)
+            if schema[col].is_integer() and all(value is None or value.is_integer() for value in (low_value, up_value)):
+                low_value, up_value = (None if low_value is None else int(low_value)), int(up_value)
+                dtype = schema[col]
+            else:
+                expr, dtype = expr.cast(pl.Float64), pl.Float64
+            capped = pl.when(expr > up).then(pl.lit(up_value))
+            if low is not None:
+                capped = capped.when(expr < low).then(pl.lit(low_value))
+            exprs.append(capped.otherwise(expr).cast(dtype).alias(col))
+        self.frame = self.frame.with_columns(exprs)
+
+    def add(self, name, operator, left, right):
+        left_col, right_col = self.pl.col(left), self.pl.col(right)
+        expr = left_col * right_col if operator == "*" else left_col + right_col
+        self.frame = self.frame.with_columns(expr.alias(name))
+
+    def aggregate(self, customer_col, aggregations):
+        pl, schema = self.pl, self._schema()
+        exprs = []
+        for name, (function, col) in aggregations.items():
+            expr = pl.col(col)
+            if function == "sum" and schema[col].is_integer():
+                expr = expr.cast(pl.Int64)
+            exprs.append((expr.n_unique() if function == "nunique" else getattr(expr, function)()).alias(name))
+        table = (self.frame.filter(pl.col(customer_col).is_not_null())
+                 .group_by(customer_col).agg(exprs).sort(customer_col).collect())
+        return table.to_pandas().set_index(customer_col)
+
+    def to_pandas(self, columns):
+        return self.frame.select(columns).collect().to_pandas()
+
+
+#############################################
+# DuckDB
+#############################################
+
+def _identifier(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def _literal(value):
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, str):
+        return "'%s'" % value.replace("'", "''")
+    return repr(value)
+
+
+class DuckDBFrame:
+
+    def __init__(self, source):
+        try:
+            import duckdb
+        except ImportError as error:
+            raise ImportError("backend='duckdb' needs the duckdb package (pip install duckdb)") from error
+        # embedded in-process database; DuckDB uses every core by default
+        self.connection = duckdb.connect()
+        if isinstance(source, str):
+            self.sql = "SELECT * FROM read_parquet(%s)" % _literal(source)
+        else:
+            self.connection.register("source", source)
+            self.sql = "SELECT * FROM source"
+
+    def _types(self):
+        return {row[0]: row[1] for row in self.connection.execute("DESCRIBE %s" % self.sql).fetchall()}
+
+    def _expr(self, node, types):
+        kind = node[0]
+        if kind == "not_null":
+            parts = []
+            for col in types if node[1] is None else node[1]:
+                part = "%s IS NOT NULL" % _identifier(col)
+                if types[col] in ("DOUBLE", "FLOAT"):
+                    part += " AND NOT isnan(%s)" % _identifier(col)  # pandas' NaN arrives as NaN, not NULL
+                parts.append(part)
+            return "(%s)" % " AND ".join(parts or ["TRUE"])
+        if kind == "not":
+            return "(NOT %s)" % self._expr(node[1], types)
+        if kind in ("and", "or"):
+            return "(%s)" % (" %s " % kind.upper()).join(self._expr(part, types) for part in node[1:])
+        col = _identifier(node[1])
+        if kind == "cancelled" and "is_cancelled" in types:
+            return "coalesce(is_cancelled, FALSE)"
+        if kind in ("contains", "cancelled"):
+            text = "C" if kind == "cancelled" else node[2]
+            return "coalesce(contains(CAST(%s AS VARCHAR), %s), FALSE)" % (col, _literal(text))
+        operator = {">": ">", "==": "=", "!=": "<>"}[kind]
+        expr = "%s %s %s" % (col, operator, _literal(node[2]))
+        if types[node[1]] in ("DOUBLE", "FLOAT"):
+            # NaN sorts above every number and equals itself in DuckDB; pandas treats it as missing
+            expr = "(%s AND NOT isnan(%s))" % (expr, col)
+            return "coalesce(%s OR isnan(%s), TRUE)" % (expr, col) if kind == "!=" else "coalesce(%s, FALSE)" % expr
+        return "coalesce(%s, %s)" % (expr, _literal(kind == "!="))
+
+    def clean(self, rules):
+        """Filters by every rule; returns the rows dropped per rule, counted as in helpers/cleaning.clean."""
+        types = self._types()
+        keep, counts, names = "TRUE", [], []
+        for name, spec in map(_spec, rules):
+            rule_keep = self._expr(spec, types)
+            counts.append("count_if(%s AND NOT %s)" % (keep, rule_keep))
+            names.append(name)
+            keep = "%s AND %s" % (keep, rule_keep)
+        dropped = {}
+        if counts:
+            row = self.connection.execute("SELECT %s FROM (%s)" % (", ".join(counts), self.sql)).fetchone()
+            dropped = {name: int(value) for name, value in zip(names, row)}
+        self.sql = "SELECT * FROM (%s) WHERE %s" % (self.sql, keep)
+        return dropped
+
+    def where(self, node):
+        self.sql = "SELECT * FROM (%s) WHERE %s" % (self.sql, self._expr(node, self._types()))
+
+    def quantiles(self, columns, probabilities):
+        probabilities = "[%s]" % ", ".join(repr(float(q)) for q in probabilities)
+        row = self.connection.execute("SELECT %s FROM (%s)" % (
+            ", ".join("quantile_cont(CAST(%s AS DOUBLE), %s)" % (_identifier(col), probabilities) for col in columns),
+            self.sql)).fetchone()
+        return np.asarray(row, dtype="float64").T
+
+    def clip(self, winsorizer):
+        types = self._types()
+        replace = []
+        for col, (low, up, low_value, up_value) in winsorizer.caps().items():
+            # compared with the limits, set to the (rounded) caps, as Winsorizer.transform
+            expr = _identifier(col)
+            integer = types[col] in ("TINYINT", "SMALLINT", "INTEGER", "BIGINT")
+            if integer and all(value is None or value.is_integer() for value in (low_value, up_value)):
+                low_value, up_value = (None if low_value is None else int(low_value)), int(up_value)
+            else:
+                expr = "CAST(%s AS DOUBLE)" % expr
+            cases = "WHEN %s > %r THEN %r" % (expr, up, up_value)
+            if low is not None:
+                cases += " WHEN %s < %r THEN %r" % (expr, low, low_value)
+            expr = "CASE %s ELSE %s END" % (cases, expr)
+            if integer and isinstance(up_value, int):
+                expr = "CAST(%s AS %s)" % (expr, types[col])
+            replace.append("%s AS %s" % (expr, _identifier(col)))
+        self.sql = "SELECT * REPLACE (%s) FROM (%s)" % (", ".join(replace), self.sql)
+
+    def add(self, name, operator, left, right):
+        self.sql = "SELECT *, %s %s %s AS %s FROM (%s)" % (_identifier(left), operator, _identifier(right),
+                                                           _identifier(name), self.sql)
+
+    def aggregate(self, customer_col, aggregations):
+        types = self._types()
+        exprs = []
+        for name, (function, col) in aggregations.items():
+            if function == "nunique":
+                expr = "count(DISTINCT %s)" % _identifier(col)
+            elif function == "sum" and types[col] in ("TINYINT", "SMALLINT", "INTEGER", "BIGINT"):
+                expr = "CAST(sum(%s) AS BIGINT)" % _identifier(col)
+            else:
+                expr = "%s(%s)" % (function, _identifier(col))
+            exprs.append("%s AS %s" % (expr, _identifier(name)))
+        customer = _identifier(customer_col)
+        query = "SELECT %s, %s FROM (%s) WHERE %s IS NOT NULL GROUP BY %s ORDER BY %s" % (
+            customer, ", ".join(exprs), self.sql, customer, customer, customer)
+        return self.connection.execute(query).df().set_index(customer_col)
+
+    def to_pandas(self, columns):
+        return self.connection.execute("SELECT %s FROM (%s)" % (", ".join(map(_identifier, columns)),
+                                                                self.sql)).df()
+
+
+def frame(source, backend):
+    """The source (DataFrame or Parquet path) as a lazy frame of the backend."""
+    _check_backend(backend)
+    if backend == "pandas":
+        raise ValueError("backend='pandas' runs in the scripts themselves")
+    return PolarsFrame(source) if backend == "polars" else DuckDBFrame(source)
+
+
+#############################################
+# Customer tables
+#############################################
+
+def _customer_index(table, source, customer_col):
+    # same index as the pandas path: the customer IDs in the dtype of the source column
+    table.index.name = customer_col
+    if isinstance(source, pd.DataFrame):
+        table.index = table.index.astype(source[customer_col].dtype)
+    return table
+
+
+def _datetimes(values):
+    return np.asarray(pd.to_datetime(values).to_numpy(), dtype="datetime64[ns]")
+
+
+def rfm_table(source, today_date, rules, backend, customer_col="Customer ID", date_col="InvoiceDate",
+              invoice_col="Invoice"):
+    """
+    clean -> TotalPrice -> rfm_metrics in the backend: the recency / frequency / monetary
+    table of helpers/rfm.rfm_metrics and the rows dropped per rule.
+    """
+    data = frame(source, backend)
+    dropped = data.clean(rules)
+    data.add("TotalPrice", "*", "Quantity", "Price")
+    table = data.aggregate(customer_col, {"last_date": ("max", date_col),
+                                          "frequency": ("nunique", invoice_col),
+                                          "monetary": ("sum", "TotalPrice")})
+    rfm = pd.DataFrame({"recency": days_between(today_date, _datetimes(table["last_date"])).astype("int64"),
+                        "frequency": table["frequency"].to_numpy(dtype="int64"),
+                        "monetary": table["monetary"].to_numpy(dtype="float64")}, index=table.index)
+    return _customer_index(rfm, source, customer_col), dropped
+
+
+def cltv_c_table(source, rules, backend, customer_col="Customer ID", invoice_col="Invoice"):
+    """clean -> TotalPrice -> helpers/cltv.cltv_c_metrics in the backend, and the rows dropped per rule."""
+    data = frame(source, backend)
+    dropped = data.clean(rules)
+    data.add("TotalPrice", "*", "Quantity", "Price")
+    table = data.aggregate(customer_col, {"total_transaction": ("nunique", invoice_col),
+                                          "total_unit": ("sum", "Quantity"),
+                                          "total_price": ("sum", "TotalPrice")})
+    table["total_transaction"] = table["total_transaction"].astype("int64")
+    return _customer_index(table, source, customer_col), dropped
+
+
+def cltv_p_table(source, today_date, rules, backend, winsorizer=None, customer_col="Customer ID",
+                 date_col="InvoiceDate", invoice_col="Invoice"):
+    """
+    clean -> winsorize -> TotalPrice -> helpers/cltv.cltv_p_metrics in the backend.
+
+    winsorizer: function (quantiles) -> fitted Winsorizer, called with the backend's
+    quantile function of the cleaned rows (see winsorizer_from_registry(quantiles=...)).
+    Returns (table, dropped, winsorizer).
+    """
+    data = frame(source, backend)
+    dropped = data.clean(rules)
+    if winsorizer is not None:
+        winsorizer = winsorizer(data.quantiles)
+        data.clip(winsorizer)
+    data.add("TotalPrice", "*", "Quantity", "Price")
+    table = data.aggregate(customer_col, {"first_date": ("min", date_col),
+                                          "last_date": ("max", date_col),
+                                          "frequency": ("nunique", invoice_col),
+                                          "monetary": ("sum", "TotalPrice")})
+    first_date, last_date = _datetimes(table["first_date"]), _datetimes(table["last_date"])
+    cltv = pd.DataFrame({"recency": days_between(last_date, first_date).astype("int64"),
+                         "T": days_between(today_date, first_date).astype("int64"),
+                         "frequency": table["frequency"].to_numpy(dtype="int64"),
+                         "monetary": table["monetary"].to_numpy(dtype="float64")}, index=table.index)
+    return _customer_index(cltv, source, customer_col), dropped, winsorizer
+
+
+def flo_table(source, backend, winsorizer=None, columns=None):
+    """
+    FLO data_prep in the backend: winsorize, order_num_total / customer_value_total and
+    the zero-value filter of create_cltv_df. Returns (customers, winsorizer); customers
+    holds master_id, the dates and the two totals.
+    """
+    data = frame(source, backend)
+    if winsorizer is not None:
+        winsorizer = winsorizer(data.quantiles)
+        data.clip(winsorizer)
+    data.add("order_num_total", "+", "order_num_total_ever_online", "order_num_total_ever_offline")
+    data.add("customer_value_total", "+", "customer_value_total_ever_offline", "customer_value_total_ever_online")
+    # ~(customer_value_total == 0) | (order_num_total == 0)
+    data.where(("or", ("!=", "customer_value_total", 0), ("==", "order_num_total", 0)))
+    customers = data.to_pandas(columns or ["master_id", "first_order_date", "last_order_date",
+                                           "order_num_total", "customer_value_total"])
+    return customers, winsorizer
@@ -0,0 +1,196 @@
+"""
+In-project BG-NBD model (Fader, Hardie & Lee 2005).
+
+Drop-in replacement for lifetimes.BetaGeoFitter where the scripts use
+BetaGeoFitter(penalizer_coef=0.001): the same log-parameterisation, time
+scaling, penalizer and starting point, but the log-likelihood and its
+analytic gradient are evaluated together in one vectorized NumPy pass.
+lifetimes differentiates the likelihood with autograd on every iteration.
+
+Not JIT-compiled: the pass is dominated by gammaln/digamma from scipy.special,
+which are already compiled ufuncs and which numba cannot call without extra
+packages.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from scipy.special import gammaln, digamma, hyp2f1
+
+from helpers.lifetimes_fit import compress_rows
+
+PARAM_NAMES = ["r", "alpha", "a", "b"]
+
+
+def frequency_groups(frequency, weights):
+    """Distinct frequencies, the row -> distinct index map and the weight of every distinct frequency."""
+    values, inverse = np.unique(frequency, return_inverse=True)
+    return values, inverse, np.bincount(inverse, weights=weights, minlength=len(values))
+
+
+def negative_log_likelihood(log_params, frequency, recency, T, weights, penalizer_coef, groups=None):
+    """
+    Penalized mean negative log-likelihood and its gradient with respect to the log-parameters.
+
+    The gammaln/digamma terms only depend on the (integer) frequency, so they are
+    evaluated once per distinct frequency (groups, see frequency_groups) and
+    only the terms with recency and T are evaluated per row.
+    """
+    params = np.exp(log_params)
+    r, alpha, a, b = params
+    x, t_x = frequency, recency
+    x_values, x_inverse, x_weights = frequency_groups(frequency, weights) if groups is None else groups
+    x_pos = x > 0
+
+    # per distinct frequency
+    b_x1_values = b + np.maximum(x_values, 1) - 1
+    A_12 = (gammaln(r + x_values) - gammaln(r) + r * np.log(alpha)
+            + gammaln(a + b) + gammaln(b + x_values) - gammaln(b) - gammaln(a + b + x_values))
+    psi_ab, psi_abx = digamma(a + b), digamma(a + b + x_values)
+    d_r_12 = digamma(r + x_values) - digamma(r) + np.log(alpha)
+    d_a_12 = psi_ab - psi_abx
+    d_b_12 = psi_ab + digamma(b + x_values) - digamma(b) - psi_abx
+
+    # per row
+    b_x1 = b_x1_values[x_inverse]
+    log_alpha_T = np.log(alpha + T)
+    log_alpha_tx = np.log(alpha + t_x)
+    A_3 = -(r + x) * log_alpha_T
+    A_4 = np.log(a) - np.log(b_x1) - (r + x) * log_alpha_tx
+
+    # log(exp(A_3) + [x > 0] exp(A_4)) without overflow; w_4 is the share of the second term
+    top = np.where(x_pos, np.maximum(A_3, A_4), A_3)
+    e_3 = np.exp(A_3 - top)
+    e_4 = np.where(x_pos, np.exp(A_4 - top), 0.0)
+    total = e_3 + e_4
+    w_4 = weights * e_4 / total
+    w_3 = weights - w_4
+
+    weight_sum = weights.sum()
+    ll = x_weights @ A_12 + weights @ (np.log(total) + top)
+    grad = np.array([x_weights @ d_r_12 - w_3 @ log_alpha_T - w_4 @ log_alpha_tx,
+                     r / alpha * weight_sum - (r + x) @ (w_3 / (alpha + T) + w_4 / (alpha + t_x)),
+                     x_weights @ d_a_12 + w_4.sum() / a,
+                     x_weights @ d_b_12 - (w_4 / b_x1).sum()])
+
+    value = -ll / weight_sum + penalizer_coef * (params ** 2).sum()
+    grad = (-grad / weight_sum + 2 * penalizer_coef * params) * params
+    return value, grad
+
+
+def _hyp_term(params, t, frequency, T):
+    # 1 - 2F1(...) * ((alpha + T) / (alpha + t + T)) ** (r + x): the only part that depends on t
+    r, alpha, a, b = params
+    x = frequency
+    _a = r + x
+    _b = b + x
+    _c = a + b + x - 1
+    _z = t / (alpha + T + t)
+    with np.errstate(divide="ignore"):
+        ln_hyp_term = np.log(hyp2f1(_a, _b, _c, _z))
+        # same fallback as lifetimes when the series overflows
+        ln_hyp_term_alt = np.log(hyp2f1(_c - _a, _c - _b, _c, _z)) + (_c - _a - _b) * np.log(1 - _z)
+    ln_hyp_term = np.where(np.isinf(ln_hyp_term), ln_hyp_term_alt, ln_hyp_term)
+    return 1 - np.exp(ln_hyp_term + (r + x) * np.log((alpha + T) / (alpha + t + T)))
+
+
+def _customer_term(params, frequency, recency, T):
+    # first_term / denominator of equation (10): independent of t
+    r, alpha, a, b = params
+    x = frequency
+    first_term = (a + b + x - 1) / (a - 1)
+    denominator = 1 + (x > 0) * (a / (b + x - 1)) * ((alpha + T) / (alpha + recency)) ** (r + x)
+    return first_term / denominator
+
+
+def expected_purchases(params, t, frequency, recency, T):
+    """E[X(t) | frequency, recency, T]; broadcasts t against the customer arrays."""
+    return _customer_term(params, frequency, recency, T) * _hyp_term(params, t, frequency, T)
+
+
+def predict_horizons(model, horizons, frequency, recency, T):
+    """
+    Expected purchases for several horizons at once, as a customers x horizons DataFrame.
+
+    model is a fitted BGNBDFitter or lifetimes.BetaGeoFitter. The t-independent
+    factor is computed once per customer; the hypergeometric term only depends on
+    (frequency, T, t), so it is evaluated once per distinct (frequency, T) pair for
+    all horizons in one broadcast and gathered back to the customers.
+    """
+    params = np.asarray([model.params_[name] for name in PARAM_NAMES])
+    horizon_values = np.atleast_1d(np.asarray(horizons, dtype="float64"))
+    x = np.asarray(frequency, dtype="float64")
+    (x_unique, T_unique), _, inverse = compress_rows(x, np.asarray(T, dtype="float64"))
+
+    hyp = _hyp_term(params, horizon_values[None, :], x_unique[:, None], T_unique[:, None])
+    values = _customer_term(params, x, np.asarray(recency, dtype="float64"),
+                            np.asarray(T, dtype="float64"))[:, None] * hyp[inverse]
+    index = frequency.index if isinstance(frequency, pd.Series) else None
+    return pd.DataFrame(values, index=index, columns=list(np.atleast_1d(horizons)))
+
+
+class BGNBDFitter:
+
+    def __init__(self, penalizer_coef=0.0):
+        self.penalizer_coef = penalizer_coef
+
+    def fit(self, frequency, recency, T, weights=None, initial_params=None, tol=1e-7, index=None, **kwargs):
+        """
+        Fits r, alpha, a, b. initial_params are log-parameters on the internal time
+        scale, like lifetimes; see params_to_initial() to warm-start from a fitted model.
+        kwargs are BFGS options, e.g. hess_inv0=model.hess_inv_ together with the warm start.
+        """
+        frequency = np.asarray(frequency).astype(int)
+        recency = np.asarray(recency, dtype="float64")
+        T = np.asarray(T, dtype="float64")
+        weights = np.ones_like(recency) if weights is None else np.asarray(weights, dtype="float64")
+        if np.any(recency > T):
+            raise ValueError("Some values in recency vector are larger than T vector.")
+        if np.any(frequency < 0):
+            raise ValueError("There exist negative values in the frequency vector.")
+
+        # time is rescaled so that max(T) == 1, as in lifetimes; the penalizer acts on the scaled alpha
+        self._scale = 1.0 / T.max()
+        x0 = 0.1 * np.ones(4) if initial_params is None else np.asarray(initial_params, dtype="float64")
+        output = minimize(negative_log_likelihood, x0, jac=True, method="BFGS", tol=tol,
+                          args=(frequency, recency * self._scale, T * self._scale, weights, self.penalizer_coef,
+                                frequency_groups(frequency, weights)),
+                          options=kwargs)
+        if not output.success:
+            # as lifetimes (ConvergenceError, a ValueError): a fit that stopped early is not used
+            raise ValueError("The model did not converge (%s). Try adding a larger penalizer to see if that helps "
+                             "convergence." % output.message)
+
+        self.params_ = pd.Series(np.exp(output.x), index=PARAM_NAMES)
+        self.params_["alpha"] /= self._scale
+        self._negative_log_likelihood_ = output.fun
+        self.n_iterations_ = output.nit
+        # BFGS inverse Hessian in log-parameter space; passing it back as hess_inv0 makes warm starts converge
+        # quickly. BFGS only accepts an exactly symmetric positive definite hess_inv0 (None otherwise).
+        hess_inv = (output.hess_inv + output.hess_inv.T) / 2
+        self.hess_inv_ = hess_inv if np.all(np.linalg.eigvalsh(hess_inv) > 0) else None
+        self.data = pd.DataFrame({"frequency": frequency, "recency": recency, "T": T, "weights": weights},
+                                 index=index)
+        return self
+
+    def params_to_initial(self, T_max):
+        """Log-parameters of this model on the time scale of data with max(T) == T_max (for warm starts)."""
+        params = self.params_.to_numpy().copy()
+        params[1] /= T_max
+        return np.log(params)
+
+    def _params(self):
+        if not hasattr(self, "params_"):
+            raise ValueError("Model has not been fit yet. Please call the .fit method first.")
+        return self.params_[PARAM_NAMES].to_numpy()
+
+    def conditional_expected_number_of_purchases_up_to_time(self, t, frequency, recency, T):
+        values = expected_purchases(self._params(), t, np.asarray(frequency), np.asarray(recency), np.asarray(T))
+        if isinstance(frequency, pd.Series):
+            return pd.Series(values, index=frequency.index)
+        return values
+
+    predict = conditional_expected_number_of_purchases_up_to_time
+
+    def predict_horizons(self, horizons, frequency, recency, T):
+        return predict_horizons(self, horizons, frequency, recency, T)
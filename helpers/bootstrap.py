@@ -0,0 +1,98 @@
+"""
+Bootstrap intervals for BG-NBD / Gamma-Gamma CLTV predictions.
+
+A bootstrap replicate resamples the customers with replacement and refits both
+models. Customers with the same (frequency, recency, T, monetary) are
+interchangeable, so a replicate is drawn as multinomial counts over the unique
+rows of the customer table and the refits run on those weights, never on a
+materialised resample. Every refit starts from the parameters of the point
+fit (and BG-NBD from its BFGS inverse Hessian), which is close to the
+optimum of any replicate. Replicates are spread over worker processes.
+
+The intervals reflect the parameter uncertainty of the fitted models: each
+replicate's parameters score the actual customers, giving per-customer and
+per-segment CLTV percentiles.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from lifetimes import GammaGammaFitter
+
+from helpers.bgnbd import BGNBDFitter
+from helpers.cltv import customer_lifetime_value_horizons
+from helpers.lifetimes_fit import compress_rows
+from helpers.model_registry import initial_params_from
+from helpers.parallel import default_n_jobs
+
+
+def _replicates(table, counts, start, seeds, time, freq, discount_rate):
+    """CLTV of every unique row under the refitted models of each seed (replicates x unique rows)."""
+    frequency, recency, T, monetary = table
+    (bg_f, bg_r, bg_T), _, bg_inverse = compress_rows(frequency, recency, T)
+    (gg_f, gg_m), _, gg_inverse = compress_rows(frequency, monetary)
+    clv = np.full((len(seeds), len(frequency)), np.nan)
+
+    for i, seed in enumerate(seeds):
+        weights = np.random.default_rng(seed).multinomial(counts.sum(), counts / counts.sum())
+        bg_weights = np.bincount(bg_inverse, weights=weights, minlength=len(bg_f))
+        gg_weights = np.bincount(gg_inverse, weights=weights, minlength=len(gg_f))
+        bg_rows, gg_rows = bg_weights > 0, gg_weights > 0
+        bgf = BGNBDFitter(penalizer_coef=start["penalizers"][0])
+        ggf = GammaGammaFitter(penalizer_coef=start["penalizers"][1])
+        try:
+            bgf.fit(bg_f[bg_rows], bg_r[bg_rows], bg_T[bg_rows], weights=bg_weights[bg_rows],
+                    initial_params=initial_params_from(start["bgf"], bg_T[bg_rows].max()),
+                    **({"hess_inv0": start["hess_inv"]} if start["hess_inv"] is not None else {}))
+            ggf.fit(gg_f[gg_rows], gg_m[gg_rows], weights=gg_weights[gg_rows],
+                    initial_params=initial_params_from(start["ggf"]))
+        except ValueError:
+            continue  # a replicate that does not converge is left out of the percentiles
+        clv[i] = customer_lifetime_value_horizons(bgf, ggf, frequency, recency, T, monetary, times=[time],
+                                                  freq=freq, discount_rate=discount_rate).to_numpy()[:, 0]
+    return clv
+
+
+def bootstrap_cltv(bgf, ggf, frequency, recency, T, monetary_value, segments=None, n_boot=200, time=6, freq="W",
+                   discount_rate=0.01, percentiles=(5, 50, 95), n_jobs=None, seed=0):
+    """
+    Percentile intervals of ggf.customer_lifetime_value(bgf, ..., time=time) from n_boot refits.
+
+    bgf / ggf are the fitted point models (BGNBDFitter or BetaGeoFitter, GammaGammaFitter);
+    the refits use BGNBDFitter and GammaGammaFitter with the same penalizers.
+    Returns (customer_intervals, segment_intervals): clv_p<percentile> columns per customer,
+    and per segment (segments aligned with frequency) the percentiles of the segment's CLTV total.
+    segment_intervals is None without segments.
+    """
+    index = frequency.index if isinstance(frequency, pd.Series) else None
+    frequency, recency, T, monetary_value = (np.asarray(column, dtype="float64")
+                                             for column in (frequency, recency, T, monetary_value))
+    table, counts, inverse = compress_rows(frequency, recency, T, monetary_value)
+    start = {"bgf": bgf.params_, "ggf": ggf.params_,
+             "penalizers": (bgf.penalizer_coef, ggf.penalizer_coef),
+             "hess_inv": getattr(bgf, "hess_inv_", None)}
+
+    n_jobs = default_n_jobs() if n_jobs in (None, -1) else n_jobs
+    seeds = np.random.SeedSequence(seed).spawn(n_boot)
+    batches = [seeds[i::n_jobs] for i in range(min(n_jobs, n_boot))]
+    with ProcessPoolExecutor(max_workers=len(batches)) as pool:
+        clv = np.vstack(list(pool.map(_replicates, [table] * len(batches), [counts] * len(batches),
+                                      [start] * len(batches), batches, [time] * len(batches),
+                                      [freq] * len(batches), [discount_rate] * len(batches))))
+
+    columns = ["clv_p%g" % q for q in percentiles]
+    customer_intervals = pd.DataFrame(np.nanpercentile(clv, percentiles, axis=0).T[inverse],
+                                      index=index, columns=columns)
+    if segments is None:
+        return customer_intervals, None
+
+    # segment totals per replicate: unique-row CLTV x number of customers of the row in the segment
+    codes, labels = pd.factorize(pd.Series(segments), sort=True)
+    members = np.zeros((len(counts), len(labels)))
+    np.add.at(members, (inverse[codes >= 0], codes[codes >= 0]), 1)
+    totals = clv @ members
+    segment_intervals = pd.DataFrame(np.nanpercentile(totals, percentiles, axis=0).T,
+                                     index=pd.Index(labels, name="segment"), columns=columns)
+    segment_intervals.insert(0, "n_customers", members.sum(axis=0).astype(int))
+    return customer_intervals, segment_intervals
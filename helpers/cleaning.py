@@ -0,0 +1,79 @@
+"""
+Declarative row-cleaning rules for the transaction frames.
+
+The pipelines used to clean with a chain of filters (dropna(inplace=True),
+then df[~df["Invoice"].str.contains("C")], then df[df["Quantity"] > 0], ...),
+copying the whole frame at every step and mutating the caller's frame with the
+in-place dropna. clean() evaluates every rule on the input into one boolean
+mask and takes the kept rows once; the input is never modified.
+
+A rule is a (name, function) pair; function(dataframe) returns a boolean array
+or Series of the rows to keep. The number of rows each rule dropped is counted
+in rule order, a row dropped by several rules counting for the first one, so
+the counts add up to the rows removed (as with the chained filters).
+
+The rules built here also carry their condition as data (rule.spec, a small
+expression tree), so helpers/backends.py can run them on Polars or DuckDB:
+
+    ("not_null", columns)          columns None = every column
+    (">" | "==" | "!=", column, value)
+    ("contains", column, text)
+    ("cancelled", invoice_col)     is_cancelled, or invoice_col contains "C"
+    ("not", node)    ("and", node, ...)    ("or", node, ...)
+
+A missing value fails every comparison except "!=", as in pandas.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _keep(values):
+    # nullable columns (Int32, boolean) give NA for missing values; those rows are dropped
+    if isinstance(values, pd.Series):
+        return values.to_numpy(dtype=bool, na_value=False)
+    return np.asarray(values, dtype=bool)
+
+
+def _rule(name, function, spec):
+    function.spec = spec
+    return name, function
+
+
+def not_null(columns=None):
+    """Rows without missing values in columns (all columns by default), like dropna()."""
+    def rule(dataframe):
+        keep = np.ones(len(dataframe), dtype=bool)
+        for col in dataframe.columns if columns is None else columns:
+            keep &= dataframe[col].notna().to_numpy()
+        return keep
+    return _rule("not_null", rule, ("not_null", None if columns is None else tuple(columns)))
+
+
+def not_cancelled(invoice_col="Invoice"):
+    """Rows whose invoice has no "C" (cancellations); uses is_cancelled of the compact schema when present."""
+    def rule(dataframe):
+        if "is_cancelled" in dataframe:
+            return ~dataframe["is_cancelled"].to_numpy(dtype=bool)
+        return ~dataframe[invoice_col].str.contains("C", na=False, regex=False).to_numpy(dtype=bool)
+    return _rule("not_cancelled", rule, ("not", ("cancelled", invoice_col)))
+
+
+def positive(column):
+    """Rows with column > 0."""
+    return _rule("%s_positive" % column, lambda dataframe: dataframe[column] > 0, (">", column, 0))
+
+
+def clean(dataframe, rules):
+    """
+    Rows of dataframe kept by every rule, as a new frame, and the rows dropped per rule.
+
+    Returns (cleaned, dropped): dropped maps each rule name to the number of rows it removed.
+    """
+    keep = np.ones(len(dataframe), dtype=bool)
+    dropped = {}
+    for name, rule in rules:
+        rule_keep = _keep(rule(dataframe))
+        dropped[name] = int(np.count_nonzero(keep & ~rule_keep))
+        keep &= rule_keep
+    return dataframe.take(np.flatnonzero(keep)), dropped
@@ -0,0 +1,82 @@
+"""
+Vectorized per-customer aggregates for the CLTV pipelines.
+
+Same tables as the groupby('Customer ID').agg({...: lambda ...}) blocks in
+cltv/cltv.py (create_cltv_c) and cltv_prediction/cltv_prediction.py
+(create_cltv_p), built from the kernels in helpers/rfm.py, and a CLTV
+engine that serves several time= horizons from one computation.
+"""
+
+import numpy as np
+import pandas as pd
+
+from helpers.bgnbd import predict_horizons
+from helpers.rfm import (encode_customers, distinct_per_customer, sum_per_customer,
+                         first_date_per_customer, last_date_per_customer, days_between)
+
+
+def _encoded(dataframe, customer_col):
+    dataframe = dataframe[dataframe[customer_col].notna()]
+    codes, customers = encode_customers(dataframe, customer_col)
+    return dataframe, codes, customers
+
+
+def cltv_c_metrics(dataframe, customer_col="Customer ID"):
+    """total_transaction, total_unit, total_price per customer (create_cltv_c)."""
+    dataframe, codes, customers = _encoded(dataframe, customer_col)
+    n_customers = len(customers)
+    total_unit = sum_per_customer(codes, dataframe["Quantity"].to_numpy(), n_customers)
+    if dataframe["Quantity"].dtype.kind in "iu":
+        total_unit = total_unit.astype("int64")
+    return pd.DataFrame({"total_transaction": distinct_per_customer(codes, dataframe["Invoice"], n_customers),
+                         "total_unit": total_unit,
+                         "total_price": sum_per_customer(codes, dataframe["TotalPrice"].to_numpy(), n_customers)},
+                        index=customers)
+
+
+def cltv_p_metrics(dataframe, today_date, customer_col="Customer ID"):
+    """recency, T (days), frequency and total monetary per customer (create_cltv_p, before the weekly scaling)."""
+    dataframe, codes, customers = _encoded(dataframe, customer_col)
+    n_customers = len(customers)
+    dates = dataframe["InvoiceDate"].to_numpy()
+    first_date = first_date_per_customer(codes, dates, n_customers)
+    last_date = last_date_per_customer(codes, dates, n_customers)
+    return pd.DataFrame({"recency": days_between(last_date, first_date).astype("int64"),
+                         "T": days_between(today_date, first_date).astype("int64"),
+                         "frequency": distinct_per_customer(codes, dataframe["Invoice"], n_customers),
+                         "monetary": sum_per_customer(codes, dataframe["TotalPrice"].to_numpy(), n_customers)},
+                        index=customers)
+
+
+#############################################
+# Discounted CLTV for several horizons
+#############################################
+
+# periods of the T unit per month, as in lifetimes' customer_lifetime_value
+FREQ_FACTOR = {"W": 4.345, "M": 1.0, "D": 30, "H": 30 * 24}
+
+
+def customer_lifetime_value_horizons(transaction_prediction_model, ggf, frequency, recency, T, monetary_value,
+                                     times=(1, 6, 12), discount_rate=0.01, freq="D"):
+    """
+    ggf.customer_lifetime_value(...) for every `time` in times, from one computation.
+
+    lifetimes loops month by month and calls predict twice per month for every
+    horizon. Here the cumulative expected purchases at every month end up to
+    max(times) come from one predict_horizons call; the monthly increments are
+    discounted and summed with a cumulative sum, and each horizon is a column
+    of the result (customers x times, columns labelled by time in months).
+    """
+    adjusted_monetary_value = np.asarray(ggf.conditional_expected_average_profit(frequency, monetary_value))
+    factor = FREQ_FACTOR[freq]
+    months = np.arange(1, max(times) + 1)
+
+    cumulative = predict_horizons(transaction_prediction_model, np.r_[0.0, months * factor],
+                                  frequency, recency, T).to_numpy()
+    expected_number_of_transactions = np.diff(cumulative, axis=1)
+    discounted = (adjusted_monetary_value[:, None] * expected_number_of_transactions
+                  / (1 + discount_rate) ** months[None, :])
+    clv = np.cumsum(discounted, axis=1)[:, np.asarray(times) - 1]
+
+    index = frequency.index if isinstance(frequency, pd.Series) else None
+    return pd.DataFrame(clv, index=index, columns=list(times))
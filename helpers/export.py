@@ -0,0 +1,165 @@
+"""
+Bulk export of customer lists and scored tables.
+
+export(dataframe, path) picks the writer from the extension:
+
+    .parquet                    Parquet, one row group per chunk
+    .arrow / .feather / .ipc    Arrow IPC file, one record batch per chunk
+    .csv / .csv.gz              CSV (gzip-compressed for .csv.gz) by Arrow's C++ writer
+    .xlsx                       Excel, only for an explicit .xlsx path or file_format="xlsx"
+
+The frame is converted to Arrow chunk_rows rows at a time and every chunk is
+written before the next one is converted, so no second full copy of the table
+is ever in memory.
+
+CSV is written by Arrow without quotes, so strings, integers and the index
+column come out byte for byte as to_csv writes them. Arrow cannot quote only
+the values that need it: a chunk holding a value with a comma, quote or
+newline has all its string fields quoted (valid CSV, unlike to_csv's bytes).
+Other values are formatted by Arrow (2 rather than 2.0, timestamps with
+microseconds, true / false); pd.read_csv reads them back unchanged.
+
+export_many writes several lists at once. Arrow releases the GIL while
+encoding, compressing and writing, so a thread pool runs the writers in
+parallel without pickling the frames.
+
+Excel sheets hold at most EXCEL_MAX_ROWS rows (header included); larger frames
+are written truncated with a warning, and an Excel export of more than
+EXCEL_WARN_ROWS rows warns that it will be slow.
+"""
+
+import gzip
+import itertools
+import os
+import re
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from helpers.parallel import default_n_jobs
+
+EXCEL_MAX_ROWS = 1_048_576
+EXCEL_WARN_ROWS = 100_000
+GZIP_LEVEL = 6
+STRUCTURAL = re.compile(r'[,"\r\n]')
+FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow",
+           ".csv": "csv", ".csv.gz": "csv.gz", ".xlsx": "xlsx"}
+
+
+def format_for(path):
+    for extension, file_format in sorted(FORMATS.items(), key=lambda item: -len(item[0])):
+        if path.lower().endswith(extension):
+            return file_format
+    raise ValueError("Unknown export format for %r (known: %s)" % (path, ", ".join(sorted(FORMATS))))
+
+
+def _index_names(dataframe):
+    # the index is written as the first column(s), named as in to_csv (empty when unnamed)
+    return [name if name is not None else "" for name in dataframe.index.names]
+
+
+def _tables(dataframe, index, chunk_rows):
+    import pyarrow as pa
+
+    # one chunk at a time: the index is reset per chunk, so the frame itself is never copied
+    for start in range(0, max(len(dataframe), 1), chunk_rows):
+        chunk = dataframe.iloc[start:start + chunk_rows]
+        if index:
+            chunk = chunk.reset_index(names=_index_names(chunk))
+        yield pa.Table.from_pandas(chunk, preserve_index=False)
+
+
+def _plain_schema(schema):
+    # the CSV writer does not take dictionary (categorical) columns
+    import pyarrow as pa
+
+    return pa.schema([pa.field(field.name, field.type.value_type if pa.types.is_dictionary(field.type) else field.type)
+                      for field in schema], metadata=schema.metadata)
+
+
+def _csv_chunk(table, sink, header):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    # unquoted like to_csv; Arrow refuses that for a value with a delimiter, quote or newline, and such a
+    # chunk is written in Arrow's "needed" style, which quotes every string field of the chunk
+    names = "none" if not any(STRUCTURAL.search(name) for name in table.column_names) else "needed"
+    for values in ("none", "needed"):
+        buffer = pa.BufferOutputStream()
+        try:
+            pa_csv.write_csv(table, buffer, pa_csv.WriteOptions(include_header=header, quoting_style=values,
+                                                                quoting_header=names))
+            break
+        except pa.ArrowInvalid:
+            if values == "needed":
+                raise
+    sink.write(buffer.getvalue())
+
+
+def _write_arrow(dataframe, path, file_format, index, chunk_rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tables = _tables(dataframe, index, chunk_rows)
+    first = next(tables)
+    schema, sink, writer = first.schema, None, None
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(path, schema)
+    elif file_format == "arrow":
+        writer = pa.ipc.new_file(path, schema)
+    else:
+        schema = _plain_schema(schema)
+        # zlib level 6 (gzip's default) instead of Arrow's level 9: ~3x faster for a ~10% larger file
+        sink = gzip.open(path, "wb", compresslevel=GZIP_LEVEL) if file_format == "csv.gz" else pa.OSFile(path, "wb")
+    try:
+        # every chunk is cast to the first one's schema (e.g. a chunk where a string column is all null)
+        for position, table in enumerate(itertools.chain([first], tables)):
+            if writer is None:
+                _csv_chunk(table.cast(schema), sink, header=position == 0)
+            else:
+                writer.write_table(table.cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
+        if sink is not None:
+            sink.close()
+
+
+def _write_excel(dataframe, path, index):
+    if len(dataframe) > EXCEL_MAX_ROWS - 1:
+        warnings.warn("%s: %d rows do not fit in an Excel sheet; only the first %d are written"
+                      % (path, len(dataframe), EXCEL_MAX_ROWS - 1), stacklevel=3)
+        dataframe = dataframe.iloc[:EXCEL_MAX_ROWS - 1]
+    elif len(dataframe) > EXCEL_WARN_ROWS:
+        warnings.warn("%s: writing %d rows to Excel is slow; Parquet or CSV are much faster"
+                      % (path, len(dataframe)), stacklevel=3)
+    dataframe.to_excel(path, index=index)
+
+
+def export(data, path, file_format=None, index=True, chunk_rows=1_000_000):
+    """
+    Writes a DataFrame or Series to path in the format of its extension (or file_format).
+
+    index=True writes the index as the first column, as to_csv / to_excel do.
+    Returns path.
+    """
+    file_format = file_format or format_for(path)
+    if file_format not in FORMATS.values():
+        raise ValueError("Unknown export format %r" % file_format)
+    dataframe = data.to_frame() if isinstance(data, pd.Series) else data
+    if file_format == "xlsx":
+        _write_excel(dataframe, path, index)
+        return path
+    tmp = path + ".tmp"
+    _write_arrow(dataframe, tmp, file_format, index, chunk_rows)
+    os.replace(tmp, path)
+    return path
+
+
+def export_many(outputs, n_jobs=None, **kwargs):
+    """Writes {path: DataFrame or Series} in parallel threads; keyword arguments go to export. Returns the paths."""
+    n_jobs = default_n_jobs() if n_jobs in (None, -1) else n_jobs
+    with ThreadPoolExecutor(max_workers=max(1, min(n_jobs, len(outputs)))) as pool:
+        futures = [pool.submit(export, data, path, **kwargs) for path, data in outputs.items()]
+        return [future.result() for future in futures]
@@ -0,0 +1,149 @@
+"""
+Typed loader for flo_data_20k.csv (and FLO-style exports of any size).
+
+pd.read_csv gives every column as object / float64; the scripts then convert
+the date columns one by one with format inference and search
+interested_in_categories_12 ("[KADIN, AKTIFCOCUK]") with str.contains.
+read_flo parses the file once with an explicit schema:
+
+    *_date columns                     datetime64, fixed format %Y-%m-%d
+    order_channel, last_order_channel  category
+    order_num_total_ever_*             int32
+    customer_value_total_ever_*        float64
+    interested_in_categories_12        category, plus
+    interested_in_categories_mask      one bit per category (FLO_CATEGORIES order)
+
+and keeps the result as Parquet in the cache directory of helpers/ingest.py
+(invalidated when the CSV changes), so reloads skip parsing. Categories that
+are not in FLO_CATEGORIES get the next bits; the full list is in
+dataframe.attrs["interested_in_categories"] and in the cache manifest.
+
+has_category(mask, "COCUK") is the bitmask version of
+str.contains("COCUK"): substring semantics, so AKTIFCOCUK matches as well.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from helpers.ingest import _write_manifest, _write_parquet, cache_dir_for, file_fingerprint, fresh_manifest
+
+FLO_CATEGORIES = ["KADIN", "ERKEK", "COCUK", "AKTIFSPOR", "AKTIFCOCUK"]
+CATEGORY_COLUMN = "interested_in_categories_12"
+MASK_COLUMN = "interested_in_categories_mask"
+CHANNEL_COLUMNS = ["order_channel", "last_order_channel"]
+COUNT_COLUMNS = ["order_num_total_ever_online", "order_num_total_ever_offline"]
+VALUE_COLUMNS = ["customer_value_total_ever_offline", "customer_value_total_ever_online"]
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def _tokens(category_list):
+    # "[KADIN, AKTIFCOCUK]" -> ["KADIN", "AKTIFCOCUK"]; "[]" -> []
+    return [token.strip() for token in str(category_list).strip("[]").split(",") if token.strip()]
+
+
+def category_masks(values, categories=None):
+    """
+    Bitmask per row of category lists such as "[KADIN, AKTIFCOCUK]".
+
+    Only the distinct lists are parsed. Returns (masks, categories): categories is
+    FLO_CATEGORIES (or the given list) extended with the unknown tokens, bit i = categories[i].
+    """
+    categories = list(FLO_CATEGORIES if categories is None else categories)
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=True)
+    unique_masks = []
+    for category_list in uniques:
+        mask = 0
+        for token in _tokens(category_list):
+            if token not in categories:
+                categories.append(token)
+            mask |= 1 << categories.index(token)
+        unique_masks.append(mask)
+    dtype = "uint8" if len(categories) <= 8 else "uint16" if len(categories) <= 16 else "uint32" \
+        if len(categories) <= 32 else "uint64"
+    unique_masks = np.asarray(unique_masks + [0], dtype=dtype)  # missing lists (code -1) -> no category
+    return unique_masks[codes], categories
+
+
+def category_bits(name, categories=None, substring=True):
+    """Bits of the categories matching name: every category containing it (substring=True) or name only."""
+    categories = FLO_CATEGORIES if categories is None else categories
+    bits = 0
+    for i, category in enumerate(categories):
+        if (name in category) if substring else (name == category):
+            bits |= 1 << i
+    return bits
+
+
+def has_category(masks, name, categories=None, substring=True):
+    """Boolean array: rows whose category list contains name, as str.contains(name) on the raw lists."""
+    masks = np.asarray(masks)
+    return (masks & masks.dtype.type(category_bits(name, categories, substring))) != 0
+
+
+def parse_flo(dataframe, categories=None):
+    """Applies the typed schema to a raw flo_data frame (pd.read_csv output); returns (frame, categories)."""
+    dataframe = dataframe.copy()
+    for col in dataframe.columns[dataframe.columns.str.contains("date")]:
+        if not pd.api.types.is_datetime64_any_dtype(dataframe[col]):
+            dataframe[col] = pd.to_datetime(dataframe[col], format=DATE_FORMAT)
+    for col in CHANNEL_COLUMNS:
+        if col in dataframe:
+            dataframe[col] = dataframe[col].astype("category")
+    for col in COUNT_COLUMNS:
+        # the counts are written as floats ("4.0"); int32 only when they are all whole numbers
+        if col in dataframe and dataframe[col].notna().all() and np.all(np.mod(dataframe[col], 1) == 0):
+            dataframe[col] = dataframe[col].astype("int32")
+    for col in VALUE_COLUMNS:
+        if col in dataframe:
+            dataframe[col] = dataframe[col].astype("float64")
+    if CATEGORY_COLUMN in dataframe:
+        masks, categories = category_masks(dataframe[CATEGORY_COLUMN], categories)
+        dataframe[CATEGORY_COLUMN] = dataframe[CATEGORY_COLUMN].astype("category")
+        dataframe[MASK_COLUMN] = masks
+        dataframe.attrs["interested_in_categories"] = categories
+    return dataframe, categories
+
+
+def _read_csv(path):
+    # pyarrow's multithreaded reader parses the ISO dates and the string columns
+    # straight into typed arrays, several times faster than pd.read_csv + pd.to_datetime
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    header = pd.read_csv(path, nrows=0).columns
+    column_types = {col: pa.timestamp("us") for col in header if "date" in col}
+    column_types.update({col: pa.float64() for col in COUNT_COLUMNS + VALUE_COLUMNS if col in header})
+    table = pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(column_types=column_types))
+    return table.to_pandas()
+
+
+def build_flo_cache(path, cache_dir=None):
+    """Parses the CSV with the typed schema into <cache>/flo.parquet and returns the manifest."""
+    directory = cache_dir_for(path, cache_dir)
+    os.makedirs(directory, exist_ok=True)
+    stat = os.stat(path)
+
+    dataframe, categories = parse_flo(_read_csv(path))
+    _write_parquet(dataframe, os.path.join(directory, "flo.parquet"))
+
+    manifest = {"source": os.path.abspath(path),
+                "fingerprint": file_fingerprint(path),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "file": "flo.parquet",
+                "categories": categories}
+    _write_manifest(directory, manifest)
+    return manifest
+
+
+def read_flo(path, cache_dir=None):
+    """flo_data CSV in the typed schema, parsed once and then read from the Parquet cache."""
+    manifest = fresh_manifest(path, cache_dir, build_flo_cache)
+    if "file" not in manifest:
+        # a manifest written by another loader for the same file name
+        manifest = build_flo_cache(path, cache_dir)
+    dataframe = pd.read_parquet(os.path.join(cache_dir_for(path, cache_dir), manifest["file"]))
+    dataframe.attrs["interested_in_categories"] = manifest["categories"]
+    return dataframe
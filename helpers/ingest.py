@@ -0,0 +1,117 @@
+"""
+Columnar cache for the raw input files.
+
+pd.read_excel is by far the slowest step of every script. The first call
+converts every sheet of the workbook to Parquet in a single pass and the
+following calls read the Parquet file instead. The cache is invalidated
+automatically when the source file's fingerprint changes.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
+
+
+def file_fingerprint(path, block_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cache_dir_for(path, cache_dir=None):
+    # default: <folder of the source>/.cache/<file name without extension>
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), ".cache")
+    return os.path.join(cache_dir, stem)
+
+
+def _slug(name):
+    return re.sub(r"[^0-9A-Za-z]+", "_", str(name)).strip("_")
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(directory, manifest):
+    tmp = os.path.join(directory, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(directory, "manifest.json"))
+
+
+def fresh_manifest(path, cache_dir, build):
+    """Return the cache manifest for `path`, calling build(path, cache_dir) when it is stale."""
+    stat = os.stat(path)
+    manifest = _read_manifest(cache_dir_for(path, cache_dir))
+    if manifest is None or manifest["size"] != stat.st_size:
+        return build(path, cache_dir)
+    if manifest["mtime_ns"] != stat.st_mtime_ns:
+        # the file was touched or rewritten: rebuild only if the content changed
+        if manifest["fingerprint"] != file_fingerprint(path):
+            return build(path, cache_dir)
+        manifest["mtime_ns"] = stat.st_mtime_ns
+        _write_manifest(cache_dir_for(path, cache_dir), manifest)
+    return manifest
+
+
+def _to_columnar(dataframe):
+    # Invoice/StockCode mix ints and strings ("C489449", "85123A");
+    # Parquet needs one type per column, so mixed object columns become str.
+    dataframe = dataframe.copy()
+    for col in dataframe.columns[dataframe.dtypes == object]:
+        values = dataframe[col]
+        dataframe[col] = values.where(values.isna(), values.astype(str))
+    dataframe.columns = [str(col) for col in dataframe.columns]
+    return dataframe
+
+
+def _write_parquet(dataframe, path):
+    tmp = path + ".tmp"
+    dataframe.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def build_excel_cache(path, cache_dir=None):
+    """Convert every sheet of the workbook to Parquet and return the manifest."""
+    directory = cache_dir_for(path, cache_dir)
+    os.makedirs(directory, exist_ok=True)
+    stat = os.stat(path)
+
+    sheets = pd.read_excel(path, sheet_name=None)
+    files = {}
+    for sheet_name, dataframe in sheets.items():
+        file_name = _slug(sheet_name) + ".parquet"
+        _write_parquet(_to_columnar(dataframe), os.path.join(directory, file_name))
+        files[sheet_name] = file_name
+
+    manifest = {"source": os.path.abspath(path),
+                "fingerprint": file_fingerprint(path),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sheets": files}
+    _write_manifest(directory, manifest)
+    return manifest
+
+
+def read_excel_cached(path, sheet_name=0, cache_dir=None):
+    """Drop-in replacement for pd.read_excel(path, sheet_name=...) backed by the Parquet cache."""
+    manifest = fresh_manifest(path, cache_dir, build_excel_cache)
+    directory = cache_dir_for(path, cache_dir)
+
+    sheet_names = list(manifest["sheets"])
+    if isinstance(sheet_name, int):
+        sheet_name = sheet_names[sheet_name]
+    if sheet_name not in manifest["sheets"]:
+        raise ValueError("Worksheet named '%s' not found" % sheet_name)
+    return pd.read_parquet(os.path.join(directory, manifest["sheets"][sheet_name]))
@@ -0,0 +1,57 @@
+"""
+Fitting BG-NBD / Gamma-Gamma on sufficient statistics.
+
+Both likelihoods only depend on (frequency, recency, T) and (frequency, monetary)
+per customer, and many customers share the same values (recency and T are whole
+days divided by 7). The fits below run on the unique rows, weighted by how often
+each row occurs. lifetimes normalises the weighted log-likelihood by the sum of
+the weights, so the objective, and therefore the parameters, are the same as
+for the uncompressed fit.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def compress_rows(*columns):
+    """
+    Unique rows of the given equally long columns.
+
+    Returns (unique columns, weights, inverse) where weights[i] counts the rows
+    equal to unique row i and unique[inverse] restores the original order.
+    """
+    columns = [np.asarray(column) for column in columns]
+    # the codes of the columns are combined into one integer key column by column (re-factorized each
+    # time so the key stays below the row count); cheaper than factorizing a MultiIndex of tuples
+    inverse = np.zeros(len(columns[0]), dtype="int64")
+    for column in columns:
+        codes, uniques = pd.factorize(column, use_na_sentinel=False)
+        inverse, _ = pd.factorize(inverse * len(uniques) + codes)
+    n_unique = inverse.max() + 1 if len(inverse) else 0
+    first = np.empty(n_unique, dtype="int64")
+    first[inverse[::-1]] = np.arange(len(inverse))[::-1]
+    weights = np.bincount(inverse, minlength=n_unique)
+    unique_columns = [column[first] for column in columns]
+    return unique_columns, weights, inverse
+
+
+def compression_ratio(*columns):
+    unique_columns, weights, _ = compress_rows(*columns)
+    return weights.sum() / len(weights) if len(weights) else 1.0
+
+
+def fit_bgf_compressed(bgf, frequency, recency, T, **kwargs):
+    """
+    bgf.fit(frequency, recency, T) on the unique (frequency, recency, T) triples with integer weights.
+
+    bgf.data then holds the unique triples, so plots built from it
+    (plot_period_transactions, ...) need a regular fit.
+    """
+    (frequency, recency, T), weights, _ = compress_rows(frequency, recency, T)
+    return bgf.fit(frequency, recency, T, weights=weights, **kwargs)
+
+
+def fit_ggf_compressed(ggf, frequency, monetary_value, **kwargs):
+    """ggf.fit(frequency, monetary_value) on the unique (frequency, monetary) pairs with integer weights."""
+    (frequency, monetary_value), weights, _ = compress_rows(frequency, monetary_value)
+    return ggf.fit(frequency, monetary_value, weights=weights, **kwargs)
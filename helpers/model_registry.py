@@ -0,0 +1,129 @@
+"""
+Small on-disk registry of fitted BG-NBD / Gamma-Gamma parameters.
+
+Every model is one JSON file (<directory>/<name>.json) with the fitted
+parameters and the metadata of the fit: model class, penalizer, negative
+log-likelihood, analysis date and a fingerprint of the data it was fitted on.
+
+A stored record is used in three ways:
+- scoring-only jobs load the parameters into an unfitted model (load),
+- refits on new data start the optimizer from the stored parameters
+  (initial_params), which converges in a few iterations when the data only
+  moved by a day,
+- a refit on data with the stored fingerprint is skipped altogether.
+"""
+
+import datetime as dt
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def data_fingerprint(*columns):
+    """sha1 of the given columns (e.g. frequency, recency, T) as float64."""
+    digest = hashlib.sha1()
+    for column in columns:
+        values = np.ascontiguousarray(np.asarray(column, dtype="float64"))
+        digest.update(str(values.shape).encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def initial_params_from(params, T_max=None):
+    """
+    Fitted parameters (params_ of a model or of a stored record) as the
+    `initial_params` of fit(): log-parameters, and for BG-NBD alpha on the
+    internal time scale of data with max(T) == T_max.
+    """
+    params = pd.Series(params, dtype="float64")
+    if "alpha" in params:
+        if T_max is None:
+            raise ValueError("T_max is needed to warm-start a BG-NBD model")
+        params["alpha"] /= T_max
+    return np.log(params.to_numpy())
+
+
+class ModelRegistry:
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, name):
+        return os.path.join(self.directory, name + ".json")
+
+    def save(self, name, model, fingerprint=None, analysis_date=None):
+        record = {"model": type(model).__name__,
+                  "params": {key: float(value) for key, value in model.params_.items()},
+                  "penalizer_coef": float(model.penalizer_coef),
+                  "negative_log_likelihood": float(model._negative_log_likelihood_),
+                  "n_iterations": getattr(model, "n_iterations_", None),
+                  "hess_inv": None if getattr(model, "hess_inv_", None) is None else model.hess_inv_.tolist(),
+                  "fingerprint": fingerprint,
+                  "analysis_date": None if analysis_date is None else str(pd.Timestamp(analysis_date).date()),
+                  "saved_at": dt.datetime.now().isoformat(timespec="seconds")}
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path(name) + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(record, file, indent=2)
+        os.replace(tmp, self.path(name))
+        return record
+
+    def record(self, name):
+        """Stored record of the model, or None."""
+        if not os.path.exists(self.path(name)):
+            return None
+        with open(self.path(name)) as file:
+            return json.load(file)
+
+    def load(self, name, model):
+        """Puts the stored parameters into model (BetaGeoFitter, BGNBDFitter or GammaGammaFitter) for scoring."""
+        record = self.record(name)
+        if record is None:
+            raise ValueError("No model named %r in %s" % (name, self.directory))
+        model.params_ = pd.Series(record["params"])
+        model.penalizer_coef = record["penalizer_coef"]
+        model._negative_log_likelihood_ = record["negative_log_likelihood"]
+        if not hasattr(model, "predict") and hasattr(model, "conditional_expected_number_of_purchases_up_to_time"):
+            # lifetimes.BetaGeoFitter only sets the predict alias in fit()
+            model.predict = model.conditional_expected_number_of_purchases_up_to_time
+        return model
+
+    def initial_params(self, name, T_max=None):
+        """Stored parameters as `initial_params` (see initial_params_from), or None."""
+        record = self.record(name)
+        if record is None:
+            return None
+        return initial_params_from(record["params"], T_max)
+
+
+def fit_with_registry(registry, name, model, fit_function, *columns, analysis_date=None, refit=True, **kwargs):
+    """
+    fit_function(model, *columns, **kwargs) with the registry around it.
+
+    - registry None: a plain fit.
+    - refit=False: scoring only, the stored parameters are loaded.
+    - data with the stored fingerprint and penalizer: loaded, not refitted.
+    - otherwise the fit starts from the stored parameters and the result is saved.
+    columns are (frequency, recency, T) for BG-NBD and (frequency, monetary) for Gamma-Gamma.
+    """
+    if registry is None:
+        return fit_function(model, *columns, **kwargs)
+    if not refit:
+        return registry.load(name, model)
+
+    fingerprint = data_fingerprint(*columns)
+    record = registry.record(name)
+    if record is not None and record["fingerprint"] == fingerprint and record["penalizer_coef"] == model.penalizer_coef:
+        return registry.load(name, model)
+    if record is not None:
+        T_max = np.max(columns[2]) if len(columns) == 3 else None
+        kwargs.setdefault("initial_params", registry.initial_params(name, T_max))
+        if record.get("hess_inv") is not None and record["model"] == type(model).__name__:
+            # BGNBDFitter: the stored BFGS inverse Hessian (the log-space curvature does not depend on the time scale)
+            kwargs.setdefault("hess_inv0", np.asarray(record["hess_inv"]))
+    fit_function(model, *columns, **kwargs)
+    registry.save(name, model, fingerprint=fingerprint, analysis_date=analysis_date)
+    return model
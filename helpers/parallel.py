@@ -0,0 +1,55 @@
+"""
+Multi-process RFM / CLTV aggregation, partitioned by a hash of Customer ID.
+
+Every customer lands in exactly one shard, so the per-customer aggregates of
+the shards are disjoint and are simply concatenated. The merged per-customer
+table is in the parent anyway, so it is scored there with the exact qcut of
+score_rfm (the same segments as a serial run); the customer counts that give
+the churn_rate and purchase_frequency denominators are the row count of the
+merged table, and the model fit inputs are the merged table itself.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from helpers.cltv import cltv_c_metrics, cltv_p_metrics
+from helpers.rfm import rfm_metrics
+
+
+def default_n_jobs():
+    return os.cpu_count() or 1
+
+
+def hash_partition(dataframe, n_shards, customer_col="Customer ID"):
+    """Splits the rows into n_shards frames by a stable hash of the customer ID."""
+    # hashed as float64 so that float, int and nullable Int32 (helpers/schema.py) IDs land in the same shard
+    ids = dataframe[customer_col].to_numpy(dtype="float64", na_value=np.nan)
+    shard = pd.util.hash_array(ids) % np.uint64(n_shards)
+    order = np.argsort(shard, kind="stable")
+    bounds = np.cumsum(np.bincount(shard.astype("int64"), minlength=n_shards))[:-1]
+    return [dataframe.iloc[rows] for rows in np.split(order, bounds)]
+
+
+def _map_shards(function, dataframe, n_jobs, customer_col, *args):
+    n_jobs = default_n_jobs() if n_jobs in (None, -1) else n_jobs
+    shards = hash_partition(dataframe[dataframe[customer_col].notna()], n_jobs, customer_col)
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        return list(pool.map(function, shards, *[[arg] * len(shards) for arg in args]))
+
+
+def parallel_rfm_metrics(dataframe, today_date, n_jobs=None, customer_col="Customer ID"):
+    """rfm_metrics over a process pool; score the result with score_rfm as a serial run would."""
+    return pd.concat(_map_shards(rfm_metrics, dataframe, n_jobs, customer_col, today_date)).sort_index()
+
+
+def parallel_cltv_c_metrics(dataframe, n_jobs=None, customer_col="Customer ID"):
+    """cltv_c_metrics over a process pool."""
+    return pd.concat(_map_shards(cltv_c_metrics, dataframe, n_jobs, customer_col)).sort_index()
+
+
+def parallel_cltv_p_metrics(dataframe, today_date, n_jobs=None, customer_col="Customer ID"):
+    """cltv_p_metrics over a process pool; the result is the input of the BG-NBD / Gamma-Gamma fits."""
+    return pd.concat(_map_shards(cltv_p_metrics, dataframe, n_jobs, customer_col, today_date)).sort_index()
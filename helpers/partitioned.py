@@ -0,0 +1,94 @@
+"""
+One BG-NBD / Gamma-Gamma pair per partition (country, order channel, cohort).
+
+Partitions are fitted and scored in worker processes, largest first, so the
+wall-clock time is bounded by the largest fit rather than the sum of all of
+them. The global model is fitted alongside; partitions below min_size, and
+partitions whose fit does not converge, are scored with it.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from lifetimes import GammaGammaFitter
+
+from helpers.bgnbd import BGNBDFitter
+from helpers.cltv import customer_lifetime_value_horizons
+from helpers.lifetimes_fit import fit_bgf_compressed, fit_ggf_compressed
+from helpers.parallel import default_n_jobs
+
+MODEL_COLUMNS = ["frequency", "recency", "T", "monetary"]
+
+
+def _models(penalizers):
+    return BGNBDFitter(penalizer_coef=penalizers[0]), GammaGammaFitter(penalizer_coef=penalizers[1])
+
+
+def _fit(frame, penalizers):
+    bgf, ggf = _models(penalizers)
+    fit_bgf_compressed(bgf, frame["frequency"], frame["recency"], frame["T"])
+    fit_ggf_compressed(ggf, frame["frequency"], frame["monetary"])
+    return bgf.params_, ggf.params_
+
+
+def _score(frame, params, penalizers, times, freq, discount_rate):
+    bgf, ggf = _models(penalizers)
+    bgf.params_, ggf.params_ = params
+    clv = customer_lifetime_value_horizons(bgf, ggf, frame["frequency"], frame["recency"], frame["T"],
+                                           frame["monetary"], times=times, freq=freq, discount_rate=discount_rate)
+    clv.insert(0, "exp_average_value", ggf.conditional_expected_average_profit(frame["frequency"], frame["monetary"]))
+    return clv
+
+
+def _fit_score(frame, penalizers, times, freq, discount_rate):
+    params = _fit(frame, penalizers)
+    return params, _score(frame, params, penalizers, times, freq, discount_rate)
+
+
+def fit_partitioned(cltv_df, by="Country", min_size=100, n_jobs=None, times=(6,), freq="W", discount_rate=0.01,
+                    penalizers=(0.001, 0.01), frequency_col="frequency", recency_col="recency", T_col="T",
+                    monetary_col="monetary"):
+    """
+    Fits and scores a model pair per value of `by` (a column of cltv_df, or a Series aligned to its index).
+
+    Returns (scores, models):
+    - scores: per customer, the partition, which model scored it ("partition" or "global"),
+      exp_average_value and the CLTV for every horizon in times (columns labelled by month),
+    - models: per partition (and "__global__"), the number of customers, the model used and its parameters.
+    """
+    data = cltv_df[[frequency_col, recency_col, T_col, monetary_col]].set_axis(MODEL_COLUMNS, axis=1)
+    keys = cltv_df[by] if isinstance(by, str) else pd.Series(by).reindex(cltv_df.index)
+    sizes = keys.value_counts()  # descending: the largest partitions are submitted first
+    sizes.index = sizes.index.astype(object)
+    large = sizes.index[sizes >= min_size]
+    groups = dict(list(data.groupby(keys, observed=True, sort=False)))
+    n_jobs = default_n_jobs() if n_jobs in (None, -1) else n_jobs
+
+    fitted, scored = {}, []
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        global_future = pool.submit(_fit, data, penalizers)
+        futures = [(key, pool.submit(_fit_score, groups[key], penalizers, times, freq, discount_rate))
+                   for key in large]
+        global_params = global_future.result()
+        for key, future in futures:
+            try:
+                fitted[key], clv = future.result()
+            except ValueError:
+                # no convergence (e.g. lifetimes' ConvergenceError): the partition falls back to the global model
+                continue
+            scored.append(clv.assign(partition=key, model="partition"))
+
+    rest = ~keys.isin(list(fitted)).to_numpy()
+    if rest.any():
+        scored.append(_score(data[rest], global_params, penalizers, times, freq, discount_rate)
+                      .assign(partition=keys[rest], model="global"))
+    scores = pd.concat(scored).reindex(cltv_df.index)
+    scores = scores[["partition", "model"] + [column for column in scores.columns if column not in ("partition", "model")]]
+
+    models = pd.DataFrame({"n_customers": sizes,
+                           "model": np.where(sizes.index.isin(list(fitted)), "partition", "global")})
+    models.loc["__global__"] = [len(data), "global"]
+    params = {key: pd.concat(fitted.get(key, global_params)) for key in models.index}
+    models = models.join(pd.DataFrame(params).T)
+    return scores, models
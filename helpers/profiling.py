@@ -0,0 +1,141 @@
+"""
+Stage-level timing and memory instrumentation for the create_* pipelines.
+
+The pipelines wrap every stage in `with profiler.stage(name, dataframe) as stage:`
+and report the output with stage.output(result); stage.annotate(**fields) adds
+fields to the record. The default profiler is NULL_PROFILER, whose stage()
+returns one shared no-op context manager, so instrumentation that is off costs
+a method call per stage.
+
+StageProfiler records, per stage: wall time, rows in / out, resident memory
+before and after (and the delta) and the process peak RSS. Each record is kept
+in profiler.records, logged as one JSON line on the "crm.profiling" logger
+and passed to the optional callback.
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger("crm.profiling")
+
+
+def _rss_mb():
+    # current resident set size; /proc is Linux only, elsewhere the peak is the best available figure
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return _peak_rss_mb()
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _rows(data):
+    return len(data) if hasattr(data, "__len__") else None
+
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def output(self, data):
+        pass
+
+    def annotate(self, **fields):
+        pass
+
+
+class NullProfiler:
+    """Instrumentation off."""
+
+    _stage = _NullStage()
+
+    def stage(self, name, data=None):
+        return self._stage
+
+    def for_pipeline(self, pipeline):
+        return self
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _Stage:
+
+    def __init__(self, profiler, name, data):
+        self.profiler = profiler
+        self.record = {"pipeline": profiler.pipeline, "stage": name, "rows_in": _rows(data), "rows_out": None}
+
+    def __enter__(self):
+        self.record["rss_before_mb"] = _rss_mb()
+        self._start = time.perf_counter()
+        return self
+
+    def output(self, data):
+        self.record["rows_out"] = _rows(data)
+
+    def annotate(self, **fields):
+        """Extra fields of the stage record (e.g. the rows dropped per cleaning rule)."""
+        self.record.update(fields)
+
+    def __exit__(self, exc_type, exc, traceback):
+        record = self.record
+        record["seconds"] = time.perf_counter() - self._start
+        record["rss_after_mb"] = _rss_mb()
+        if record["rss_before_mb"] is not None and record["rss_after_mb"] is not None:
+            record["memory_delta_mb"] = record["rss_after_mb"] - record["rss_before_mb"]
+        record["peak_rss_mb"] = _peak_rss_mb()
+        if exc_type is not None:
+            record["error"] = "%s: %s" % (exc_type.__name__, exc)
+        self.profiler._add(record)
+        return False
+
+
+class StageProfiler:
+
+    def __init__(self, pipeline=None, callback=None, log=True):
+        self.pipeline = pipeline
+        self.callback = callback
+        self.log = log
+        self.records = []
+
+    def stage(self, name, data=None):
+        return _Stage(self, name, data)
+
+    def _add(self, record):
+        self.records.append(record)
+        if self.log:
+            logger.info(json.dumps(record))
+        if self.callback is not None:
+            self.callback(record)
+
+    def for_pipeline(self, pipeline):
+        """Sets the pipeline name stamped on the following records (the create_* functions call it)."""
+        self.pipeline = pipeline
+        return self
+
+    def summary(self):
+        """Seconds and memory delta per stage, slowest first."""
+        import pandas as pd
+
+        columns = ["pipeline", "stage", "seconds", "rows_in", "rows_out", "memory_delta_mb", "peak_rss_mb"]
+        frame = pd.DataFrame(self.records).reindex(columns=columns)
+        return frame.sort_values("seconds", ascending=False)
+
+    def to_json(self, path):
+        with open(path, "w") as file:
+            json.dump(self.records, file, indent=2)
@@ -0,0 +1,162 @@
+"""
+Mergeable quantile sketches for RFM scoring in chunked / sharded runs.
+
+pd.qcut needs every customer's value in one process. QuantileSketch is a
+deterministic compactor sketch (the MRL / KLL family without the random coin):
+each level holds at most k sorted items of weight 2**level and a full level is
+compacted by promoting every other item one level up. Shards or chunks build
+their own sketches, merge() combines them, and the quintile breakpoints are
+applied afterwards with np.searchsorted.
+
+Every compaction at level h moves the rank of any value by at most 2**h, so
+the sketch keeps an exact upper bound of the rank error it has accumulated
+(rank_error, or error_bound() as a fraction of n). Until the first compaction
+the sketch is exact and the breakpoints equal the pd.qcut ones.
+
+Frequency is sketched as (frequency, customer ID) keys (frequency_key), so the
+frequency ties are spread over the bins like rank(method="first") does.
+"""
+
+import numpy as np
+import pandas as pd
+
+RECENCY_LABELS = [5, 4, 3, 2, 1]
+SCORE_LABELS = [1, 2, 3, 4, 5]
+
+
+class QuantileSketch:
+
+    def __init__(self, k=1024):
+        self.k = k
+        self.n = 0
+        self.rank_error = 0
+        self.levels = [np.empty(0)]
+        self._parity = [0]
+
+    def update(self, values):
+        values = np.asarray(values)
+        if values.dtype.names is None:
+            values = values.astype("float64").ravel()
+            values = values[~np.isnan(values)]
+        else:
+            values = values[~np.isnan(values[values.dtype.names[0]])]
+        self.levels[0] = _concatenate(self.levels[0], values)
+        self.n += len(values)
+        self._compress()
+        return self
+
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError("Sketches with different k cannot be merged: %d != %d" % (self.k, other.k))
+        for level, items in enumerate(other.levels):
+            self._ensure_level(level)
+            self.levels[level] = _concatenate(self.levels[level], items)
+        self.n += other.n
+        self.rank_error += other.rank_error
+        self._compress()
+        return self
+
+    def _ensure_level(self, level):
+        while len(self.levels) <= level:
+            self.levels.append(np.empty(0))
+            self._parity.append(0)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                items = np.sort(items)
+                # an odd item stays behind; the others are paired and every other one is promoted.
+                # Alternating the kept half per level makes the sketch deterministic and unbiased.
+                keep = items[len(items) - len(items) % 2:]
+                promoted = items[self._parity[level]:len(items) - len(items) % 2:2]
+                self._parity[level] ^= 1
+                self._ensure_level(level + 1)
+                self.levels[level] = keep
+                self.levels[level + 1] = _concatenate(self.levels[level + 1], promoted)
+                self.rank_error += 2 ** level
+            level += 1
+
+    def error_bound(self):
+        """Upper bound of the rank error as a fraction of the number of values (0.0 while exact)."""
+        return self.rank_error / self.n if self.n else 0.0
+
+    def quantile(self, q):
+        """
+        Linear-interpolated quantiles; identical to np.quantile as long as no compaction happened.
+        Keys (frequency_key) cannot be interpolated: the item at or below the rank is returned.
+        """
+        if self.n == 0:
+            raise ValueError("Empty sketch")
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, weights = values[order], weights[order]
+        # a weighted item covers the ranks [cum - w, cum - 1]; it is placed at the middle of them
+        ranks = np.cumsum(weights) - (weights + 1) / 2
+        position = np.asarray(q, dtype="float64") * (self.n - 1)
+        if values.dtype.names is not None:
+            return values[np.maximum(np.searchsorted(ranks, position, side="right") - 1, 0)]
+        return np.interp(position, ranks, values)
+
+
+def _concatenate(items, values):
+    # the levels start as empty float arrays; they take the dtype of the first values (floats or keys)
+    if len(items) == 0:
+        return values
+    return np.concatenate([items, values]) if len(values) else items
+
+
+def frequency_key(frequency, customer_ids):
+    """
+    Deterministic stand-in for rank(method="first") that does not need all rows in one place:
+    (frequency, customer ID as str) keys, ordered by frequency and then by the sorted order of
+    the str IDs. A customer gets the same key in any shard, whatever the type of its ID. For a
+    groupby result the order equals rank(method="first") when the IDs sort as their str (string
+    IDs, or numeric Customer IDs of the same number of digits).
+    """
+    ids = pd.Index(customer_ids).astype(str).to_numpy(dtype=str)
+    keys = np.empty(len(ids), dtype=[("frequency", "float64"), ("customer", ids.dtype)])
+    keys["frequency"] = np.asarray(frequency, dtype="float64")
+    keys["customer"] = ids
+    return keys
+
+
+def sketch_rfm(rfm, k=1024):
+    """Sketches of recency, frequency (tie-broken key) and monetary for one shard of a customer table."""
+    return {"recency": QuantileSketch(k).update(rfm["recency"]),
+            "frequency": QuantileSketch(k).update(frequency_key(rfm["frequency"], rfm.index)),
+            "monetary": QuantileSketch(k).update(rfm["monetary"])}
+
+
+def merge_sketches(shard_sketches):
+    """Merges a list of sketch_rfm() results."""
+    merged = None
+    for sketches in shard_sketches:
+        if merged is None:
+            merged = {name: QuantileSketch(sketch.k).merge(sketch) for name, sketch in sketches.items()}
+        else:
+            for name, sketch in sketches.items():
+                merged[name].merge(sketch)
+    return merged
+
+
+def rfm_breakpoints(sketches, q=5):
+    """Quintile breakpoints of every sketch plus its error bound (fraction of customers)."""
+    probabilities = np.linspace(0, 1, q + 1)
+    return {name: {"edges": sketch.quantile(probabilities), "error_bound": sketch.error_bound()}
+            for name, sketch in sketches.items()}
+
+
+def apply_breakpoints(values, edges, labels):
+    """pd.qcut(values, edges) with right-closed bins, as a vectorized searchsorted."""
+    values = np.asarray(values)
+    if edges.dtype.names is not None:
+        # keys of other shards may have wider customer strings; both sides are compared at the wider one
+        dtype = np.promote_types(edges.dtype, values.dtype)
+        edges, values = edges.astype(dtype), values.astype(dtype)
+    else:
+        values = values.astype("float64")
+    codes = np.searchsorted(edges[1:-1], values, side="left")
+    return pd.Categorical.from_codes(codes, categories=labels, ordered=True)
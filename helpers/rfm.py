@@ -0,0 +1,268 @@
+"""
+Vectorized RFM kernels.
+
+groupby(...).agg({col: lambda ...}) calls a Python function once per customer
+per column. Here Customer ID is dictionary-encoded into dense integer codes
+and every metric is a single bincount, a hashed unique over (customer, invoice)
+keys or an unbuffered scatter reduction (ufunc.at).
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from helpers.quantile_sketch import apply_breakpoints, frequency_key, RECENCY_LABELS, SCORE_LABELS
+
+
+def encode_customers(dataframe, customer_col="Customer ID"):
+    """Dense integer codes for the customers (sorted like groupby keys) and the matching Index."""
+    codes, customers = pd.factorize(dataframe[customer_col], sort=True)
+    customers = pd.Index(customers, name=customer_col)
+    return codes, customers
+
+
+def sum_per_customer(codes, values, n_customers):
+    values = np.asarray(values, dtype="float64")
+    values = np.where(np.isnan(values), 0.0, values)
+    return np.bincount(codes, weights=values, minlength=n_customers)
+
+
+def distinct_per_customer(codes, values, n_customers):
+    # a (customer, invoice) pair becomes one int64 key; unique keys are then counted per customer
+    value_codes, uniques = pd.factorize(values)
+    if len(uniques) == 0:
+        return np.zeros(n_customers, dtype="int64")
+    valid = value_codes >= 0
+    keys = pd.unique(codes[valid].astype("int64") * len(uniques) + value_codes[valid])
+    return np.bincount(keys // len(uniques), minlength=n_customers).astype("int64")
+
+
+def _date_reduce(ufunc, fill, codes, dates, n_customers):
+    # datetime64 -> int64 nanoseconds so the scatter reduction runs on plain integers
+    out = np.full(n_customers, fill, dtype="int64")
+    ufunc.at(out, codes, np.asarray(dates, dtype="datetime64[ns]").view("int64"))
+    return out.view("datetime64[ns]")
+
+
+def last_date_per_customer(codes, dates, n_customers):
+    return _date_reduce(np.maximum, np.iinfo("int64").min, codes, dates, n_customers)
+
+
+def first_date_per_customer(codes, dates, n_customers):
+    return _date_reduce(np.minimum, np.iinfo("int64").max, codes, dates, n_customers)
+
+
+def days_between(later, earlier):
+    """Whole days between datetime64 values, same as (later - earlier).days."""
+    later = np.asarray(later, dtype="datetime64[ns]")
+    earlier = np.asarray(earlier, dtype="datetime64[ns]")
+    return (later - earlier) // np.timedelta64(1, "D")
+
+
+def rfm_metrics(dataframe, today_date, customer_col="Customer ID", date_col="InvoiceDate",
+                invoice_col="Invoice", price_col="TotalPrice"):
+    """
+    Vectorized equivalent of
+
+        dataframe.groupby('Customer ID').agg({'InvoiceDate': lambda date: (today_date - date.max()).days,
+                                              'Invoice': lambda num: num.nunique(),
+                                              'TotalPrice': lambda price: price.sum()})
+
+    with the columns named recency, frequency and monetary.
+    """
+    codes, customers = encode_customers(dataframe, customer_col)
+    n_customers = len(customers)
+    if n_customers == 0:
+        return pd.DataFrame({"recency": pd.Series(dtype="int64"),
+                             "frequency": pd.Series(dtype="int64"),
+                             "monetary": pd.Series(dtype="float64")}, index=customers)
+    if (codes < 0).any():
+        # rows without a Customer ID are dropped by groupby as well
+        dataframe = dataframe[codes >= 0]
+        codes = codes[codes >= 0]
+
+    last_date = last_date_per_customer(codes, dataframe[date_col].to_numpy(), n_customers)
+    frequency = distinct_per_customer(codes, dataframe[invoice_col], n_customers)
+    monetary = sum_per_customer(codes, dataframe[price_col].to_numpy(), n_customers)
+
+    return pd.DataFrame({"recency": days_between(today_date, last_date).astype("int64"),
+                         "frequency": frequency,
+                         "monetary": monetary}, index=customers)
+
+
+#############################################
+# Scoring & segments
+#############################################
+
+SEG_MAP = {
+    r'[1-2][1-2]': 'hibernating',
+    r'[1-2][3-4]': 'at_risk',
+    r'[1-2]5': 'cant_loose',
+    r'3[1-2]': 'about_to_sleep',
+    r'33': 'need_attention',
+    r'[3-4][4-5]': 'loyal_customers',
+    r'41': 'promising',
+    r'51': 'new_customers',
+    r'[4-5][2-3]': 'potential_loyalists',
+    r'5[4-5]': 'champions'
+}
+
+
+@lru_cache(maxsize=32)
+def _compile_seg_map(rules):
+    table = np.empty((5, 5), dtype="int8")
+    categories = list(dict.fromkeys(segment for _, segment in rules))
+    for recency_score in range(1, 6):
+        for frequency_score in range(1, 6):
+            # same substitutions Series.replace(seg_map, regex=True) applies to "<r><f>"
+            label = "%d%d" % (recency_score, frequency_score)
+            for pattern, segment in rules:
+                label = re.sub(pattern, segment, label)
+            if label not in categories:
+                categories.append(label)
+            table[recency_score - 1, frequency_score - 1] = categories.index(label)
+    table.setflags(write=False)
+    return table, pd.Index(categories)
+
+
+def compile_seg_map(seg_map=SEG_MAP):
+    """
+    Compiles the regex rules once into a 5x5 table of segment codes indexed by
+    (recency_score - 1, frequency_score - 1), plus the segment names.
+    """
+    return _compile_seg_map(tuple(seg_map.items()))
+
+
+def segment_from_scores(recency_score, frequency_score, seg_map=SEG_MAP):
+    """Segments as a categorical, with one gather from the compiled table instead of regex passes."""
+    table, categories = compile_seg_map(seg_map)
+    codes = table[np.asarray(recency_score, dtype="int64") - 1, np.asarray(frequency_score, dtype="int64") - 1]
+    segment = pd.Categorical.from_codes(codes, categories)
+    if isinstance(recency_score, pd.Series):
+        return pd.Series(segment, index=recency_score.index)
+    return segment
+
+
+def rfm_score(rfm, monetary=False):
+    """RF_SCORE ("53") or, with monetary=True, RFM_SCORE ("534") strings, built only on request."""
+    score = rfm['recency_score'].astype(str) + rfm['frequency_score'].astype(str)
+    if monetary:
+        score = score + rfm['monetary_score'].astype(str)
+    return score
+
+
+def score_rfm(rfm, seg_map=SEG_MAP, breakpoints=None):
+    """
+    Adds the 1-5 recency/frequency/monetary scores and the segment to a recency/frequency/monetary table.
+
+    breakpoints: optional rfm_breakpoints() result (helpers/quantile_sketch.py) from merged shard
+    sketches. The scores are then assigned with searchsorted instead of pd.qcut over all customers,
+    and the sketches' rank error bounds (fraction of customers, per column) are kept in
+    rfm.attrs["score_error_bound"]; 0 means the scores are the exact qcut ones.
+    """
+    rfm = rfm.copy()
+    if breakpoints is None:
+        rfm["recency_score"] = pd.qcut(rfm['recency'], 5, labels=[5, 4, 3, 2, 1])
+        rfm["frequency_score"] = pd.qcut(rfm["frequency"].rank(method="first"), 5, labels=[1, 2, 3, 4, 5])
+        rfm["monetary_score"] = pd.qcut(rfm['monetary'], 5, labels=[1, 2, 3, 4, 5])
+    else:
+        rfm["recency_score"] = apply_breakpoints(rfm["recency"], breakpoints["recency"]["edges"], RECENCY_LABELS)
+        rfm["frequency_score"] = apply_breakpoints(frequency_key(rfm["frequency"], rfm.index),
+                                                   breakpoints["frequency"]["edges"], SCORE_LABELS)
+        rfm["monetary_score"] = apply_breakpoints(rfm["monetary"], breakpoints["monetary"]["edges"], SCORE_LABELS)
+        rfm.attrs["score_error_bound"] = {name: float(breakpoints[name]["error_bound"])
+                                          for name in ("recency", "frequency", "monetary")}
+    rfm['segment'] = segment_from_scores(rfm["recency_score"], rfm["frequency_score"], seg_map)
+    return rfm
+
+
+#############################################
+# Out-of-core (chunked) RFM
+#############################################
+
+def read_transaction_chunks(path, chunksize=500_000, columns=None):
+    """Yield DataFrame chunks of a CSV or Parquet transaction file without reading it whole."""
+    if str(path).endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        parse_dates = ["InvoiceDate"] if columns is None or "InvoiceDate" in columns else None
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns, parse_dates=parse_dates,
+                               dtype={"Invoice": str, "StockCode": str})
+
+
+class ChunkedRFM:
+    """
+    Folds transaction chunks into per-customer partial aggregates.
+
+    Per chunk only the last invoice date and the monetary sum of each customer
+    and the distinct (customer, invoice) keys are kept. Partials are merged
+    whenever they outgrow the already merged table, so memory follows the
+    number of customers and invoices, never the number of line items.
+    """
+
+    def __init__(self, customer_col="Customer ID", date_col="InvoiceDate",
+                 invoice_col="Invoice", price_col="TotalPrice"):
+        self.customer_col = customer_col
+        self.date_col = date_col
+        self.invoice_col = invoice_col
+        self.price_col = price_col
+        self._totals = []
+        self._invoices = []
+        self._merged_rows = 0
+        self._pending_rows = 0
+
+    def add(self, chunk):
+        chunk = chunk[chunk[self.customer_col].notna()]
+        if chunk.empty:
+            return self
+        codes, customers = encode_customers(chunk, self.customer_col)
+        n_customers = len(customers)
+        self._totals.append(pd.DataFrame({
+            "last_date": last_date_per_customer(codes, chunk[self.date_col].to_numpy(), n_customers),
+            "monetary": sum_per_customer(codes, chunk[self.price_col].to_numpy(), n_customers)},
+            index=customers))
+        invoices = pd.DataFrame({"customer": chunk[self.customer_col].to_numpy(),
+                                 "invoice": chunk[self.invoice_col].to_numpy()}).drop_duplicates()
+        self._invoices.append(invoices)
+        self._pending_rows += n_customers + len(invoices)
+        if self._pending_rows > max(self._merged_rows, 1_000_000):
+            self._merge()
+        return self
+
+    def _merge(self):
+        totals = pd.concat(self._totals)
+        if len(self._totals) > 1:
+            totals = totals.groupby(level=0).agg({"last_date": "max", "monetary": "sum"})
+        invoices = pd.concat(self._invoices, ignore_index=True)
+        if len(self._invoices) > 1:
+            invoices = invoices.drop_duplicates()
+        self._totals = [totals]
+        self._invoices = [invoices]
+        self._merged_rows = len(totals) + len(invoices)
+        self._pending_rows = 0
+
+    def result(self, today_date):
+        """The same recency/frequency/monetary table rfm_metrics returns for the concatenated chunks."""
+        if not self._totals:
+            return rfm_metrics(pd.DataFrame(columns=[self.customer_col, self.date_col,
+                                                     self.invoice_col, self.price_col]), today_date)
+        self._merge()
+        totals = self._totals[0].sort_index()
+        frequency = self._invoices[0]["customer"].value_counts()
+        rfm = pd.DataFrame({"recency": days_between(today_date, totals["last_date"].to_numpy()).astype("int64"),
+                            "frequency": frequency.reindex(totals.index).to_numpy().astype("int64"),
+                            "monetary": totals["monetary"].to_numpy()}, index=totals.index)
+        rfm.index.name = self.customer_col
+        return rfm
+
+
+def rfm_metrics_chunked(chunks, today_date, **columns):
+    """rfm_metrics for an iterator of row chunks (see read_transaction_chunks)."""
+    state = ChunkedRFM(**columns)
+    for chunk in chunks:
+        state.add(chunk)
+    return state.result(today_date)
@@ -0,0 +1,114 @@
+"""
+RFM as of many analysis dates from one sorted pass over the transactions.
+
+The rows are reduced once to one entry per (customer, invoice) with the
+invoice's date and total, and sorted by customer and date. For a snapshot
+date D every customer's entries before D are then a prefix of its block:
+searchsorted on the (customer, date) keys gives the end of the prefix, the
+prefix length is the frequency, the entry before the end holds the last
+invoice date (recency) and a difference of the running sum of the invoice
+totals is the monetary value. No snapshot aggregates the transactions again.
+
+A snapshot as of D sees the invoices dated strictly before D, like create_rfm
+with today_date=D on the rows before D. An invoice is dated by its first row
+and dates are compared at one-second resolution.
+"""
+
+import numpy as np
+import pandas as pd
+
+from helpers.rfm import SEG_MAP, compile_seg_map, days_between, encode_customers, score_rfm
+
+ABSENT = "(none)"
+_SECONDS = np.int64(10 ** 9)
+
+
+class InvoiceHistory:
+
+    def __init__(self, dataframe, customer_col="Customer ID", date_col="InvoiceDate", invoice_col="Invoice",
+                 price_col="TotalPrice"):
+        """Prepared transactions (TotalPrice added, cancellations and NaNs removed)."""
+        dataframe = dataframe[dataframe[customer_col].notna()]
+        codes, self.customers = encode_customers(dataframe, customer_col)
+        dates = np.asarray(dataframe[date_col].to_numpy(), dtype="datetime64[ns]").view("int64")
+        prices = np.asarray(dataframe[price_col].to_numpy(), dtype="float64")
+
+        # one entry per (customer, invoice): the first date of the invoice and its total
+        invoice_codes, invoices = pd.factorize(dataframe[invoice_col])
+        pairs, pair_index = pd.factorize(codes.astype("int64") * max(len(invoices), 1) + invoice_codes)
+        n_pairs = len(pair_index)
+        pair_dates = np.full(n_pairs, np.iinfo("int64").max, dtype="int64")
+        np.minimum.at(pair_dates, pairs, dates)
+        pair_totals = np.bincount(pairs, weights=np.where(np.isnan(prices), 0.0, prices), minlength=n_pairs)
+        pair_customers = np.asarray(pair_index, dtype="int64") // max(len(invoices), 1)
+
+        # sorted once by customer and date; key = customer code in the high 32 bits, seconds in the low ones
+        self.origin = pair_dates.min() // _SECONDS if n_pairs else 0
+        seconds = pair_dates // _SECONDS - self.origin
+        if n_pairs and seconds.max() >= 2 ** 32:
+            raise ValueError("Transactions span more than 136 years")
+        keys = pair_customers << np.int64(32) | seconds
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.dates = pair_dates[order]
+        self.starts = np.searchsorted(self.keys, np.arange(len(self.customers), dtype="int64") << np.int64(32))
+        # running total restarted at every customer's first invoice: a snapshot's monetary is one lookup
+        # and stays as exact as the customer's own sum instead of a difference of two large totals
+        self.running_total = pd.Series(pair_totals[order]).groupby(pair_customers[order]).cumsum().to_numpy()
+
+    def metrics(self, as_of):
+        """recency / frequency / monetary of the customers with an invoice before as_of."""
+        as_of = pd.Timestamp(as_of)
+        seconds = np.clip(as_of.value // _SECONDS - self.origin, 0, 2 ** 32 - 1)
+        ends = np.searchsorted(self.keys, (np.arange(len(self.customers), dtype="int64") << np.int64(32)) | seconds)
+        frequency = ends - self.starts
+        active = frequency > 0
+        ends = ends[active]
+        last_date = self.dates[ends - 1].view("datetime64[ns]")
+        return pd.DataFrame({"recency": days_between(as_of.to_datetime64(), last_date).astype("int64"),
+                             "frequency": frequency[active].astype("int64"),
+                             "monetary": self.running_total[ends - 1]},
+                            index=self.customers[active])
+
+
+def rfm_snapshots(dataframe, dates, seg_map=SEG_MAP, **columns):
+    """
+    Scored RFM tables as of every date, stacked with a (snapshot, customer) index.
+
+    Every snapshot keeps the customers with monetary > 0 and is scored with
+    its own quintiles (score_rfm), as create_rfm would on that date.
+    """
+    history = InvoiceHistory(dataframe, **columns)
+    snapshots = []
+    for as_of in dates:
+        rfm = history.metrics(as_of)
+        rfm = rfm[rfm["monetary"] > 0]
+        if rfm.empty:
+            raise ValueError("No customers with purchases before the snapshot %s" % pd.Timestamp(as_of).date())
+        snapshots.append(score_rfm(rfm, seg_map))
+    # every snapshot's segment categorical has the categories of the compiled seg_map, so they concat as one
+    return pd.concat(snapshots, keys=pd.DatetimeIndex(pd.to_datetime(list(dates)), name="snapshot"))
+
+
+def segment_transitions(snapshots, seg_map=SEG_MAP):
+    """
+    Customer counts moving from one segment to another between consecutive snapshots.
+
+    Index (snapshot, from_segment), columns to_segment; snapshot is the later date of
+    the pair. Customers missing from one side of a pair are counted as ABSENT.
+    """
+    segments = list(compile_seg_map(seg_map)[1]) + [ABSENT]
+    by_date = [(date, frame.droplevel(0)["segment"]) for date, frame in snapshots.groupby(level=0, sort=True)]
+    matrices = []
+    for (_, before), (date, after) in zip(by_date, by_date[1:]):
+        # outer join on the customers; the code of a missing side (-1) becomes ABSENT
+        pair = pd.concat({"from": before.cat.codes, "to": after.cat.codes}, axis=1).fillna(-1).astype("int64")
+        from_codes = np.where(pair["from"] < 0, len(segments) - 1, pair["from"])
+        to_codes = np.where(pair["to"] < 0, len(segments) - 1, pair["to"])
+        counts = np.bincount(from_codes * len(segments) + to_codes, minlength=len(segments) ** 2)
+        matrices.append(pd.DataFrame(counts.reshape(len(segments), len(segments)),
+                                     index=pd.Index(segments, name="from_segment"),
+                                     columns=pd.Index(segments, name="to_segment")))
+    if not matrices:
+        return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=["snapshot", "from_segment"]))
+    return pd.concat(matrices, keys=pd.DatetimeIndex([date for date, _ in by_date[1:]], name="snapshot"))
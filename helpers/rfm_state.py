@@ -0,0 +1,155 @@
+"""
+Persistent per-customer RFM state for incremental (e.g. nightly) updates.
+
+Instead of recomputing RFM from the full invoice history, the state keeps one
+row per customer (first purchase, last invoice date, invoice count, monetary
+sum) on disk. A delta batch of new invoices is aggregated on its own and merged
+into the rows of the customers it touches. Recency is not stored; it is
+derived from the stored today_date when the state is queried.
+
+RFMState holds the columns as NumPy arrays with spare capacity, so an update
+is O(delta): the touched rows are written in place and new customers are
+appended into the spare rows, which grow by doubling (amortized O(1) per new
+customer) instead of a concat over every customer.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from helpers.rfm import (encode_customers, first_date_per_customer, last_date_per_customer,
+                         distinct_per_customer, sum_per_customer, days_between, score_rfm)
+
+STATE_METADATA_KEY = b"rfm_state"
+STATE_COLUMNS = ["first_purchase", "last_invoice", "frequency", "monetary"]
+
+
+class RFMState:
+
+    def __init__(self, frame, today_date):
+        """frame: one row per customer (index) with the STATE_COLUMNS."""
+        self.today_date = pd.Timestamp(today_date)
+        self.n = len(frame)
+        self._index = frame.index  # customers of the frame; its hash table is built once and reused
+        self._index_name = frame.index.name
+        self._appended = {}  # customer -> row of the customers added by updates
+        self._customers = frame.index.to_numpy().copy()
+        self._columns = {col: frame[col].to_numpy().copy() for col in STATE_COLUMNS}
+
+    def __len__(self):
+        return self.n
+
+    def rows(self, customers):
+        """Row of every customer in the state, -1 for the ones it does not have."""
+        rows = self._index.get_indexer(customers)
+        if self._appended:
+            for position in np.flatnonzero(rows < 0):
+                rows[position] = self._appended.get(customers[position], -1)
+        return rows
+
+    def append(self, frame):
+        """Adds the customers of frame (not in the state yet) into the spare rows."""
+        end = self.n + len(frame)
+        if end > len(self._customers):
+            capacity = max(end, 2 * len(self._customers), 16)
+            self._customers = _grown(self._customers, capacity)
+            self._columns = {col: _grown(values, capacity) for col, values in self._columns.items()}
+        self._customers[self.n:end] = frame.index.to_numpy()
+        for col in STATE_COLUMNS:
+            self._columns[col][self.n:end] = frame[col].to_numpy()
+        self._appended.update(zip(frame.index, range(self.n, end)))
+        self.n = end
+
+    def column(self, col):
+        """Values of a state column (a view of the first n rows)."""
+        return self._columns[col][:self.n]
+
+    def to_frame(self):
+        """The state as a DataFrame, one row per customer."""
+        return pd.DataFrame({col: self.column(col) for col in STATE_COLUMNS},
+                            index=pd.Index(self._customers[:self.n], name=self._index_name))
+
+
+def _grown(values, capacity):
+    grown = np.empty(capacity, dtype=values.dtype)
+    grown[:len(values)] = values
+    return grown
+
+
+def _aggregate(dataframe, customer_col="Customer ID", date_col="InvoiceDate", invoice_col="Invoice",
+               price_col="TotalPrice"):
+    dataframe = dataframe[dataframe[customer_col].notna()]
+    codes, customers = encode_customers(dataframe, customer_col)
+    n_customers = len(customers)
+    dates = dataframe[date_col].to_numpy()
+    return pd.DataFrame({"first_purchase": first_date_per_customer(codes, dates, n_customers),
+                         "last_invoice": last_date_per_customer(codes, dates, n_customers),
+                         "frequency": distinct_per_customer(codes, dataframe[invoice_col], n_customers),
+                         "monetary": sum_per_customer(codes, dataframe[price_col].to_numpy(), n_customers)},
+                        index=customers)
+
+
+def build_rfm_state(dataframe, today_date, **columns):
+    """Per-customer state from prepared transactions (TotalPrice added, cancellations and NaNs removed)."""
+    return RFMState(_aggregate(dataframe, **columns), today_date)
+
+
+def update_rfm(state, new_transactions, today_date=None, **columns):
+    """
+    Merges a batch of new (not yet counted) invoices into the state, in place; returns None.
+
+    Only the delta is aggregated and only the rows of the customers it touches are
+    written; new customers go into the spare rows of the state. today_date moves the
+    analysis date forward (the stored one is kept when None). Score the updated state
+    with score_state (it ranks all customers, so it is O(customers)).
+    """
+    delta = _aggregate(new_transactions, **columns)
+    if today_date is not None:
+        state.today_date = pd.Timestamp(today_date)
+
+    rows = state.rows(delta.index)
+    known = rows >= 0
+    touched, updates = rows[known], delta[known]
+    first_purchase, last_invoice = state.column("first_purchase"), state.column("last_invoice")
+    first_purchase[touched] = np.minimum(first_purchase[touched], updates["first_purchase"].to_numpy())
+    last_invoice[touched] = np.maximum(last_invoice[touched], updates["last_invoice"].to_numpy())
+    # a customer appears once in the delta, so the fancy-indexed += adds every update once
+    state.column("frequency")[touched] += updates["frequency"].to_numpy()
+    state.column("monetary")[touched] += updates["monetary"].to_numpy()
+    if not known.all():
+        state.append(delta[~known])
+
+
+def rfm_from_state(state, today_date=None):
+    """recency/frequency/monetary table; recency is measured from today_date (default: the stored one)."""
+    today_date = state.today_date if today_date is None else today_date
+    frame = state.to_frame()
+    return pd.DataFrame({"recency": days_between(today_date, frame["last_invoice"].to_numpy()).astype("int64"),
+                         "frequency": frame["frequency"].to_numpy(),
+                         "monetary": frame["monetary"].to_numpy()}, index=frame.index)
+
+
+def score_state(state, today_date=None):
+    """Scored RFM table of the customers with monetary > 0 (score_rfm), sorted by customer."""
+    # appended customers are at the end of the state; sorted like a groupby, the frequency ties
+    # (rank(method="first")) are broken as in a full rebuild
+    return score_rfm(rfm_from_state(state, today_date).query("monetary > 0").sort_index())
+
+
+def save_rfm_state(state, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(state.to_frame())
+    metadata = dict(table.schema.metadata or {})
+    metadata[STATE_METADATA_KEY] = json.dumps({"today_date": state.today_date.isoformat()}).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+
+
+def load_rfm_state(path):
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    info = json.loads(table.schema.metadata[STATE_METADATA_KEY])
+    return RFMState(table.to_pandas(), info["today_date"])
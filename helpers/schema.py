@@ -0,0 +1,100 @@
+"""
+Compact typed schema for Online Retail II transaction frames.
+
+read_excel_cached / pd.read_excel return Invoice, StockCode, Description and
+Country as one string per row and Customer ID as float64, which is most of the
+memory of a sheet. compact_transactions stores:
+
+    Invoice                  int32, the invoice number without its letter prefix
+    InvoicePrefix            category, the letter prefix ("" for a normal invoice,
+                             "C" cancelled, "A" adjustment)
+    is_cancelled             bool, the "C" of the cancelled invoices
+    StockCode, Description,  category (the strings are kept once; .str,
+    Country                  nunique, groupby and comparisons work as before)
+    Customer ID              Int32 (nullable, missing customers stay NA)
+    Quantity                 int32 (float32 with float32=True)
+    Price, TotalPrice        float64 (float32 with float32=True)
+
+Invoice keeps its name, so nunique / groupby on it and the create_* functions
+of the scripts run on the compact frame unchanged; cancellations are selected
+with is_cancelled (helpers/cleaning.not_cancelled does so) instead of
+Invoice.str.contains("C"), and the adjustments (bad debt write-offs) stay
+apart from the sales with InvoicePrefix. When some invoice has no number that
+fits int32, Invoice stays a category instead (and keeps its prefix).
+
+float32 money halves the numeric columns again but sums of many float32 prices
+lose cents, so it is off by default.
+
+Measured on a synthetic 541,910-row 2010-2011 sheet: 152 MB with object
+strings (pandas < 3) -> 18.7 MB, 8.1x less. pandas >= 3 already stores the
+strings as Arrow str (50.8 MB), and there the frame shrinks 2.7x (3.0x with
+float32=True): the 8-byte InvoiceDate and Price columns and the 4-byte
+Invoice / Customer ID / Quantity columns are the floor, so the 4x target is
+not reached against that baseline.
+"""
+
+import numpy as np
+import pandas as pd
+
+CATEGORY_COLUMNS = ["StockCode", "Description", "Country"]
+MONEY_COLUMNS = ["Price", "TotalPrice"]
+
+
+def _integral(values):
+    values = values.dropna()
+    return bool(np.all(np.mod(values, 1) == 0))
+
+
+def _fits(values, dtype):
+    info = np.iinfo(dtype)
+    return values.empty or (values.min() >= info.min and values.max() <= info.max)
+
+
+def _categorical(values):
+    # the Excel reader gives numeric stock codes / invoices as ints, the others as str
+    return values.where(values.isna(), values.astype(str)).astype("category")
+
+
+def compact_transactions(dataframe, float32=False, invoice_col="Invoice", customer_col="Customer ID"):
+    """Copy of a transaction frame in the compact schema (columns it does not know are kept as they are)."""
+    dataframe = dataframe.copy()
+
+    # an int Invoice is already compact (its prefix and cancel flag are in their own columns)
+    if invoice_col in dataframe and dataframe[invoice_col].dtype.kind not in "iu":
+        invoice = dataframe[invoice_col].astype(str)
+        # letter prefix ("C" cancelled, "A" adjustment) followed by the number; anything else does not parse
+        parts = invoice.str.extract(r"^([A-Z]*)(\d+)$")
+        number = pd.to_numeric(parts[1], errors="coerce")
+        dataframe["is_cancelled"] = invoice.str.contains("C", regex=False).to_numpy(dtype=bool)
+        if number.notna().all() and _fits(number, np.int32):
+            dataframe[invoice_col] = number.astype("int32")
+            dataframe.insert(dataframe.columns.get_loc(invoice_col) + 1, "InvoicePrefix",
+                             parts[0].astype("category"))
+        elif not isinstance(dataframe[invoice_col].dtype, pd.CategoricalDtype):
+            dataframe[invoice_col] = _categorical(dataframe[invoice_col])
+
+    for col in CATEGORY_COLUMNS:
+        if col in dataframe and not isinstance(dataframe[col].dtype, pd.CategoricalDtype):
+            dataframe[col] = _categorical(dataframe[col])
+
+    if customer_col in dataframe and dataframe[customer_col].dtype.kind in "iuf" \
+            and _integral(dataframe[customer_col]) and _fits(dataframe[customer_col].dropna(), np.int32):
+        dataframe[customer_col] = dataframe[customer_col].astype("Int32")
+
+    if "Quantity" in dataframe:
+        quantity = dataframe["Quantity"]
+        if float32:
+            dataframe["Quantity"] = quantity.astype("float32")
+        elif quantity.dtype.kind in "iu" and _fits(quantity, np.int32):
+            dataframe["Quantity"] = quantity.astype("int32")
+
+    if float32:
+        for col in MONEY_COLUMNS:
+            if col in dataframe:
+                dataframe[col] = dataframe[col].astype("float32")
+    return dataframe
+
+
+def memory_usage_mb(dataframe):
+    """Deep memory usage of a DataFrame in MB (strings and categories included)."""
+    return dataframe.memory_usage(deep=True).sum() / 1024 ** 2
@@ -0,0 +1,177 @@
+"""
+In-process CLTV scoring for single customers and micro-batches.
+
+The service only needs the fitted parameters (BG-NBD r, alpha, a, b and
+Gamma-Gamma p, q, v) and the frozen CLTV segment breakpoints, so it can be
+built from fitted models, from the model registry or from its own JSON file,
+and scores without pandas or lifetimes on the request path. Recent results are
+kept in an LRU cache and the latency of every call is recorded (latency()).
+
+serve() exposes the same service as a local HTTP endpoint (standard library
+only):
+    POST /score  {"frequency": 5, "recency": 20.0, "T": 40.0, "monetary": 150.0}
+                 or a list of such objects
+    GET  /stats  latency percentiles and cache counters
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from helpers.bgnbd import PARAM_NAMES, expected_purchases
+from helpers.cltv import FREQ_FACTOR
+
+GAMMA_GAMMA_PARAM_NAMES = ["p", "q", "v"]
+SEGMENT_LABELS = ["D", "C", "B", "A"]
+
+
+def expected_average_profit(params, frequency, monetary_value):
+    """GammaGammaFitter.conditional_expected_average_profit for numpy arrays."""
+    p, q, v = params
+    individual_weight = p * frequency / (p * frequency + q - 1)
+    population_mean = v * p / (q - 1)
+    return (1 - individual_weight) * population_mean + individual_weight * monetary_value
+
+
+class CLTVScoringService:
+
+    def __init__(self, bgf_params, ggf_params, segment_edges, segment_labels=SEGMENT_LABELS, time=6, freq="W",
+                 discount_rate=0.01, cache_size=4096, latency_window=10000):
+        self.bgf_params = np.asarray([bgf_params[name] for name in PARAM_NAMES], dtype="float64")
+        self.ggf_params = np.asarray([ggf_params[name] for name in GAMMA_GAMMA_PARAM_NAMES], dtype="float64")
+        self.segment_edges = np.asarray(segment_edges, dtype="float64")
+        self.segment_labels = list(segment_labels)
+        self.time, self.freq, self.discount_rate = time, freq, discount_rate
+        months = np.arange(1, time + 1)
+        self._points = np.r_[0.0, months * FREQ_FACTOR[freq]]
+        self._discount = (1 + discount_rate) ** -months.astype("float64")
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self.hits = self.misses = 0
+
+    @classmethod
+    def from_models(cls, bgf, ggf, clv, q=4, **kwargs):
+        """Fitted models plus the CLTV of the training customers, whose pd.qcut(clv, q) edges are frozen."""
+        edges = np.quantile(np.asarray(clv, dtype="float64"), np.linspace(0, 1, q + 1))
+        return cls(bgf.params_, ggf.params_, edges, **kwargs)
+
+    @classmethod
+    def from_registry(cls, registry, segment_edges, bgf_name="bgnbd", ggf_name="gamma_gamma", **kwargs):
+        return cls(registry.record(bgf_name)["params"], registry.record(ggf_name)["params"], segment_edges, **kwargs)
+
+    def save(self, path):
+        with open(path, "w") as file:
+            json.dump({"bgf_params": dict(zip(PARAM_NAMES, self.bgf_params.tolist())),
+                       "ggf_params": dict(zip(GAMMA_GAMMA_PARAM_NAMES, self.ggf_params.tolist())),
+                       "segment_edges": self.segment_edges.tolist(), "segment_labels": self.segment_labels,
+                       "time": self.time, "freq": self.freq, "discount_rate": self.discount_rate}, file, indent=2)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path) as file:
+            config = json.load(file)
+        return cls(**config, **kwargs)
+
+    def _score_arrays(self, frequency, recency, T, monetary):
+        # same computation as helpers.cltv.customer_lifetime_value_horizons for the single horizon self.time
+        cumulative = expected_purchases(self.bgf_params, self._points[None, :], frequency[:, None],
+                                        recency[:, None], T[:, None])
+        profit = expected_average_profit(self.ggf_params, frequency, monetary)
+        clv = profit * (np.diff(cumulative, axis=1) @ self._discount)
+        codes = np.searchsorted(self.segment_edges[1:-1], clv, side="left")
+        return cumulative[:, -1], profit, clv, codes
+
+    def score_batch(self, rows):
+        """rows: (frequency, recency, T, monetary) tuples or dicts with those keys; returns one dict per row."""
+        start = time.perf_counter()
+        keys = [tuple(float(row[name]) for name in ("frequency", "recency", "T", "monetary"))
+                if isinstance(row, dict) else tuple(float(value) for value in row) for row in rows]
+        results = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    results[i] = self._cache[key]
+                    self.hits += 1
+                else:
+                    missing.append(i)
+                    self.misses += 1
+
+        if missing:
+            values = np.asarray([keys[i] for i in missing], dtype="float64")
+            purchases, profit, clv, codes = self._score_arrays(*values.T)
+            with self._lock:
+                for j, i in enumerate(missing):
+                    results[i] = {"expected_purchases": float(purchases[j]), "expected_average_profit": float(profit[j]),
+                                  "clv": float(clv[j]), "segment": self.segment_labels[codes[j]]}
+                    self._cache[keys[i]] = results[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        self._latencies.append(time.perf_counter() - start)
+        return results
+
+    def score(self, frequency, recency, T, monetary):
+        return self.score_batch([(frequency, recency, T, monetary)])[0]
+
+    def latency(self):
+        """p50 / p99 latency of the recorded calls in milliseconds, with the cache counters."""
+        latencies = np.asarray(self._latencies) * 1000
+        p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (np.nan, np.nan)
+        return {"calls": len(latencies), "p50_ms": float(p50), "p99_ms": float(p99),
+                "cache_hits": self.hits, "cache_misses": self.misses}
+
+
+def serve(service, host="127.0.0.1", port=8000, ready=None):
+    """
+    Blocks serving POST /score and GET /stats for service on host:port.
+
+    ready: called with the server once it listens (its server_address has the port when port=0;
+    server.shutdown() from another thread stops serve).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._reply(200, service.latency())
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/score":
+                return self._reply(404, {"error": "not found"})
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                rows = request if isinstance(request, list) else [request]
+                results = service.score_batch(rows)
+            except (ValueError, KeyError, TypeError) as error:
+                return self._reply(400, {"error": str(error)})
+            self._reply(200, results if isinstance(request, list) else results[0])
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    if ready is not None:
+        ready(server)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
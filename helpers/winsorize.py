@@ -0,0 +1,163 @@
+"""
+Multi-column winsorization for the replace_with_thresholds steps of the scripts.
+
+The scripts compute the 1% and the 99% quantile of a column in two passes and
+cap it with two .loc assignments, one column after the other. Winsorizer fits
+the limits of all columns in one call (both quantiles of a column from a single
+np.quantile call over the columns, or from one QuantileSketch per column for
+chunked input), then caps every column with one vectorized pass. The limits are
+those of outlier_thresholds:
+
+    low  = q01 - 1.5 * (q99 - q01)
+    up   = q99 + 1.5 * (q99 - q01)
+
+sides="upper" only caps from above (cltv_prediction.py), sides="both" caps
+both ends (FLO and Project scripts). round_limits behaves as round(limit, 0)
+in those scripts: values are compared with the unrounded limits and the ones
+beyond a limit are set to the rounded limit, so a value between round(up) and
+up is left as it is.
+
+The fitted limits are saved as JSON (save / load, or through the model
+registry with winsorizer_from_registry) so that data scored later is clipped
+with the limits of the training data instead of its own quantiles.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from helpers.quantile_sketch import QuantileSketch
+
+
+class Winsorizer:
+
+    def __init__(self, lower_quantile=0.01, upper_quantile=0.99, iqr_factor=1.5, sides="both", round_limits=False):
+        if sides not in ("both", "upper"):
+            raise ValueError("sides must be 'both' or 'upper', got %r" % (sides,))
+        self.lower_quantile, self.upper_quantile = lower_quantile, upper_quantile
+        self.iqr_factor = iqr_factor
+        self.sides = sides
+        self.round_limits = round_limits
+        self.limits_ = {}
+
+    def _set_limits(self, columns, quantiles):
+        # quantiles: (2, n_columns) array of the lower and upper quantile of each column
+        low_q, up_q = quantiles
+        iqr = up_q - low_q
+        low, up = low_q - self.iqr_factor * iqr, up_q + self.iqr_factor * iqr
+        self.limits_ = {col: (float(low[i]), float(up[i])) for i, col in enumerate(columns)}
+        return self
+
+    def fit(self, dataframe, columns):
+        """Limits of every column: both quantiles of all columns from one np.quantile call."""
+        columns = list(columns)
+        probabilities = [self.lower_quantile, self.upper_quantile]
+        values = dataframe[columns].to_numpy(dtype="float64", na_value=np.nan)
+        # nanquantile only when needed: it is much slower than quantile on columns without NaN
+        quantile = np.nanquantile if np.isnan(values).any() else np.quantile
+        return self._set_limits(columns, quantile(values, probabilities, axis=0).reshape(2, len(columns)))
+
+    def fit_quantiles(self, columns, quantiles):
+        """Limits from precomputed quantiles: (2, n_columns), the lower and upper quantile of each column."""
+        return self._set_limits(list(columns), np.asarray(quantiles, dtype="float64"))
+
+    def fit_chunks(self, chunks, columns, k=4096):
+        """Limits from QuantileSketches updated chunk by chunk (approximate once a sketch compacts)."""
+        columns = list(columns)
+        sketches = {col: QuantileSketch(k) for col in columns}
+        for chunk in chunks:
+            for col in columns:
+                sketches[col].update(chunk[col].to_numpy(dtype="float64", na_value=np.nan))
+        probabilities = [self.lower_quantile, self.upper_quantile]
+        return self._set_limits(columns, np.column_stack([sketches[col].quantile(probabilities) for col in columns]))
+
+    def caps(self):
+        """
+        {column: (low, up, low_value, up_value)}: values below low are set to low_value and values
+        above up to up_value (the rounded limits with round_limits). low and low_value are None
+        with sides="upper".
+        """
+        caps = {}
+        for col, (low, up) in self.limits_.items():
+            low_value, up_value = (float(np.round(low)), float(np.round(up))) if self.round_limits else (low, up)
+            if self.sides == "upper":
+                low = low_value = None
+            caps[col] = (low, up, low_value, up_value)
+        return caps
+
+    def transform(self, dataframe):
+        """Caps the fitted columns of dataframe in place and returns it."""
+        if not self.limits_:
+            raise ValueError("Winsorizer is not fitted")
+        for col, (low, up, low_value, up_value) in self.caps().items():
+            values = dataframe[col].to_numpy()
+            above = values > up
+            below = values < low if low is not None else np.zeros(len(values), dtype=bool)
+            if not (above.any() or below.any()):
+                continue  # nothing to cap: the column (and its dtype) is left as it is
+            if values.dtype.kind in "iu" and all(value is None or value.is_integer() for value in (low_value, up_value)):
+                # whole-number caps keep integer columns integer
+                info = np.iinfo(values.dtype)
+                capped = values.copy()
+                up_value = min(int(up_value), info.max)
+                low_value = None if low_value is None else max(int(low_value), info.min)
+            else:
+                capped = values.astype("float64") if values.dtype.kind in "iu" else values.copy()
+            capped[above] = up_value
+            if low_value is not None:
+                capped[below] = low_value
+            dataframe[col] = capped
+        return dataframe
+
+    def fit_transform(self, dataframe, columns):
+        return self.fit(dataframe, columns).transform(dataframe)
+
+    def to_dict(self):
+        return {"lower_quantile": self.lower_quantile, "upper_quantile": self.upper_quantile,
+                "iqr_factor": self.iqr_factor, "sides": self.sides, "round_limits": self.round_limits,
+                "limits": {col: list(limits) for col, limits in self.limits_.items()}}
+
+    @classmethod
+    def from_dict(cls, config):
+        config = dict(config)
+        limits = config.pop("limits")
+        winsorizer = cls(**config)
+        winsorizer.limits_ = {col: tuple(limits) for col, limits in limits.items()}
+        return winsorizer
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            return cls.from_dict(json.load(file))
+
+
+def winsorizer_from_registry(registry, name, dataframe, columns, refit=True, quantiles=None, **kwargs):
+    """
+    Winsorizer with the model registry around it, as fit_with_registry:
+    registry None fits on dataframe[columns]; refit=False loads the stored limits;
+    otherwise the limits are fitted and stored as <name> next to the models.
+
+    quantiles: optional function (columns, probabilities) -> (2, n_columns) array used
+    instead of dataframe, e.g. a compute backend's quantiles (helpers/backends.py).
+    """
+    if registry is not None and not refit:
+        if not os.path.exists(registry.path(name)):
+            raise ValueError("No thresholds named %r in %s" % (name, registry.directory))
+        return Winsorizer.load(registry.path(name))
+    winsorizer = Winsorizer(**kwargs)
+    if quantiles is None:
+        winsorizer.fit(dataframe, columns)
+    else:
+        winsorizer.fit_quantiles(columns, quantiles(list(columns), [winsorizer.lower_quantile,
+                                                                    winsorizer.upper_quantile]))
+    if registry is not None:
+        os.makedirs(registry.directory, exist_ok=True)
+        winsorizer.save(registry.path(name))
+    return winsorizer
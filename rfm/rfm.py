@@ -40,12 +40,29 @@
 ###############################################################
 
 import datetime as dt
+import os
+from collections.abc import Iterable
 import pandas as pd
+from helpers.backends import rfm_table
+from helpers.cleaning import clean, not_cancelled, not_null
+from helpers.export import export
+from helpers.ingest import read_excel_cached
+from helpers.rfm import (rfm_metrics, rfm_metrics_chunked, read_transaction_chunks, score_rfm,
+                         segment_from_scores)
+from helpers.parallel import parallel_rfm_metrics
+from helpers.profiling import NULL_PROFILER, StageProfiler
+from helpers.quantile_sketch import sketch_rfm, merge_sketches, rfm_breakpoints
+from helpers.rfm_snapshots import rfm_snapshots, segment_transitions
+from helpers.rfm_state import build_rfm_state, update_rfm, score_state, save_rfm_state, load_rfm_state
+from helpers.schema import compact_transactions
 pd.set_option('display.max_columns', None)
 # pd.set_option('display.max_rows', None)
 pd.set_option('display.float_format', lambda x: '%.3f' % x)
 
-df_ = pd.read_excel("/Users/mvahit/Desktop/DSMLBC4/datasets/online_retail_II.xlsx", sheet_name="Year 2009-2010")
+# compact_transactions: int32 fatura no + InvoicePrefix (C / A harfi) + is_cancelled,
+# kategorik metin kolonları, int32 ID / adet (helpers/schema.py)
+df_ = compact_transactions(read_excel_cached("/Users/mvahit/Desktop/DSMLBC4/datasets/online_retail_II.xlsx",
+                                             sheet_name="Year 2009-2010"))
 df = df_.copy()
 df.head()
 df.shape
@@ -75,7 +92,8 @@ df.isnull().sum()
 df.describe().T
 df = df[(df['Quantity'] > 0)]
 df.dropna(inplace=True)
-df = df[~df["Invoice"].str.contains("C", na=False)]
+# iptaller compact şemada is_cancelled kolonunda (Invoice artık int32 fatura numarası)
+df = df[~df["is_cancelled"]]
 
 ###############################################################
 # 4. RFM Metriklerinin Hesaplanması (Calculating RFM Metrics)
@@ -96,6 +114,12 @@ rfm.head()
 
 rfm.columns = ['recency', 'frequency', 'monetary']
 
+# Aynı metrikler müşteri başına lambda çağırmadan da hesaplanabilir (helpers/rfm.py):
+# Customer ID yoğun tamsayı kodlara çevrilir, metrikler bincount ve vektörel indirgemelerle bulunur.
+# Parite kontrolü: iki yöntem aynı recency/frequency/monetary tablosunu üretmeli.
+rfm_fast = rfm_metrics(df, today_date)
+pd.testing.assert_frame_equal(rfm_fast, rfm, check_exact=False)
+
 rfm.describe().T
 
 rfm = rfm[rfm["monetary"] > 0]
@@ -144,6 +168,10 @@ seg_map = {
 
 rfm['segment'] = rfm['RFM_SCORE'].replace(seg_map, regex=True)
 
+# Aynı sonuç regex'siz: seg_map bir kez 5x5'lik (recency_score, frequency_score) tablosuna derlenir,
+# segmentler tek bir vektörel indeksleme ile kategorik değişken olarak gelir (create_rfm bunu kullanır).
+(segment_from_scores(rfm["recency_score"], rfm["frequency_score"], seg_map) == rfm["segment"]).all()
+
 rfm[["segment", "recency", "frequency", "monetary"]].groupby("segment").agg(["mean", "count"])
 
 rfm[rfm["segment"] == "cant_loose"].head()
@@ -154,66 +182,147 @@ new_df["new_customer_id"] = rfm[rfm["segment"] == "new_customers"].index
 
 new_df["new_customer_id"] = new_df["new_customer_id"].astype(int)
 
-new_df.to_csv("new_customers.csv")
+# Arrow ile parça parça yazılır; .parquet / .csv.gz / .arrow uzantıları da desteklenir (helpers/export.py)
+export(new_df, "new_customers.csv")
 
-rfm.to_csv("rfm.csv")
+export(rfm, "rfm.csv")
 
 ###############################################################
 # 7. Tüm Sürecin Fonksiyonlaştırılması
 ###############################################################
 
-def create_rfm(dataframe, csv=False):
+def prep_rules():
+    # eksik değerli ve iptal edilen satırlar atılır; data_prep ve backend'ler aynı kuralları kullanır
+    return [not_null(), not_cancelled()]
 
-    # VERIYI HAZIRLAMA
-    dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
-    dataframe.dropna(inplace=True)
-    dataframe = dataframe[~dataframe["Invoice"].str.contains("C", na=False)]
 
-    # RFM METRIKLERININ HESAPLANMASI
+def data_prep(dataframe, stage=None):
+    # kurallar tek bir maske ile uygulanır, girdi değiştirilmez (helpers/cleaning.py)
+    dataframe, dropped = clean(dataframe, prep_rules())
+    if stage is not None:
+        stage.annotate(dropped_rows=dropped)
+    dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
+    return dataframe
+
+
+def create_rfm(dataframe, csv=False, breakpoints=None, n_jobs=1, profiler=None, backend="pandas"):
+    # dataframe: tüm veri (DataFrame) ya da belleğe sığmayan dosyalar için satır parçaları
+    # üreten bir iterator (read_transaction_chunks). Parçalar müşteri bazında özetlenip birleştirilir,
+    # skorlama ve segmentasyon bu küçük müşteri tablosu üzerinde yapılır.
+    # n_jobs > 1 (ya da -1: tüm çekirdekler): veri Customer ID hash'ine göre parçalanıp süreç havuzunda
+    # özetlenir; birleştirilen müşteri tablosu merkezde qcut ile skorlanır (seri çalışmayla aynı segmentler).
+    # breakpoints (birleştirilmiş sketch sınırları) verilirse skorlar qcut'tan en fazla sketch'in hata payı
+    # kadar sapabilir; müşteri oranı olarak üst sınır rfm.attrs["score_error_bound"] içinde döner.
+    # profiler: adım bazında süre, satır sayısı ve bellek ölçümü (helpers/profiling.py, StageProfiler)
+    # backend: "pandas", "polars" ya da "duckdb" (helpers/backends.py). polars / duckdb ile temizleme ve
+    # müşteri bazında özetleme o motorda çok çekirdekli yapılır, pandas'a sadece müşteri tablosu gelir;
+    # dataframe bir Parquet dosyasının yolu da olabilir, dosya belleğe okunmadan taranır.
+    # pandas ile bir Parquet / CSV yolu read_transaction_chunks ile parça parça okunur.
+    if isinstance(dataframe, os.PathLike):
+        dataframe = os.fspath(dataframe)
+    if backend == "pandas" and isinstance(dataframe, str):
+        dataframe = read_transaction_chunks(dataframe)
+    if backend == "pandas" and not isinstance(dataframe, (pd.DataFrame, Iterable)):
+        raise TypeError("create_rfm takes a DataFrame, an iterator of DataFrame chunks or a Parquet / CSV path, "
+                        "got %s" % type(dataframe).__name__)
+    if backend != "pandas" and not isinstance(dataframe, (pd.DataFrame, str)):
+        raise TypeError("backend=%r takes a DataFrame or a Parquet path, got %s" % (backend, type(dataframe).__name__))
+    profiler = (profiler or NULL_PROFILER).for_pipeline("create_rfm")
     today_date = dt.datetime(2011, 12, 11)
-    rfm = dataframe.groupby('Customer ID').agg({'InvoiceDate': lambda date: (today_date - date.max()).days,
-                                                'Invoice': lambda num: num.nunique(),
-                                                "TotalPrice": lambda price: price.sum()})
-    rfm.columns = ['recency', 'frequency', "monetary"]
-    rfm = rfm[(rfm['monetary'] > 0)]
-
-    # RFM SKORLARININ HESAPLANMASI
-    rfm["recency_score"] = pd.qcut(rfm['recency'], 5, labels=[5, 4, 3, 2, 1])
-    rfm["frequency_score"] = pd.qcut(rfm["frequency"].rank(method="first"), 5, labels=[1, 2, 3, 4, 5])
-    rfm["monetary_score"] = pd.qcut(rfm['monetary'], 5, labels=[1, 2, 3, 4, 5])
-
-    # cltv_df skorları kategorik değere dönüştürülüp df'e eklendi
-    rfm["RFM_SCORE"] = (rfm['recency_score'].astype(str) +
-                        rfm['frequency_score'].astype(str))
-
-
-    # SEGMENTLERIN ISIMLENDIRILMESI
-    seg_map = {
-        r'[1-2][1-2]': 'hibernating',
-        r'[1-2][3-4]': 'at_risk',
-        r'[1-2]5': 'cant_loose',
-        r'3[1-2]': 'about_to_sleep',
-        r'33': 'need_attention',
-        r'[3-4][4-5]': 'loyal_customers',
-        r'41': 'promising',
-        r'51': 'new_customers',
-        r'[4-5][2-3]': 'potential_loyalists',
-        r'5[4-5]': 'champions'
-    }
-
-    rfm['segment'] = rfm['RFM_SCORE'].replace(seg_map, regex=True)
-    rfm = rfm[["recency", "frequency", "monetary", "segment"]]
-    rfm.index = rfm.index.astype(int)
+
+    # VERIYI HAZIRLAMA & RFM METRIKLERININ HESAPLANMASI
+    if isinstance(dataframe, pd.DataFrame) and backend == "pandas":
+        with profiler.stage("data_prep", dataframe) as stage:
+            dataframe = data_prep(dataframe, stage)
+            stage.output(dataframe)
+    with profiler.stage("rfm_metrics", None if isinstance(dataframe, str) else dataframe) as stage:
+        if backend != "pandas":
+            rfm, dropped = rfm_table(dataframe, today_date, prep_rules(), backend)
+            stage.annotate(backend=backend, dropped_rows=dropped)
+        elif isinstance(dataframe, pd.DataFrame) and n_jobs != 1:
+            rfm = parallel_rfm_metrics(dataframe, today_date, n_jobs=n_jobs)
+        elif isinstance(dataframe, pd.DataFrame):
+            rfm = rfm_metrics(dataframe, today_date)
+        else:
+            rfm = rfm_metrics_chunked((data_prep(chunk) for chunk in dataframe), today_date)
+        rfm = rfm[(rfm['monetary'] > 0)]
+        stage.output(rfm)
+
+    # RFM SKORLARININ HESAPLANMASI & SEGMENTLERIN ISIMLENDIRILMESI (helpers/rfm.py: score_rfm, SEG_MAP)
+    # breakpoints: parçalardan (shard/chunk) birleştirilen sketch'lerin quintile sınırları (rfm_breakpoints)
+    with profiler.stage("score_rfm", rfm) as stage:
+        rfm = score_rfm(rfm, breakpoints=breakpoints)
+        if "score_error_bound" in rfm.attrs:
+            # skorlar sketch sınırlarından geldiyse sıralama hatası üst sınırı rfm.attrs'ta kalır
+            stage.annotate(score_error_bound=rfm.attrs["score_error_bound"])
+        rfm = rfm[["recency", "frequency", "monetary", "segment"]]
+        rfm.index = rfm.index.astype(int)
+        stage.output(rfm)
 
     if csv:
-        rfm.to_csv("rfm.csv")
+        with profiler.stage("export", rfm):
+            export(rfm, "rfm.csv")
 
     return rfm
 
+
+def create_rfm_snapshots(dataframe, dates, profiler=None):
+    # Birden fazla analiz tarihi için RFM: veri bir kez hazırlanır, müşteri ve fatura tarihine göre
+    # bir kez sıralanır; her tarihin recency/frequency/monetary değerleri searchsorted ve kümülatif
+    # toplamlardan okunur (tarih başına yeniden groupby yok). Her tarih, o tarihten önceki faturalarla
+    # create_rfm(today_date=tarih) ne veriyorsa onu verir.
+    # Dönüş: (snapshots, transitions)
+    #   snapshots: (snapshot, Customer ID) indeksli skorlar ve segmentler
+    #   transitions: ardışık iki tarih arasında segmentten segmente geçen müşteri sayıları;
+    #                indeks (snapshot, from_segment), sütunlar to_segment, "(none)" = o tarihte müşteri değil
+    profiler = (profiler or NULL_PROFILER).for_pipeline("create_rfm_snapshots")
+    with profiler.stage("data_prep", dataframe) as stage:
+        dataframe = data_prep(dataframe, stage)
+        stage.output(dataframe)
+    with profiler.stage("snapshots", dataframe) as stage:
+        snapshots = rfm_snapshots(dataframe, dates)
+        snapshots = snapshots[["recency", "frequency", "monetary", "segment"]]
+        stage.output(snapshots)
+    with profiler.stage("transitions", snapshots) as stage:
+        transitions = segment_transitions(snapshots)
+        stage.output(transitions)
+    return snapshots, transitions
+
 df = df_.copy()
 
 rfm_new = create_rfm(df, csv=True)
 
+# Adım bazında süre / satır / bellek ölçümü: her adım JSON olarak "crm.profiling" logger'ına yazılır,
+# callback verilirse ona da gönderilir. profiler verilmezse ölçüm yapılmaz.
+profiler = StageProfiler()
+rfm_new = create_rfm(df_.copy(), profiler=profiler)
+profiler.summary()
+
+# Belleğe sığmayan çok yıllık export'lar için (CSV ya da Parquet) parça parça okuma:
+# rfm_big = create_rfm(read_transaction_chunks("datasets/online_retail_all_years.parquet", chunksize=500_000))
+# ya da dosyayı DuckDB / Polars ile çok çekirdekli tarayarak (helpers/backends.py):
+# rfm_big = create_rfm("datasets/online_retail_all_years.parquet", backend="duckdb")
+
+# Skorlar için tüm müşterilerin tek bir süreçte olması gerekmez: her parça kendi quantile sketch'ini çıkarır,
+# sketch'ler birleştirilir ve quintile sınırları searchsorted ile uygulanır. error_bound sıralama hatasının
+# üst sınırıdır (müşteri sayısına oran); frequency eşitlikleri Customer ID ile bozulur (rank(method="first") ile aynı).
+rfm_parts = [rfm_new.iloc[i::4] for i in range(4)]
+breakpoints = rfm_breakpoints(merge_sketches([sketch_rfm(part) for part in rfm_parts]))
+breakpoints["monetary"]["error_bound"]
+rfm_sketch = score_rfm(rfm_new[["recency", "frequency", "monetary"]], breakpoints=breakpoints)
+
+# Artımlı (incremental) RFM: müşteri bazındaki durum (ilk/son alışveriş tarihi, fatura sayısı, toplam harcama)
+# diske yazılır, her gün sadece yeni faturalar bu duruma eklenir ve skorlar yeniden hesaplanır.
+# recency saklanmaz; durumdaki today_date'e göre sorgu anında hesaplanır.
+rfm_state = build_rfm_state(data_prep(df_.copy()), dt.datetime(2011, 12, 11))
+save_rfm_state(rfm_state, "rfm_state.parquet")
+# ertesi gün: update_rfm durumu yerinde günceller (yeni müşteriler boş satırlara eklenir), skorlar ayrıca hesaplanır
+# rfm_state = load_rfm_state("rfm_state.parquet")
+# update_rfm(rfm_state, data_prep(new_invoices_df), today_date=dt.datetime(2011, 12, 12))
+# rfm_daily = score_state(rfm_state)
+# save_rfm_state(rfm_state, "rfm_state.parquet")
+
+
 
 
 
@@ -223,3 +332,8 @@ rfm_new = create_rfm(df, csv=True)
 
 
 
+# Aylık RFM geçmişi (24 ay) ve segmentler arası geçiş matrisi:
+snapshot_dates = pd.date_range("2010-01-01", "2011-12-01", freq="MS")
+rfm_history, segment_moves = create_rfm_snapshots(df_.copy(), snapshot_dates)
+# son ayda champions'tan hangi segmentlere geçildi:
+segment_moves.loc[snapshot_dates[-1]].loc["champions"]
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+@pytest.fixture(scope="session")
+def cltv_table():
+    """BG-NBD / Gamma-Gamma inputs (frequency, recency, T in weeks, monetary) of 2,000 synthetic FLO customers."""
+    from benchmarks.synthetic import flo
+    from helpers.flo import parse_flo
+
+    data, _ = parse_flo(flo(2_000, seed=5))
+    frequency = data["order_num_total_ever_online"] + data["order_num_total_ever_offline"]
+    value = data["customer_value_total_ever_online"] + data["customer_value_total_ever_offline"]
+    table = pd.DataFrame({"frequency": frequency,
+                          "recency": (data["last_order_date"] - data["first_order_date"]).dt.days / 7,
+                          "T": (pd.Timestamp(2021, 6, 1) - data["first_order_date"]).dt.days / 7,
+                          "monetary": value / frequency})
+    table.index = data["master_id"].rename("customer_id")
+    return table[table["frequency"] > 1]
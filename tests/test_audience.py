@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import flo
+from helpers.audience import AudienceIndex
+from helpers.flo import parse_flo
+
+SEGMENTS = ["champions", "loyal_customers", "cant_loose", "about_to_sleep", "hibernating", "new_customers"]
+
+
+@pytest.fixture(scope="module")
+def customers():
+    dataframe, _ = parse_flo(flo(5_000, seed=0))
+    dataframe["segment"] = np.random.default_rng(0).choice(SEGMENTS, len(dataframe))
+    return dataframe
+
+
+def contains(customers, name):
+    return customers["interested_in_categories_12"].astype(str).str.contains(name).to_numpy()
+
+
+def test_campaign_lists_match_the_original_masks(customers):
+    # the masks of FLO_RFM.py before the index, & binding tighter than |
+    segment = customers["segment"]
+    woman = (segment == "champions") | (segment == "loyal_customers") & contains(customers, "KADIN")
+    man_and_child = ((segment == "cant_loose") | (segment == "about_to_sleep") & contains(customers, "ERKEK")
+                     | contains(customers, "COCUK"))
+
+    audience = AudienceIndex.from_frame(customers)
+    assert (audience.mask("segment = champions OR (segment = loyal_customers AND category has KADIN)")
+            == woman.to_numpy()).all()
+    assert (audience.mask("segment = cant_loose OR (segment = about_to_sleep AND category has ERKEK) "
+                          "OR category has COCUK") == man_and_child.to_numpy()).all()
+
+
+def test_and_binds_tighter_than_or(customers):
+    audience = AudienceIndex.from_frame(customers)
+    assert (audience.mask("segment = champions OR segment = loyal_customers AND category has KADIN")
+            == audience.mask("segment = champions OR (segment = loyal_customers AND category has KADIN)")).all()
@@ -0,0 +1,75 @@
+import builtins
+import dis
+import json
+import os
+
+import pytest
+
+from benchmarks import run_benchmarks
+from benchmarks.run_benchmarks import REPO_ROOT, STAGES, compare, load_script_functions
+from benchmarks.synthetic import online_retail
+
+SCRIPTS = sorted({script for script, _, _, _ in STAGES.values()})
+
+
+def global_names(code):
+    # LOAD_GLOBAL names of a function and of the lambdas / functions nested in it
+    names = {instruction.argval for instruction in dis.get_instructions(code) if instruction.opname == "LOAD_GLOBAL"}
+    for constant in code.co_consts:
+        if hasattr(constant, "co_code"):
+            names |= global_names(constant)
+    return names
+
+
+@pytest.mark.parametrize("script", SCRIPTS)
+def test_loaded_functions_only_use_loaded_names(script):
+    # the benchmark loader keeps imports, functions and classes only: a module-level
+    # constant used inside a function would be a NameError in the benchmark
+    namespace = load_script_functions(os.path.join(REPO_ROOT, script))
+    for name, value in namespace.items():
+        if getattr(value, "__code__", None) is None or value.__module__ != "benchmarked_script":
+            continue
+        missing = {global_name for global_name in global_names(value.__code__)
+                   if global_name not in namespace and not hasattr(builtins, global_name)}
+        assert not missing, "%s: %s uses %s, which the benchmark loader does not define" % (script, name, missing)
+
+
+@pytest.mark.parametrize("stage", sorted(STAGES))
+def test_stage_function_is_loaded(stage):
+    script, function_name, _, _ = STAGES[stage]
+    assert callable(load_script_functions(os.path.join(REPO_ROOT, script))[function_name])
+
+
+def test_create_rfm_runs_through_the_loader():
+    create_rfm = load_script_functions(os.path.join(REPO_ROOT, "rfm", "rfm.py"))["create_rfm"]
+    rfm = create_rfm(online_retail(20_000, seed=0, n_customers=300))
+    assert list(rfm.columns) == ["recency", "frequency", "monetary", "segment"]
+    assert len(rfm) > 0
+
+
+def report(*results):
+    return {"results": [{"rows": 1000, "n_jobs": None, **result} for result in results]}
+
+
+def test_compare_reports_slower_and_newly_failing_stages():
+    baseline = report({"stage": "create_rfm", "seconds": 1.0}, {"stage": "create_cltv_c", "seconds": 1.0},
+                      {"stage": "create_cltv_p", "seconds": 1.0},
+                      {"stage": "create_cltv_df", "error": "ValueError: old"})
+    current = report({"stage": "create_rfm", "seconds": 1.1}, {"stage": "create_cltv_c", "seconds": 1.5},
+                     {"stage": "create_cltv_p", "error": "ValueError: new"},
+                     {"stage": "create_cltv_df", "error": "ValueError: old"})
+    regressions = {regression["stage"]: regression for regression in compare(current, baseline)}
+    assert sorted(regressions) == ["create_cltv_c", "create_cltv_p"]
+    assert regressions["create_cltv_c"]["ratio"] == pytest.approx(1.5)
+    assert regressions["create_cltv_p"]["error"] == "ValueError: new"
+
+
+def test_main_fails_when_a_stage_starts_failing(tmp_path, monkeypatch):
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps(report({"stage": "create_rfm", "seconds": 1.0})))
+    monkeypatch.setattr(run_benchmarks, "run", lambda *args: report({"stage": "create_rfm", "error": "KeyError: 'x'"}))
+    assert run_benchmarks.main(["--stages", "create_rfm", "--baseline", str(baseline),
+                                "--output", str(tmp_path / "report.json")]) == 1
+    monkeypatch.setattr(run_benchmarks, "run", lambda *args: report({"stage": "create_rfm", "seconds": 1.0}))
+    assert run_benchmarks.main(["--stages", "create_rfm", "--baseline", str(baseline),
+                                "--output", str(tmp_path / "report.json")]) == 0
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+lifetimes = pytest.importorskip("lifetimes")
+
+from helpers.bgnbd import BGNBDFitter
+
+
+@pytest.fixture(scope="module")
+def fitted(cltv_table):
+    columns = cltv_table["frequency"], cltv_table["recency"], cltv_table["T"]
+    return (lifetimes.BetaGeoFitter(penalizer_coef=0.001).fit(*columns),
+            BGNBDFitter(penalizer_coef=0.001).fit(*columns))
+
+
+def test_params_match_lifetimes(fitted):
+    reference, model = fitted
+    names = ["r", "alpha", "a", "b"]
+    pd.testing.assert_series_equal(model.params_[names], reference.params_[names], check_exact=False, rtol=1e-6)
+
+
+def test_log_likelihood_matches_lifetimes(fitted):
+    reference, model = fitted
+    assert model._negative_log_likelihood_ == pytest.approx(reference._negative_log_likelihood_, rel=1e-10)
+
+
+@pytest.mark.parametrize("t", [4, 12, 24])
+def test_predictions_match_lifetimes(fitted, cltv_table, t):
+    reference, model = fitted
+    columns = cltv_table["frequency"], cltv_table["recency"], cltv_table["T"]
+    np.testing.assert_allclose(model.predict(t, *columns), reference.predict(t, *columns), rtol=1e-6)
+    np.testing.assert_allclose(model.predict_horizons([t], *columns)[t], reference.predict(t, *columns), rtol=1e-6)
+
+
+def test_a_fit_that_does_not_converge_raises(cltv_table):
+    # two BFGS iterations cannot reach the optimum; lifetimes raises on any unsuccessful fit too
+    with pytest.raises(ValueError, match="did not converge"):
+        BGNBDFitter(penalizer_coef=0.001).fit(cltv_table["frequency"], cltv_table["recency"], cltv_table["T"],
+                                              maxiter=2)
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("lifetimes")
+from lifetimes import GammaGammaFitter
+
+from helpers.bgnbd import BGNBDFitter
+from helpers.bootstrap import bootstrap_cltv
+
+
+@pytest.fixture(scope="module")
+def models(cltv_table):
+    bgf = BGNBDFitter(penalizer_coef=0.001).fit(cltv_table["frequency"], cltv_table["recency"], cltv_table["T"])
+    ggf = GammaGammaFitter(penalizer_coef=0.01).fit(cltv_table["frequency"], cltv_table["monetary"])
+    return bgf, ggf
+
+
+def run(cltv_table, models, seed=0, n_jobs=1):
+    segments = pd.qcut(cltv_table["monetary"], 4, labels=["D", "C", "B", "A"])
+    return bootstrap_cltv(*models, cltv_table["frequency"], cltv_table["recency"], cltv_table["T"],
+                          cltv_table["monetary"], segments=segments, n_boot=12, seed=seed, n_jobs=n_jobs)
+
+
+def test_percentiles_are_ordered(cltv_table, models):
+    customers, segments = run(cltv_table, models)
+    assert list(customers.columns) == ["clv_p5", "clv_p50", "clv_p95"]
+    assert customers.index.equals(cltv_table.index)
+    assert customers.notna().all().all()
+    assert (customers["clv_p5"] <= customers["clv_p50"]).all()
+    assert (customers["clv_p50"] <= customers["clv_p95"]).all()
+    assert (customers["clv_p5"] < customers["clv_p95"]).any()
+    assert sorted(segments.index) == ["A", "B", "C", "D"]
+    assert segments["n_customers"].sum() == len(cltv_table)
+    assert (segments["clv_p5"] <= segments["clv_p50"]).all() and (segments["clv_p50"] <= segments["clv_p95"]).all()
+
+
+def test_fixed_seed_is_reproducible(cltv_table, models):
+    first, first_segments = run(cltv_table, models, seed=7)
+    # the replicates are seeded individually, so the result does not depend on the number of workers
+    second, second_segments = run(cltv_table, models, seed=7, n_jobs=2)
+    pd.testing.assert_frame_equal(first, second)
+    pd.testing.assert_frame_equal(first_segments, second_segments)
+    other, _ = run(cltv_table, models, seed=8)
+    assert not np.allclose(first.to_numpy(), other.to_numpy())
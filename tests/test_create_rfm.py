@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+import pytest
+
+from benchmarks.run_benchmarks import REPO_ROOT, load_script_functions
+from benchmarks.synthetic import online_retail
+from helpers.quantile_sketch import merge_sketches, rfm_breakpoints, sketch_rfm
+
+create_rfm = load_script_functions(os.path.join(REPO_ROOT, "rfm", "rfm.py"))["create_rfm"]
+
+
+@pytest.fixture(scope="module")
+def transactions():
+    return online_retail(30_000, seed=3, n_customers=400)
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".csv"])
+def test_path_on_pandas_backend_streams_the_file(transactions, tmp_path, suffix):
+    path = tmp_path / ("transactions" + suffix)
+    if suffix == ".parquet":
+        transactions.to_parquet(path)
+    else:
+        transactions.to_csv(path, index=False)
+    expected = create_rfm(transactions.copy())
+    pd.testing.assert_frame_equal(create_rfm(str(path)), expected, check_exact=False, rtol=1e-9)
+    pd.testing.assert_frame_equal(create_rfm(path), expected, check_exact=False, rtol=1e-9)
+
+
+def test_unsupported_input_raises_type_error():
+    with pytest.raises(TypeError, match="create_rfm takes a DataFrame"):
+        create_rfm(42)
+
+
+def test_parallel_run_matches_serial_above_sketch_k():
+    # more customers than the k=1024 of a sketch: scoring must still be the exact qcut of a serial run
+    transactions = online_retail(60_000, seed=4, n_customers=3_000)
+    serial = create_rfm(transactions.copy())
+    assert len(serial) > 1024
+    pd.testing.assert_frame_equal(create_rfm(transactions.copy(), n_jobs=4), serial)
+    assert "score_error_bound" not in serial.attrs
+
+
+def test_sketch_breakpoints_report_their_error_bound():
+    transactions = online_retail(60_000, seed=4, n_customers=3_000)
+    serial = create_rfm(transactions.copy())
+    parts = [serial.iloc[i::4] for i in range(4)]
+    breakpoints = rfm_breakpoints(merge_sketches([sketch_rfm(part, k=256) for part in parts]))
+    approximate = create_rfm(transactions.copy(), breakpoints=breakpoints)
+    bounds = approximate.attrs["score_error_bound"]
+    assert set(bounds) == {"recency", "frequency", "monetary"}
+    assert 0 < bounds["recency"] < 1  # the k=256 sketches did compact
+    # segments can only differ for customers whose rank is within the bound of a quintile edge
+    disagreement = (approximate["segment"].astype(str) != serial["segment"].astype(str)).mean()
+    assert disagreement <= 2 * (bounds["recency"] + bounds["frequency"]) * 4 + 1e-12
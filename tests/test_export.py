@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+
+from helpers.export import export, export_many
+
+
+def read_bytes(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+@pytest.mark.parametrize("data", [
+    pd.Series(["00022580-ce3c", "00089c51-30dc", "002006ef-5a2c"], index=[2, 5, 15], name="master_id"),
+    pd.DataFrame({"segment": pd.Categorical(["champions", "hibernating"]), "frequency": [3, 1]},
+                 index=pd.Index([13085, 13078], name="Customer ID")),
+    pd.Series(["a", None, "b"]),
+])
+def test_csv_matches_to_csv(tmp_path, data):
+    data.to_csv(tmp_path / "expected.csv")
+    export(data, str(tmp_path / "result.csv"), chunk_rows=2)
+    assert read_bytes(tmp_path / "result.csv") == read_bytes(tmp_path / "expected.csv")
+
+
+def test_values_that_need_quotes_round_trip(tmp_path):
+    dataframe = pd.DataFrame({"Description": ['12 PENCILS, "TALL"', "line\nbreak"], "Quantity": [1, 2]})
+    export_many({str(tmp_path / "result.csv"): dataframe, str(tmp_path / "result.csv.gz"): dataframe})
+    for name in ("result.csv", "result.csv.gz"):
+        pd.testing.assert_frame_equal(pd.read_csv(tmp_path / name, index_col=0), dataframe)
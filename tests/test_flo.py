@@ -0,0 +1,92 @@
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import helpers.flo as flo_module
+from benchmarks.synthetic import flo
+from helpers.flo import parse_flo, read_flo
+from helpers.ingest import _read_manifest, _write_manifest, cache_dir_for, file_fingerprint
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = str(tmp_path / "flo_data_20k.csv")
+    flo(200, seed=1).to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    calls = []
+    build = flo_module.build_flo_cache
+
+    def counting_build(path, cache_dir=None):
+        calls.append(path)
+        return build(path, cache_dir)
+
+    monkeypatch.setattr(flo_module, "build_flo_cache", counting_build)
+    return calls
+
+
+def bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def edit_first_online_order_count(path):
+    """Rewrites the first customer's order_num_total_ever_online in place, keeping the file size."""
+    with open(path) as f:
+        header, first, rest = f.read().split("\n", 2)
+    fields = first.split(",")
+    column = header.split(",").index("order_num_total_ever_online")
+    new = "9.0" if fields[column] != "9.0" else "8.0"
+    assert len(new) == len(fields[column])
+    fields[column] = new
+    with open(path, "w") as f:
+        f.write("\n".join([header, ",".join(fields), rest]))
+    return int(float(new))
+
+
+def test_read_flo_matches_parse_flo(csv_path):
+    expected, categories = parse_flo(pd.read_csv(csv_path))
+    result = read_flo(csv_path)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    assert result.attrs["interested_in_categories"] == categories
+    assert result["first_order_date"].dtype.kind == "M"
+
+
+def test_unchanged_source_reuses_the_cache(csv_path, builds):
+    first = read_flo(csv_path)
+    pd.testing.assert_frame_equal(read_flo(csv_path), first)
+    bump_mtime(csv_path)  # touched, same content
+    pd.testing.assert_frame_equal(read_flo(csv_path), first)
+    assert builds == [csv_path]
+    manifest = _read_manifest(cache_dir_for(csv_path))
+    assert (manifest["size"], manifest["mtime_ns"]) == (os.path.getsize(csv_path), os.stat(csv_path).st_mtime_ns)
+
+
+def test_changed_source_rebuilds_the_cache(csv_path, builds):
+    before = read_flo(csv_path)
+    size = os.path.getsize(csv_path)
+    value = edit_first_online_order_count(csv_path)
+    bump_mtime(csv_path)
+    assert os.path.getsize(csv_path) == size  # only the sha1 tells the content changed
+
+    after = read_flo(csv_path)
+    assert len(builds) == 2
+    assert after["order_num_total_ever_online"].iloc[0] == value != before["order_num_total_ever_online"].iloc[0]
+    assert _read_manifest(cache_dir_for(csv_path))["fingerprint"] == file_fingerprint(csv_path)
+
+
+def test_a_manifest_of_another_loader_is_rebuilt(csv_path, builds):
+    # e.g. helpers.ingest.build_excel_cache wrote the manifest of a file with the same name
+    directory = cache_dir_for(csv_path)
+    os.makedirs(directory)
+    stat = os.stat(csv_path)
+    _write_manifest(directory, {"fingerprint": file_fingerprint(csv_path), "size": stat.st_size,
+                                "mtime_ns": stat.st_mtime_ns, "sheets": {}})
+    assert len(read_flo(csv_path)) == 200
+    assert builds == [csv_path]
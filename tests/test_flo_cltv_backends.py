@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.run_benchmarks import REPO_ROOT, load_script_functions
+from benchmarks.synthetic import flo
+from helpers.flo import parse_flo
+
+pytest.importorskip("lifetimes")
+create_cltv_df = load_script_functions(os.path.join(REPO_ROOT, "FLO_CRM_Analytics",
+                                                    "FLO_CLTV_Prediction.py"))["create_cltv_df"]
+
+
+@pytest.fixture(scope="module")
+def raw():
+    return flo(3_000, seed=0)
+
+
+@pytest.fixture(scope="module")
+def expected(raw):
+    return create_cltv_df(parse_flo(raw)[0])
+
+
+def test_weeks_are_whole_days_over_seven(raw, expected):
+    data = parse_flo(raw)[0].set_index("master_id").loc[expected["customer_id"]]
+    days = (data["last_order_date"] - data["first_order_date"]).to_numpy() // np.timedelta64(1, "D")
+    np.testing.assert_array_equal(expected["recency_cltv_weekly"].to_numpy(), days / 7)
+    assert expected["cltv"].notna().all()
+
+
+@pytest.mark.parametrize("backend", ["polars", "duckdb"])
+def test_backends_match_pandas(raw, expected, backend):
+    pytest.importorskip(backend)
+    result = create_cltv_df(parse_flo(raw)[0], backend=backend)
+    pd.testing.assert_frame_equal(result.set_index("customer_id").sort_index(),
+                                  expected.set_index("customer_id").sort_index(),
+                                  check_exact=False, rtol=1e-6)
+
+
+def test_bootstrap_keeps_the_dataframe_return_type(raw, expected):
+    result = create_cltv_df(parse_flo(raw)[0], bootstrap=4, n_jobs=1)
+    assert isinstance(result, pd.DataFrame)
+    pd.testing.assert_frame_equal(result[expected.columns], expected)
+    assert {"clv_p5", "clv_p50", "clv_p95"} <= set(result.columns)
+    assert sorted(result.attrs["segment_intervals"].index) == ["A", "B", "C", "D"]
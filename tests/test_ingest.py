@@ -0,0 +1,100 @@
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("openpyxl")
+
+import helpers.ingest as ingest
+from helpers.ingest import cache_dir_for, fresh_manifest, read_excel_cached
+
+
+def sheets(quantity=6):
+    return {"Year 2009-2010": pd.DataFrame({"Invoice": [489434, "C489449"], "StockCode": ["85048", "22087"],
+                                            "Quantity": [quantity, -12], "Price": [6.95, 2.55],
+                                            "Customer ID": [13085.0, None]}),
+            "Year 2010-2011": pd.DataFrame({"Invoice": [536365], "StockCode": ["85123A"], "Quantity": [6],
+                                            "Price": [2.55], "Customer ID": [17850.0]})}
+
+
+def write_workbook(path, quantity=6):
+    with pd.ExcelWriter(path) as writer:
+        for name, dataframe in sheets(quantity).items():
+            dataframe.to_excel(writer, sheet_name=name, index=False)
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    calls = []
+    build = ingest.build_excel_cache
+
+    def counting_build(path, cache_dir=None):
+        calls.append(path)
+        return build(path, cache_dir)
+
+    monkeypatch.setattr(ingest, "build_excel_cache", counting_build)
+    return calls
+
+
+def bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_sheets_match_read_excel(tmp_path):
+    path = str(tmp_path / "online_retail_II.xlsx")
+    write_workbook(path)
+    expected = pd.read_excel(path, sheet_name="Year 2010-2011")
+    pd.testing.assert_frame_equal(read_excel_cached(path, sheet_name="Year 2010-2011"), expected, check_dtype=False)
+    # mixed int / str invoices are stored as str
+    assert read_excel_cached(path)["Invoice"].tolist() == ["489434", "C489449"]
+    with pytest.raises(ValueError, match="Worksheet named 'Year 2011' not found"):
+        read_excel_cached(path, sheet_name="Year 2011")
+
+
+def test_unchanged_source_reuses_the_cache(tmp_path, builds):
+    path = str(tmp_path / "online_retail_II.xlsx")
+    write_workbook(path)
+    first = read_excel_cached(path, sheet_name=1)
+    second = read_excel_cached(path, sheet_name=1)
+    assert builds == [path]
+    pd.testing.assert_frame_equal(second, first)
+
+    # touched but not changed: the sha1 still matches, the new mtime is recorded
+    bump_mtime(path)
+    read_excel_cached(path, sheet_name=1)
+    assert builds == [path]
+    assert ingest._read_manifest(cache_dir_for(path))["mtime_ns"] == os.stat(path).st_mtime_ns
+
+
+def test_changed_source_rebuilds_the_cache(tmp_path, builds):
+    path = str(tmp_path / "online_retail_II.xlsx")
+    write_workbook(path)
+    assert read_excel_cached(path)["Quantity"].tolist() == [6, -12]
+    write_workbook(path, quantity=7)
+    bump_mtime(path)
+    assert read_excel_cached(path)["Quantity"].tolist() == [7, -12]
+    assert len(builds) == 2
+    assert ingest._read_manifest(cache_dir_for(path))["fingerprint"] == ingest.file_fingerprint(path)
+
+
+def test_same_size_edit_is_caught_by_the_sha1(tmp_path):
+    path = str(tmp_path / "data.txt")
+    with open(path, "w") as f:
+        f.write("quantity=6\n")
+    built = []
+
+    def build(path, cache_dir):
+        stat = os.stat(path)
+        manifest = {"fingerprint": ingest.file_fingerprint(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        os.makedirs(cache_dir_for(path, cache_dir), exist_ok=True)
+        ingest._write_manifest(cache_dir_for(path, cache_dir), manifest)
+        built.append(manifest["fingerprint"])
+        return manifest
+
+    fresh_manifest(path, None, build)
+    with open(path, "w") as f:
+        f.write("quantity=7\n")
+    bump_mtime(path)
+    manifest = fresh_manifest(path, None, build)
+    assert len(built) == 2 and manifest["fingerprint"] == built[-1] != built[0]
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers.bgnbd import BGNBDFitter
+from helpers.model_registry import ModelRegistry, data_fingerprint, fit_with_registry, initial_params_from
+
+
+class RecordingFit:
+    """fit_function that records the kwargs of every fit."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, model, *columns, **kwargs):
+        self.calls.append(kwargs)
+        return model.fit(*columns, **kwargs)
+
+
+def bgnbd_columns(cltv_table, days_later=0):
+    # a day later every customer is one day older; recency and frequency do not move without new orders
+    return cltv_table["frequency"], cltv_table["recency"], cltv_table["T"] + days_later / 7
+
+
+def fit(registry, columns, refit=True, penalizer_coef=0.001):
+    fit_function = RecordingFit()
+    model = fit_with_registry(registry, "bgnbd", BGNBDFitter(penalizer_coef=penalizer_coef), fit_function, *columns,
+                              analysis_date="2021-06-01", refit=refit)
+    return model, fit_function.calls
+
+
+def test_without_a_registry_it_is_a_plain_fit(cltv_table):
+    model, calls = fit(None, bgnbd_columns(cltv_table))
+    assert calls == [{}]
+    assert model.params_["r"] > 0
+
+
+def test_first_fit_is_saved_with_its_fingerprint(cltv_table, tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    columns = bgnbd_columns(cltv_table)
+    model, calls = fit(registry, columns)
+    assert calls == [{}]  # nothing stored yet: a cold start
+    record = registry.record("bgnbd")
+    assert record["model"] == "BGNBDFitter" and record["analysis_date"] == "2021-06-01"
+    assert record["fingerprint"] == data_fingerprint(*columns)
+    assert record["params"] == pytest.approx(model.params_.to_dict())
+
+
+def test_unchanged_data_skips_the_fit(cltv_table, tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    first, _ = fit(registry, bgnbd_columns(cltv_table))
+    second, calls = fit(registry, bgnbd_columns(cltv_table))
+    assert calls == []
+    pd.testing.assert_series_equal(second.params_, first.params_)
+    np.testing.assert_allclose(second.predict(4, *bgnbd_columns(cltv_table)),
+                               first.predict(4, *bgnbd_columns(cltv_table)))
+
+
+def test_changed_data_refits_from_the_stored_parameters(cltv_table, tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    stored, _ = fit(registry, bgnbd_columns(cltv_table))
+    new_columns = bgnbd_columns(cltv_table, days_later=1)
+    assert data_fingerprint(*new_columns) != registry.record("bgnbd")["fingerprint"]
+
+    warm, calls = fit(registry, new_columns)
+    (kwargs,) = calls
+    np.testing.assert_allclose(kwargs["initial_params"], initial_params_from(stored.params_, np.max(new_columns[2])))
+    np.testing.assert_array_equal(kwargs["hess_inv0"], stored.hess_inv_)
+    assert registry.record("bgnbd")["fingerprint"] == data_fingerprint(*new_columns)
+
+    cold = BGNBDFitter(penalizer_coef=0.001).fit(*new_columns)
+    pd.testing.assert_series_equal(warm.params_, cold.params_, check_exact=False, rtol=1e-4)
+    assert warm.n_iterations_ < cold.n_iterations_
+
+
+def test_a_changed_penalizer_forces_a_refit(cltv_table, tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    fit(registry, bgnbd_columns(cltv_table))
+    model, calls = fit(registry, bgnbd_columns(cltv_table), penalizer_coef=0.01)
+    assert len(calls) == 1
+    assert registry.record("bgnbd")["penalizer_coef"] == 0.01
+
+
+def test_refit_false_loads_without_fitting(cltv_table, tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    with pytest.raises(ValueError, match="No model named 'bgnbd'"):
+        fit(registry, bgnbd_columns(cltv_table), refit=False)
+
+    stored, _ = fit(registry, bgnbd_columns(cltv_table))
+    saved = registry.record("bgnbd")
+    # scoring-only: even on changed data the stored parameters are used and the record is not touched
+    loaded, calls = fit(registry, bgnbd_columns(cltv_table, days_later=3), refit=False)
+    assert calls == []
+    pd.testing.assert_series_equal(loaded.params_, stored.params_, check_names=False)
+    assert registry.record("bgnbd") == saved
+
+
+def test_gamma_gamma_warm_start(cltv_table, tmp_path):
+    lifetimes = pytest.importorskip("lifetimes")
+    registry = ModelRegistry(str(tmp_path))
+    fit_function = RecordingFit()
+    columns = cltv_table["frequency"], cltv_table["monetary"]
+    stored = fit_with_registry(registry, "gamma_gamma", lifetimes.GammaGammaFitter(penalizer_coef=0.01),
+                               fit_function, *columns)
+    changed = cltv_table["frequency"], cltv_table["monetary"] * 1.01
+    fit_with_registry(registry, "gamma_gamma", lifetimes.GammaGammaFitter(penalizer_coef=0.01), fit_function,
+                      *changed)
+    assert len(fit_function.calls) == 2
+    np.testing.assert_allclose(fit_function.calls[1]["initial_params"], np.log(stored.params_.to_numpy()))
+    assert "hess_inv0" not in fit_function.calls[1]
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+lifetimes = pytest.importorskip("lifetimes")
+
+from helpers.bgnbd import BGNBDFitter
+from helpers.partitioned import fit_partitioned
+
+PENALIZERS = (0.001, 0.0)  # without a Gamma-Gamma penalizer a partition of identical spend cannot converge
+
+
+@pytest.fixture(scope="module")
+def partitioned(cltv_table):
+    table = cltv_table.copy()
+    channel = np.full(len(table), "web", dtype=object)
+    channel[:150] = "gift_card"  # degenerate: everyone spends the same
+    channel[150:170] = "kiosk"  # below min_size
+    table.iloc[:150, table.columns.get_loc("monetary")] = 50.0
+    table["channel"] = channel
+    scores, models = fit_partitioned(table, by="channel", min_size=100, n_jobs=2, penalizers=PENALIZERS)
+    return table, scores, models
+
+
+def models_from(row):
+    bgf, ggf = BGNBDFitter(), lifetimes.GammaGammaFitter()
+    bgf.params_ = row[["r", "alpha", "a", "b"]].astype("float64")
+    ggf.params_ = row[["p", "q", "v"]].astype("float64")
+    return bgf, ggf
+
+
+def test_the_degenerate_partition_does_not_converge(partitioned):
+    table, _, _ = partitioned
+    gift_card = table[table["channel"] == "gift_card"]
+    with pytest.raises(ValueError):
+        lifetimes.GammaGammaFitter(penalizer_coef=PENALIZERS[1]).fit(gift_card["frequency"], gift_card["monetary"])
+
+
+def test_small_and_failed_partitions_fall_back_to_the_global_model(partitioned):
+    table, scores, models = partitioned
+    assert models["model"].to_dict() == {"web": "partition", "gift_card": "global", "kiosk": "global",
+                                         "__global__": "global"}
+    assert models["n_customers"].to_dict() == {"web": 1830, "gift_card": 150, "kiosk": 20, "__global__": 2000}
+    parameters = ["r", "alpha", "a", "b", "p", "q", "v"]
+    for key in ("gift_card", "kiosk"):
+        pd.testing.assert_series_equal(models.loc[key, parameters], models.loc["__global__", parameters],
+                                       check_names=False)
+
+    assert scores.index.equals(table.index) and scores.notna().all().all()
+    assert (scores["partition"] == table["channel"]).all()
+    assert (scores["model"] == np.where(table["channel"] == "web", "partition", "global")).all()
+
+
+@pytest.mark.parametrize("key", ["web", "__global__"])
+def test_customers_are_scored_with_the_model_of_their_row(partitioned, key):
+    table, scores, models = partitioned
+    rows = (table["channel"] == "web") if key == "web" else (table["channel"] != "web")
+    customers = table[rows]
+    bgf, ggf = models_from(models.loc[key])
+    expected = ggf.customer_lifetime_value(bgf, customers["frequency"], customers["recency"], customers["T"],
+                                           customers["monetary"], time=6, freq="W", discount_rate=0.01)
+    np.testing.assert_allclose(scores.loc[rows, 6], expected, rtol=1e-6)
+
+
+def test_partition_parameters_are_a_fit_on_the_partition_alone(partitioned):
+    table, _, models = partitioned
+    web = table[table["channel"] == "web"]
+    bgf = BGNBDFitter(penalizer_coef=PENALIZERS[0]).fit(web["frequency"], web["recency"], web["T"])
+    np.testing.assert_allclose(models.loc["web", ["r", "alpha", "a", "b"]].astype("float64"),
+                               bgf.params_[["r", "alpha", "a", "b"]], rtol=1e-4)
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+
+import pytest
+
+from benchmarks.run_benchmarks import REPO_ROOT, load_script_functions
+from benchmarks.synthetic import online_retail
+from helpers.profiling import NULL_PROFILER, NullProfiler, StageProfiler
+
+
+def test_null_profiler_is_a_no_op():
+    profiler = NullProfiler()
+    assert profiler.for_pipeline("create_rfm") is profiler
+    stage = profiler.stage("data_prep", [1, 2, 3])
+    # one shared stage object: nothing is allocated or recorded per stage
+    assert stage is NULL_PROFILER.stage("segment") is profiler.stage("aggregate")
+    with stage as entered:
+        assert entered is stage
+        assert entered.output([1]) is None and entered.annotate(dropped_rows=1) is None
+    assert not hasattr(profiler, "records") and vars(stage) == {}
+
+
+def test_null_profiler_does_not_swallow_errors():
+    with pytest.raises(KeyError):
+        with NULL_PROFILER.stage("aggregate"):
+            raise KeyError("Customer ID")
+
+
+def test_stage_record_fields():
+    seen = []
+    profiler = StageProfiler(pipeline="create_cltv_c", callback=seen.append, log=False)
+    with profiler.stage("data_prep", list(range(10))) as stage:
+        stage.annotate(dropped_rows={"not_null": 2})
+        stage.output(list(range(8)))
+
+    (record,) = profiler.records
+    assert seen == [record]
+    assert {key: record[key] for key in ("pipeline", "stage", "rows_in", "rows_out", "dropped_rows")} == \
+        {"pipeline": "create_cltv_c", "stage": "data_prep", "rows_in": 10, "rows_out": 8,
+         "dropped_rows": {"not_null": 2}}
+    assert record["seconds"] >= 0
+    assert {"rss_before_mb", "rss_after_mb", "peak_rss_mb"} <= set(record)
+    if record["rss_before_mb"] is not None:
+        assert record["memory_delta_mb"] == pytest.approx(record["rss_after_mb"] - record["rss_before_mb"])
+    assert "error" not in record
+
+
+def test_failed_stage_is_recorded_and_raised(caplog):
+    profiler = StageProfiler().for_pipeline("create_rfm")
+    with caplog.at_level(logging.INFO, logger="crm.profiling"):
+        with pytest.raises(ValueError):
+            with profiler.stage("segment", None):
+                raise ValueError("Bin edges must be unique")
+    (record,) = profiler.records
+    assert record["error"] == "ValueError: Bin edges must be unique"
+    assert record["rows_in"] is None and record["rows_out"] is None
+    assert json.loads(caplog.records[-1].getMessage()) == record
+
+
+def test_summary_and_json(tmp_path):
+    profiler = StageProfiler(pipeline="create_rfm", log=False)
+    for name in ("data_prep", "aggregate"):
+        with profiler.stage(name, [0]) as stage:
+            stage.output([0])
+    summary = profiler.summary()
+    assert sorted(summary["stage"]) == ["aggregate", "data_prep"]
+    assert summary["seconds"].is_monotonic_decreasing  # slowest first
+    profiler.to_json(str(tmp_path / "profile.json"))
+    with open(tmp_path / "profile.json") as file:
+        assert json.load(file) == profiler.records
+
+
+def test_every_step_of_create_cltv_c_is_in_a_stage():
+    create_cltv_c = load_script_functions(os.path.join(REPO_ROOT, "cltv", "cltv.py"))["create_cltv_c"]
+    profiler = StageProfiler(log=False)
+    cltv_c = create_cltv_c(online_retail(20_000, seed=1, n_customers=300), profiler=profiler)
+    assert [record["stage"] for record in profiler.records] == ["data_prep", "aggregate", "cltv", "segment"]
+    cltv_stage = profiler.records[2]
+    assert cltv_stage["pipeline"] == "create_cltv_c"
+    assert cltv_stage["rows_in"] == cltv_stage["rows_out"] == len(cltv_c)
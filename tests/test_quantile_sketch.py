@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers.quantile_sketch import (QuantileSketch, apply_breakpoints, frequency_key, merge_sketches,
+                                     rfm_breakpoints, sketch_rfm, SCORE_LABELS)
+
+
+def merged(parts, k):
+    sketch = QuantileSketch(k)
+    for part in parts:
+        sketch.merge(QuantileSketch(k).update(part))
+    return sketch
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_rank_error_bounds_the_distance_to_the_exact_quantiles(seed):
+    values = np.random.default_rng(seed).lognormal(0.0, 1.5, 200_000)
+    sketch = merged(np.array_split(values, 8), k=128)
+    assert sketch.n == len(values) and sketch.rank_error > 0
+    assert sketch.error_bound() < 0.05
+
+    q = np.linspace(0, 1, 101)
+    estimates = sketch.quantile(q)
+    ordered = np.sort(values)
+    # ranks the estimate can take in the data; the exact quantile is at rank q * (n - 1)
+    low, high = np.searchsorted(ordered, estimates, "left"), np.searchsorted(ordered, estimates, "right")
+    target = q * (len(values) - 1)
+    assert (low - target <= sketch.rank_error).all()
+    assert (target - high <= sketch.rank_error).all()
+
+
+def test_exact_until_the_first_compaction():
+    values = np.random.default_rng(3).normal(size=1_000)
+    sketch = merged(np.array_split(values, 4), k=1_024)
+    assert sketch.rank_error == 0
+    np.testing.assert_allclose(sketch.quantile(np.linspace(0, 1, 6)), np.quantile(values, np.linspace(0, 1, 6)))
+
+
+def rfm_table(ids, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"recency": rng.integers(1, 400, len(ids)),
+                         "frequency": rng.integers(1, 4, len(ids)),  # many ties
+                         "monetary": rng.gamma(2.0, 100.0, len(ids))}, index=pd.Index(ids, name="customer_id"))
+
+
+def test_frequency_ties_are_broken_by_the_sorted_str_ids():
+    ids = ["c%d" % i for i in np.random.default_rng(1).permutation(3_000)]
+    rfm = rfm_table(ids)
+    parts = [rfm.iloc[i::3] for i in range(3)]
+    breakpoints = rfm_breakpoints(merge_sketches([sketch_rfm(part, k=4_096) for part in parts]))
+    scores = apply_breakpoints(frequency_key(rfm["frequency"], rfm.index), breakpoints["frequency"]["edges"],
+                               SCORE_LABELS)
+
+    ordered = rfm.sort_index()  # ties are ranked in the sorted order of the IDs
+    expected = pd.qcut(ordered["frequency"].rank(method="first"), 5, labels=SCORE_LABELS)
+    pd.testing.assert_series_equal(pd.Series(scores, index=rfm.index, name="frequency").loc[ordered.index],
+                                   expected.astype(pd.CategoricalDtype(SCORE_LABELS, ordered=True)))
+
+
+@pytest.mark.parametrize("ids", [np.arange(10_000, 16_000, 2).astype("float64"),
+                                 ["%08x-%04x" % (i * 7919, i) for i in range(3_000)]])
+def test_the_key_does_not_depend_on_the_sharding(ids):
+    rfm = rfm_table(ids, seed=2)
+    by_stride = merge_sketches([sketch_rfm(rfm.iloc[i::4], k=128) for i in range(4)])
+    shuffled = rfm.sample(frac=1.0, random_state=0)
+    by_block = merge_sketches([sketch_rfm(shuffled.iloc[rows], k=128) for rows in np.array_split(range(len(rfm)), 4)])
+    keys = frequency_key(rfm["frequency"], rfm.index)
+    for sketches in (by_stride, by_block):
+        edges = rfm_breakpoints(sketches)["frequency"]["edges"]
+        # keys from different shards compare by (frequency, str ID): a customer's key is the same everywhere
+        assert set(np.asarray(edges["customer"])) <= set(keys["customer"])
+        scores = apply_breakpoints(keys, edges, SCORE_LABELS)
+        counts = pd.Series(scores).value_counts(normalize=True)
+        bound = sketches["frequency"].error_bound()
+        assert (counts - 0.2).abs().max() <= 2 * bound + 1e-9
@@ -0,0 +1,73 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import online_retail
+from helpers.cleaning import clean, not_cancelled, not_null
+from helpers.rfm import rfm_metrics
+
+TODAY = dt.datetime(2011, 12, 11)
+
+
+def lambda_rfm(dataframe, today_date=TODAY):
+    # the groupby of rfm/rfm.py that rfm_metrics replaces
+    rfm = dataframe.groupby('Customer ID').agg({'InvoiceDate': lambda InvoiceDate: (today_date - InvoiceDate.max()).days,
+                                                'Invoice': lambda Invoice: Invoice.nunique(),
+                                                'TotalPrice': lambda TotalPrice: TotalPrice.sum()})
+    rfm.columns = ['recency', 'frequency', 'monetary']
+    return rfm
+
+
+def transactions():
+    # customer 1: two invoices, one of them cancelled; customer 2: a single invoice of two lines;
+    # the last rows have no Customer ID
+    return pd.DataFrame({
+        "Invoice": ["100", "100", "C101", "102", "102", "103", "104"],
+        "InvoiceDate": pd.to_datetime(["2011-12-01 10:00", "2011-12-01 10:00", "2011-12-05 09:00",
+                                       "2011-11-20 12:00", "2011-11-20 12:00", "2011-12-08 08:00",
+                                       "2011-12-09 08:00"]),
+        "Quantity": [2, 1, -1, 5, 3, 1, 4],
+        "Price": [1.5, 2.0, 1.5, 0.5, 1.25, 3.0, 1.0],
+        "Customer ID": [1.0, 1.0, 1.0, 2.0, 2.0, np.nan, np.nan],
+    }).assign(TotalPrice=lambda frame: frame["Quantity"] * frame["Price"])
+
+
+def test_matches_lambda_groupby_with_nan_ids_and_cancellations():
+    dataframe = transactions()
+    expected = lambda_rfm(dataframe)
+    result = rfm_metrics(dataframe, TODAY)
+    pd.testing.assert_frame_equal(result, expected, check_names=False, check_dtype=False)
+    assert result.loc[1.0, "frequency"] == 2  # the cancelled invoice counts until it is cleaned
+    assert result.loc[2.0, "frequency"] == 1
+    assert list(result.index) == [1.0, 2.0]  # rows without a Customer ID are dropped
+
+
+def test_matches_lambda_groupby_after_cleaning():
+    dataframe, _ = clean(transactions(), [not_null(), not_cancelled()])
+    expected = lambda_rfm(dataframe)
+    result = rfm_metrics(dataframe, TODAY)
+    pd.testing.assert_frame_equal(result, expected, check_names=False, check_dtype=False)
+    assert result.loc[1.0].tolist() == [9, 1, 5.0]
+
+
+def test_single_invoice_customer():
+    dataframe = transactions().iloc[3:5]
+    result = rfm_metrics(dataframe, TODAY)
+    assert result.loc[2.0].tolist() == [20, 1, 2.5 + 3.75]
+
+
+def test_empty_frame():
+    result = rfm_metrics(transactions().iloc[:0], TODAY)
+    assert result.empty
+    assert list(result.columns) == ["recency", "frequency", "monetary"]
+    assert len(lambda_rfm(transactions().iloc[:0])) == 0
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_matches_lambda_groupby_on_synthetic_data(seed):
+    dataframe = online_retail(20_000, seed=seed, n_customers=300)
+    dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
+    pd.testing.assert_frame_equal(rfm_metrics(dataframe, TODAY), lambda_rfm(dataframe),
+                                  check_names=False, check_dtype=False, check_exact=False, rtol=1e-9)
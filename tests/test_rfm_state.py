@@ -0,0 +1,73 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import online_retail
+from helpers.cleaning import clean, not_cancelled, not_null
+from helpers.rfm import score_rfm
+from helpers.rfm_state import (build_rfm_state, load_rfm_state, rfm_from_state, save_rfm_state, score_state,
+                               update_rfm)
+
+
+def prepared(n_rows, seed):
+    dataframe, _ = clean(online_retail(n_rows, seed=seed, n_customers=500), [not_null(), not_cancelled()])
+    dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
+    return dataframe
+
+
+def test_update_matches_full_rebuild():
+    data = prepared(40_000, seed=4)
+    cut = pd.Timestamp("2011-06-01")
+    old, new = data[data["InvoiceDate"] < cut], data[data["InvoiceDate"] >= cut]
+    state = build_rfm_state(old, cut)
+    n_before = len(state)
+
+    assert update_rfm(state, new, today_date=dt.datetime(2011, 12, 11)) is None
+    expected = build_rfm_state(data, dt.datetime(2011, 12, 11))
+
+    assert len(state) > n_before  # new customers were appended to the same state
+    pd.testing.assert_frame_equal(state.to_frame().sort_index(), expected.to_frame(), check_exact=False,
+                                  rtol=1e-9, check_index_type=False, check_dtype=False)
+    pd.testing.assert_frame_equal(rfm_from_state(state).sort_index(), rfm_from_state(expected),
+                                  check_exact=False, rtol=1e-9, check_dtype=False)
+    assert state.today_date == pd.Timestamp(2011, 12, 11)
+    scored = score_state(state).sort_index()
+    pd.testing.assert_frame_equal(scored, score_rfm(rfm_from_state(expected).query("monetary > 0")),
+                                  check_exact=False, rtol=1e-9, check_dtype=False)
+
+
+def test_updates_in_small_batches_grow_the_state():
+    data = prepared(40_000, seed=6)
+    # batches of whole invoice days, so that no invoice is counted in two batches
+    days = np.array_split(np.sort(data["InvoiceDate"].dt.normalize().unique()), 25)
+    batches = [data[data["InvoiceDate"].dt.normalize().isin(batch)] for batch in days]
+    state = build_rfm_state(batches[0], dt.datetime(2011, 12, 11))
+    for batch in batches[1:]:
+        # later batches touch customers appended by earlier updates as well
+        update_rfm(state, batch)
+    expected = build_rfm_state(data, dt.datetime(2011, 12, 11))
+    pd.testing.assert_frame_equal(state.to_frame().sort_index(), expected.to_frame(), check_exact=False,
+                                  rtol=1e-9, check_index_type=False, check_dtype=False)
+
+
+def test_update_with_known_customers_only_writes_their_rows():
+    data = prepared(20_000, seed=5)
+    state = build_rfm_state(data, dt.datetime(2011, 12, 11))
+    before = state.to_frame()
+    customer = data["Customer ID"].iloc[0]
+    batch = data[data["Customer ID"] == customer]
+    update_rfm(state, batch)
+    after = state.to_frame()
+    assert len(after) == len(before)
+    assert after.loc[customer, "frequency"] == 2 * batch["Invoice"].nunique()
+    pd.testing.assert_frame_equal(after.drop(customer), before.drop(customer))
+
+
+def test_save_and_load_round_trip(tmp_path):
+    data = prepared(20_000, seed=5)
+    state = build_rfm_state(data, dt.datetime(2011, 12, 11))
+    save_rfm_state(state, str(tmp_path / "rfm_state.parquet"))
+    loaded = load_rfm_state(str(tmp_path / "rfm_state.parquet"))
+    assert loaded.today_date == state.today_date
+    pd.testing.assert_frame_equal(loaded.to_frame(), state.to_frame())
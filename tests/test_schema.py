@@ -0,0 +1,52 @@
+import datetime as dt
+
+import pandas as pd
+
+from benchmarks.synthetic import online_retail
+from helpers.cleaning import clean, not_cancelled, not_null
+from helpers.rfm import rfm_metrics
+from helpers.schema import compact_transactions, memory_usage_mb
+
+TODAY = dt.datetime(2011, 12, 11)
+
+
+def test_invoice_is_an_int32_number_with_a_cancel_flag():
+    dataframe = pd.DataFrame({"Invoice": ["489434", "C489449", "A506401"], "Customer ID": [13085.0, None, 1.0]})
+    compact = compact_transactions(dataframe)
+    assert compact["Invoice"].dtype == "int32"
+    assert compact["Invoice"].tolist() == [489434, 489449, 506401]
+    assert compact["is_cancelled"].tolist() == [False, True, False]
+    assert compact["Customer ID"].dtype == "Int32"
+
+
+def test_the_invoice_prefix_is_kept_as_a_category():
+    dataframe = pd.DataFrame({"Invoice": ["489434", "C489449", "A506401", "A506402"]})
+    compact = compact_transactions(dataframe)
+    assert isinstance(compact["InvoicePrefix"].dtype, pd.CategoricalDtype)
+    assert compact["InvoicePrefix"].tolist() == ["", "C", "A", "A"]
+    # the adjustments are not sales: they stay apart from the normal invoices
+    assert compact.loc[compact["InvoicePrefix"] == "A", "Invoice"].tolist() == [506401, 506402]
+    restored = compact["InvoicePrefix"].astype(str) + compact["Invoice"].astype(str)
+    assert restored.tolist() == dataframe["Invoice"].tolist()
+
+
+def test_compacting_twice_keeps_the_prefix_and_the_cancel_flag():
+    compact = compact_transactions(pd.DataFrame({"Invoice": ["489434", "C489449", "A506401"]}))
+    pd.testing.assert_frame_equal(compact_transactions(compact), compact)
+
+
+def test_unparsable_invoices_stay_categorical():
+    compact = compact_transactions(pd.DataFrame({"Invoice": ["489434", "X-1"]}))
+    assert isinstance(compact["Invoice"].dtype, pd.CategoricalDtype)
+    assert compact["is_cancelled"].tolist() == [False, False]
+
+
+def test_compact_frame_gives_the_same_rfm():
+    dataframe = online_retail(20_000, seed=0, n_customers=300)
+    dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
+    compact = compact_transactions(dataframe)
+    rules = [not_null(["Customer ID"]), not_cancelled()]
+    expected = rfm_metrics(clean(dataframe, rules)[0], TODAY)
+    result = rfm_metrics(clean(compact, rules)[0], TODAY)
+    pd.testing.assert_frame_equal(result, expected, check_index_type=False, check_dtype=False)
+    assert memory_usage_mb(compact) < memory_usage_mb(dataframe) / 2
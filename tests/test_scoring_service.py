@@ -0,0 +1,125 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+lifetimes = pytest.importorskip("lifetimes")
+
+import helpers.scoring_service as scoring_service
+from helpers.bgnbd import BGNBDFitter
+from helpers.scoring_service import CLTVScoringService, serve
+
+
+@pytest.fixture(scope="module")
+def models(cltv_table):
+    bgf = BGNBDFitter(penalizer_coef=0.001).fit(cltv_table["frequency"], cltv_table["recency"], cltv_table["T"])
+    ggf = lifetimes.GammaGammaFitter(penalizer_coef=0.01).fit(cltv_table["frequency"], cltv_table["monetary"])
+    clv = ggf.customer_lifetime_value(bgf, cltv_table["frequency"], cltv_table["recency"], cltv_table["T"],
+                                      cltv_table["monetary"], time=6, freq="W", discount_rate=0.01)
+    return bgf, ggf, clv
+
+
+def rows(cltv_table, n=50):
+    return list(cltv_table[["frequency", "recency", "T", "monetary"]].head(n).itertuples(index=False, name=None))
+
+
+def test_scores_match_lifetimes(cltv_table, models):
+    service = CLTVScoringService.from_models(*models)
+    results = service.score_batch(rows(cltv_table, len(cltv_table)))
+    np.testing.assert_allclose([result["clv"] for result in results], models[2], rtol=1e-6)
+    assert {result["segment"] for result in results} == {"A", "B", "C", "D"}
+
+
+def test_lru_cache_hits_and_evicts_the_least_recently_used(cltv_table, models):
+    service = CLTVScoringService.from_models(*models, cache_size=2)
+    a, b, c = rows(cltv_table, 3)
+    first = service.score(*a)
+    service.score(*b)
+    assert service.score(*a) is first  # hit; a is now the most recent entry
+    service.score(*c)  # evicts b, not a
+    service.score(*b)  # miss; evicts a
+    service.score(*c)  # hit
+    assert (service.hits, service.misses) == (2, 4)
+    assert service.latency()["cache_hits"] == 2 and service.latency()["cache_misses"] == 4
+
+
+def test_cached_rows_give_the_same_results(cltv_table, models):
+    service = CLTVScoringService.from_models(*models)
+    batch = rows(cltv_table, 10)
+    assert service.score_batch(batch) == service.score_batch(batch[::-1])[::-1]
+    assert (service.hits, service.misses) == (10, 10)
+    # dicts and tuples share the cache
+    assert service.score_batch([dict(zip(["frequency", "recency", "T", "monetary"], batch[0]))])[0] == \
+        service.score(*batch[0])
+
+
+class FakeClock:
+
+    def __init__(self, latencies):
+        self.times = iter(np.cumsum([[0.0, latency] for latency in latencies]))
+
+    def perf_counter(self):
+        return next(self.times)
+
+
+def test_latency_percentiles_of_the_recorded_calls(cltv_table, models, monkeypatch):
+    service = CLTVScoringService.from_models(*models, latency_window=50)
+    assert service.latency()["calls"] == 0 and np.isnan(service.latency()["p50_ms"])
+
+    latencies = np.arange(1, 101) / 1000  # 1 ms ... 100 ms
+    monkeypatch.setattr(scoring_service, "time", FakeClock(latencies))
+    row = rows(cltv_table, 1)[0]
+    for _ in latencies:
+        service.score(*row)
+    stats = service.latency()
+    # only the last latency_window calls are kept: 51 ms ... 100 ms
+    assert stats["calls"] == 50
+    assert stats["p50_ms"] == pytest.approx(np.percentile(np.arange(51, 101), 50))
+    assert stats["p99_ms"] == pytest.approx(np.percentile(np.arange(51, 101), 99))
+    assert (stats["cache_hits"], stats["cache_misses"]) == (99, 1)
+
+
+def test_save_and_load_give_identical_scores(cltv_table, models, tmp_path):
+    service = CLTVScoringService.from_models(*models)
+    service.save(str(tmp_path / "service.json"))
+    loaded = CLTVScoringService.load(str(tmp_path / "service.json"), cache_size=16)
+    batch = rows(cltv_table, 200)
+    assert loaded.score_batch(batch) == service.score_batch(batch)
+    assert loaded.cache_size == 16
+    np.testing.assert_array_equal(loaded.segment_edges, service.segment_edges)
+
+
+def request(url, body=None):
+    data = None if body is None else json.dumps(body).encode()
+    with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=10) as response:
+        return response.status, json.loads(response.read())
+
+
+def test_http_endpoint_on_an_ephemeral_port(cltv_table, models):
+    service = CLTVScoringService.from_models(*models)
+    started = threading.Event()
+    servers = []
+    thread = threading.Thread(target=serve, args=(service,), kwargs={"port": 0, "ready": lambda server: (
+        servers.append(server), started.set())}, daemon=True)
+    thread.start()
+    assert started.wait(10)
+    url = "http://127.0.0.1:%d" % servers[0].server_address[1]
+    try:
+        frequency, recency, T, monetary = rows(cltv_table, 1)[0]
+        status, result = request(url + "/score", {"frequency": frequency, "recency": recency, "T": T,
+                                                  "monetary": monetary})
+        assert status == 200 and result == service.score(frequency, recency, T, monetary)
+        status, results = request(url + "/score", [{"frequency": frequency, "recency": recency, "T": T,
+                                                    "monetary": monetary}])
+        assert results == [result]
+        with pytest.raises(urllib.error.HTTPError) as error:
+            request(url + "/score", {"frequency": frequency})
+        assert error.value.code == 400
+        status, stats = request(url + "/stats")
+        assert stats["calls"] == 3 and stats["cache_hits"] == 2
+    finally:
+        servers[0].shutdown()
+        thread.join(10)
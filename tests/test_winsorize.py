@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers.winsorize import Winsorizer
+
+
+def outlier_thresholds(dataframe, variable):
+    # the functions of the scripts that Winsorizer replaces
+    quartile1 = dataframe[variable].quantile(0.01)
+    quartile3 = dataframe[variable].quantile(0.99)
+    interquantile_range = quartile3 - quartile1
+    up_limit = quartile3 + 1.5 * interquantile_range
+    low_limit = quartile1 - 1.5 * interquantile_range
+    return low_limit, up_limit
+
+
+def replace_with_thresholds_rounded(dataframe, variable):
+    # FLO_CLTV_Prediction.py, Project/customer_lifetime_value_prediction.py
+    low_limit, up_limit = outlier_thresholds(dataframe, variable)
+    dataframe.loc[(dataframe[variable] < low_limit), variable] = round(low_limit, 0)
+    dataframe.loc[(dataframe[variable] > up_limit), variable] = round(up_limit, 0)
+
+
+def replace_with_thresholds_upper(dataframe, variable):
+    # cltv_prediction.py
+    low_limit, up_limit = outlier_thresholds(dataframe, variable)
+    dataframe.loc[(dataframe[variable] > up_limit), variable] = up_limit
+
+
+def frame(seed=0, n=5_000):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"Price": np.round(rng.lognormal(1.0, 1.2, n), 2),
+                         "Quantity": rng.zipf(1.8, n).astype("int64") * rng.choice([-1, 1], n, p=[0.02, 0.98]),
+                         "value": np.where(np.arange(n) % 97 == 0, np.nan, rng.normal(100.0, 40.0, n))})
+
+
+def between_limits(dataframe, columns):
+    """
+    Moves some of the values beyond a limit to between the limit and its rounded value (where
+    the rounded one is nearer the middle). They stay beyond the 1% / 99% quantiles, so the limits
+    do not change, and they must be left alone.
+    """
+    dataframe = dataframe.copy()
+    moved = 0
+    for col in columns:
+        low, up = outlier_thresholds(dataframe, col)
+        values = dataframe[col].astype("float64")
+        for limit, beyond, inward in ((up, values > up, round(up) < up), (low, values < low, round(low) > low)):
+            rows = dataframe.index[beyond.to_numpy()][::2]
+            if inward and len(rows):
+                dataframe[col] = values
+                dataframe.loc[rows, col] = (limit + round(limit)) / 2
+                values, moved = dataframe[col], moved + len(rows)
+    return dataframe, moved
+
+
+@pytest.mark.parametrize("seed", [0, 1, 4])
+def test_round_limits_match_replace_with_thresholds(seed):
+    columns = ["Price", "Quantity", "value"]
+    data, moved = between_limits(frame(seed), columns)
+    assert moved > 0
+    expected = data.copy()
+    for col in columns:
+        replace_with_thresholds_rounded(expected, col)
+    result = Winsorizer(sides="both", round_limits=True).fit_transform(data.copy(), columns)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_values_between_the_rounded_and_the_raw_limit_are_kept():
+    # q01 = 2, q99 = 4.12: limits -1.18 and 7.3, set to -1 and 7
+    winsorizer = Winsorizer(sides="both", round_limits=True).fit_quantiles(["x"], [[2.0], [4.12]])
+    low, up, low_value, up_value = winsorizer.caps()["x"]
+    assert (low_value, up_value) == (-1.0, 7.0)
+    dataframe = pd.DataFrame({"x": [-1.1, 7.2, -2.0, 9.0]})
+    assert winsorizer.transform(dataframe)["x"].tolist() == [-1.1, 7.2, -1.0, 7.0]
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_upper_side_matches_replace_with_thresholds(seed):
+    columns = ["Price", "Quantity"]
+    expected = frame(seed)
+    expected["Quantity"] = expected["Quantity"].astype("float64")  # the unrounded limit makes the column float
+    for col in columns:
+        replace_with_thresholds_upper(expected, col)
+    result = Winsorizer(sides="upper").fit_transform(frame(seed), columns)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_saved_limits_give_the_same_caps(tmp_path):
+    winsorizer = Winsorizer(sides="both", round_limits=True).fit(frame(), ["Price", "Quantity"])
+    winsorizer.save(str(tmp_path / "thresholds.json"))
+    loaded = Winsorizer.load(str(tmp_path / "thresholds.json"))
+    assert loaded.caps() == winsorizer.caps()
+    pd.testing.assert_frame_equal(loaded.transform(frame(3)), winsorizer.transform(frame(3)))
+
+
+@pytest.mark.parametrize("backend", ["polars", "duckdb"])
+def test_backends_cap_as_transform(backend):
+    pytest.importorskip(backend)
+    from helpers.backends import frame as backend_frame
+
+    columns = ["Price", "Quantity", "value"]
+    data, _ = between_limits(frame(0), columns)
+    winsorizer = Winsorizer(sides="both", round_limits=True).fit(data, columns)
+    engine = backend_frame(data, backend)
+    engine.clip(winsorizer)
+    pd.testing.assert_frame_equal(engine.to_pandas(columns), winsorizer.transform(data.copy())[columns],
+                                  check_dtype=False)